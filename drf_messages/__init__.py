@@ -11,5 +11,19 @@ __license__ = "BSD 3-Clause"
 
 logger = logging.getLogger("drf_messages")
 
+
+def batch(request=None, limit=None):
+    """
+    Write all messages added to the request storage in bulk, when the block (or view) is over.
+    e.g. "with drf_messages.batch(request):" or "@drf_messages.batch(limit=100)" for a view.
+    :param request: Request context, not required when decorating a view.
+    :param limit: Maximum number of messages written, the rest are collapsed into a summary message.
+    :return: MessageBatch object.
+    """
+    # pylint: disable=import-outside-toplevel
+    from drf_messages.storage import MessageBatch
+    return MessageBatch(request, limit)
+
+
 if django.VERSION < (3, 2):
     default_app_config = "drf_messages.apps.DrfMessagesConfig"
@@ -1,8 +1,126 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django import forms
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.contrib.messages.storage.base import LEVEL_TAGS
+from django.core.paginator import Paginator
+from django.http import QueryDict
+from django.db import connections
+from django.utils.functional import cached_property
 
-from drf_messages.models import Message, MessageTag
+from drf_messages.models import Message, MessageTag, Tag
+from drf_messages.routers import get_shard, get_shards, is_separate
+
+# Minimum estimated rows of a table for using the estimate instead of counting
+ESTIMATED_COUNT_THRESHOLD = 100000
+# Maximum number of tags listed by the tag filter, other tags are filtered using ?tag=<text>
+TAG_FILTER_MAX_LOOKUPS = 50
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using the table statistics as the count of large unfiltered querysets (PostgreSQL only),
+    to avoid counting all rows of the table on every page.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+        return super(EstimatedCountPaginator, self).count
+
+
+class LevelListFilter(admin.SimpleListFilter):
+    """Filter by the configured message levels, without querying the distinct levels"""
+    title = "level"
+    parameter_name = "level"
+
+    def lookups(self, request, model_admin):
+        return tuple(LEVEL_TAGS.items())
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(level=self.value())
+        return queryset
+
+
+class TagListFilter(admin.SimpleListFilter):
+    """
+    Filter by tag, using a semi-join without duplicating messages.
+    Only the first TAG_FILTER_MAX_LOOKUPS tags (by text) are listed, any tag is filtered using ?tag=<text>.
+    """
+    title = "tag"
+    parameter_name = "tag"
+
+    def lookups(self, request, model_admin):
+        texts = list(Tag.objects.order_by("text").values_list("text", flat=True)[:TAG_FILTER_MAX_LOOKUPS + 1])
+        if len(texts) > TAG_FILTER_MAX_LOOKUPS:
+            texts = texts[:TAG_FILTER_MAX_LOOKUPS]
+            self.title = f"tag (first {TAG_FILTER_MAX_LOOKUPS}, others using ?tag=)"
+        # a tag beyond the listed tags is shown when selected
+        if self.value() is not None and self.value() not in texts:
+            texts.append(self.value())
+        return tuple((text, text) for text in texts)
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.with_tag(self.value())
+        return queryset
+
+
+def get_search_user_id(search_term: str):
+    """
+    Parse the search term of the messages admin as a user ID.
+    :param search_term: Search term.
+    :return: Primary key of the user, or None when the term is not a valid user ID.
+    """
+    if not search_term:
+        return None
+    try:
+        return get_user_model()._meta.pk.to_python(search_term.strip())
+    except ValidationError:
+        return None
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """
+    Select the shard of listed messages (the queryset is routed by MessageAdmin.get_queryset).
+    A single shard is always listed, the first shard when none is selected.
+    """
+    title = "shard"
+    parameter_name = "shard"
+
+    def __init__(self, request, params, model, model_admin):
+        super(ShardListFilter, self).__init__(request, params, model, model_admin)
+        self.shard = model_admin.get_shard(request)
+
+    def lookups(self, request, model_admin):
+        return tuple((alias, alias) for alias in get_shards())
+
+    def has_output(self):
+        return len(get_shards()) > 1
+
+    def value(self):
+        return self.shard
+
+    def choices(self, changelist):
+        # messages of all shards can not be listed together, so there is no "All" choice
+        for lookup, title in self.lookup_choices:
+            yield {
+                "selected": self.value() == lookup,
+                "query_string": changelist.get_query_string({self.parameter_name: lookup}),
+                "display": title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset
 
 
 class MessageAdminForm(forms.ModelForm):
@@ -10,20 +128,98 @@ class MessageAdminForm(forms.ModelForm):
 
     class Meta:
         model = Message
-        fields = "__all__"
+        exclude = ("tags",)
 
 
 class MessageTagInline(admin.StackedInline):
     model = MessageTag
-    fields = ("text",)
+    fields = ("tag",)
+    raw_id_fields = ("tag",)
     extra = 0
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     form = MessageAdminForm
-    list_display = ("session", "message", "level_tag", "read_at")
-    list_filter = ("created", "extra_tags", "level", "read_at", "view", "session")
-    readonly_fields = ("session", "created")
+    list_display = ("user", "session_key", "message_text", "level_tag", "read_at")
+    list_filter = (ShardListFilter, "created", LevelListFilter, TagListFilter, "read_at")
+    list_select_related = ("user", "broadcast")
+    # messages are searched by the ID of their user, in the shard of the user (see get_search_results)
+    search_fields = ("user_id",)
+    raw_id_fields = ("user", "session", "broadcast")
+    readonly_fields = ("session", "created", "data")
+    date_hierarchy = "created"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ("mark_read", "purge")
 
     inlines = (MessageTagInline,)
+
+    @staticmethod
+    def get_shard(request):
+        """
+        Get the shard of the listed messages, also when editing a message from the list:
+        the shard selected by the shard filter, the shard of the user searched by ID, or the first shard.
+        :param request: Admin request.
+        :return: Database alias, or None when messages are not sharded.
+        """
+        shards = get_shards()
+        if len(shards) <= 1:
+            return None
+        params = request.GET
+        if "_changelist_filters" in params:
+            params = QueryDict(params["_changelist_filters"])
+        shard = params.get(ShardListFilter.parameter_name)
+        if shard in shards:
+            return shard
+        user_id = get_search_user_id(params.get(SEARCH_VAR, ""))
+        return shards[0] if user_id is None else get_shard(user_id)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        user_id = get_search_user_id(search_term)
+        if user_id is None:
+            self.message_user(request, f"Messages are searched by user ID, \"{search_term}\" is not a valid user ID.",
+                              messages.WARNING)
+            return queryset.none(), False
+        return queryset.filter(user_id=user_id), False
+
+    def changelist_view(self, request, extra_context=None):
+        shard = self.get_shard(request)
+        if shard is not None:
+            # messages of a single shard are listed, tell which one
+            extra_context = {"title": f"Select message to change (shard {shard})", **(extra_context or {})}
+        return super(MessageAdmin, self).changelist_view(request, extra_context=extra_context)
+
+    def get_queryset(self, request):
+        queryset = super(MessageAdmin, self).get_queryset(request).defer("data")
+        if is_separate():
+            # users are stored in another database, and can not be joined
+            queryset = queryset.prefetch_related("user")
+        shard = self.get_shard(request)
+        return queryset.using(shard) if shard else queryset
+
+    def get_list_select_related(self, request):
+        if is_separate():
+            return tuple(name for name in self.list_select_related if name != "user")
+        return self.list_select_related
+
+    def message_text(self, obj):
+        return obj.text
+
+    message_text.short_description = "message"
+
+    def mark_read(self, request, queryset):
+        count = queryset.mark_read()
+        self.message_user(request, f"Marked {count} messages as read.", messages.SUCCESS)
+
+    mark_read.short_description = "Mark selected messages as read"
+    mark_read.allowed_permissions = ("change",)
+
+    def purge(self, request, queryset):
+        count = queryset.purge()
+        self.message_user(request, f"Purged {count} messages.", messages.SUCCESS)
+
+    purge.short_description = "Purge selected messages"
+    purge.allowed_permissions = ("delete",)
@@ -1,7 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class DrfMessagesConfig(AppConfig):
     name = 'drf_messages'
     verbose_name = "DRF Messages"
     default_auto_field = 'django.db.models.BigAutoField'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel, unused-import
+        from drf_messages import signals
+        from drf_messages.search import install_search_backend
+        post_migrate.connect(install_search_backend, sender=self)
@@ -0,0 +1,129 @@
+from datetime import datetime
+from typing import Iterable, Optional
+
+import django
+from django.db import models, router, transaction
+from django.db.models import Exists, OuterRef
+
+from drf_messages import logger
+from drf_messages.conf import messages_settings
+from drf_messages.routers import group_by_shard
+from drf_messages.stats import MessageStats
+from drf_messages.tags import Tag
+
+# Number of broadcast recipients created in a single insert statement
+BROADCAST_BATCH_SIZE = 1000
+# Message references Broadcast, so drf_messages.models is imported where Message is used
+
+
+class BroadcastQuerySet(models.QuerySet):
+
+    def delete(self):
+        """
+        Delete broadcasts, after purging their recipient messages in batches (recipients are not cascaded).
+        :return: Number of objects deleted, and the number of deletions per object type
+        """
+        from drf_messages.models import Message  # pylint: disable=import-outside-toplevel
+        purged = Message.objects.using(self.db).filter(broadcast__in=self.values("pk")).purge()
+        count, deleted = super(BroadcastQuerySet, self).delete()
+        if purged:
+            deleted[Message._meta.label] = purged
+        return count + purged, deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class BroadcastManager(models.Manager):
+
+    def get_queryset(self) -> BroadcastQuerySet:
+        return BroadcastQuerySet(self.model, using=self._db, hints=self._hints)
+
+    def create_broadcast(self, users: Iterable, message: str, level: int, extra_tags=None,
+                         expires_at: Optional[datetime] = None, view: str = "") -> int:
+        """
+        Create a message for many users, storing its text and tags once.
+        Each user gets a recipient message row, holding the read state of the user.
+        :param users: User objects or primary keys of the recipients.
+        :param message: Text body of the message.
+        :param level: Integer describing the type of the message.
+        :param extra_tags: One or more tags to attach to the message.
+        :param expires_at: When the message expires (defaults to MESSAGES_DEFAULT_TTL from now).
+        :param view: Name of the view the message was submitted from.
+        :return: Number of recipients.
+        """
+        from drf_messages.models import Message  # pylint: disable=import-outside-toplevel
+        if not extra_tags:
+            extra_tags = []
+        elif not isinstance(extra_tags, (list, tuple, set)):
+            extra_tags = [extra_tags]
+        texts = list(dict.fromkeys(map(str, extra_tags)))
+        expires_at = Message.objects._get_expires_at(expires_at)
+        user_ids = list(dict.fromkeys(getattr(user, "pk", user) for user in users))
+
+        # the body is stored in the database (or shard) of each recipient
+        shards = group_by_shard(user_ids) if self._db is None else {self._db: user_ids}
+        for using, shard_user_ids in shards.items():
+            with transaction.atomic(using=using):
+                broadcast = self.db_manager(using).create(
+                    message=message, level=level, view=view, expires_at=expires_at)
+                # tags are attached in the given order (interned tags are ordered existing tags first)
+                tags = Tag.objects.intern(texts, using=using)
+                broadcast.tags.through.objects.using(using).bulk_create(
+                    broadcast.tags.through(broadcast=broadcast, tag_id=tags[text]) for text in texts)
+                recipients = Message.objects.using(using).bulk_create((
+                    Message(user_id=user_id, broadcast=broadcast, view=view, level=level, expires_at=expires_at)
+                    for user_id in shard_user_ids
+                ), batch_size=BROADCAST_BATCH_SIZE)
+                if messages_settings.MESSAGES_STATS:
+                    MessageStats.objects.record_created(recipients, using=using)
+                    MessageStats.objects.record_tagged([
+                        (recipient, text) for recipient in recipients for text in texts
+                    ], using=using)
+            if messages_settings.MESSAGES_MAX_UNREAD_PER_SCOPE:
+                for user_id in shard_user_ids:
+                    Message.objects.db_manager(using).enforce_unread_limit(user_id)
+
+        logger.debug(f"Broadcast message to {len(user_ids)} users")
+        return len(user_ids)
+
+    def delete_orphans(self) -> int:
+        """
+        Delete broadcasts without recipients (after their recipients were deleted).
+        :return: Number of broadcasts deleted
+        """
+        from drf_messages.models import Message  # pylint: disable=import-outside-toplevel
+        has_recipients = Exists(Message.objects.filter(broadcast=OuterRef("pk")))
+        if django.VERSION < (3, 0):
+            queryset = self.annotate(has_recipients=has_recipients).filter(has_recipients=False)
+        else:
+            queryset = self.filter(~has_recipients)
+        _, deleted = queryset.delete()
+        return deleted.get(self.model._meta.label, 0)
+
+
+class Broadcast(models.Model):
+    message = models.CharField(max_length=1024, blank=True, help_text="The actual text of the message.")
+    level = models.IntegerField(help_text="An integer describing the type of the message.")
+    view = models.CharField(max_length=64, blank=True, default="",
+                            help_text="The view where the message was submitted from.")
+    expires_at = models.DateTimeField(blank=True, null=True, default=None,
+                                      help_text="When the message expires and is no longer shown.")
+    created = models.DateTimeField(auto_now_add=True)
+
+    tags = models.ManyToManyField(Tag, related_name="broadcasts", blank=True)
+
+    objects = BroadcastManager()
+
+    def delete(self, using=None, keep_parents=False):
+        from drf_messages.models import Message  # pylint: disable=import-outside-toplevel
+        using = using or router.db_for_write(self.__class__, instance=self)
+        # recipients are not cascaded, purge them in batches without loading them
+        purged = Message.objects.using(using).filter(broadcast_id=self.pk).purge()
+        count, deleted = super(Broadcast, self).delete(using=using, keep_parents=keep_parents)
+        if purged:
+            deleted[Message._meta.label] = purged
+        return count + purged, deleted
+
+    def __str__(self):
+        return self.message
@@ -1,4 +1,6 @@
 from dataclasses import dataclass, fields
+from datetime import timedelta
+from typing import Optional, Sequence, Union
 
 from django.conf import settings
 from django.core.signals import setting_changed
@@ -13,6 +15,50 @@ class DrfMessagesSettings:
     MESSAGES_DELETE_READ: bool = False
     # Use request session for storing messages
     MESSAGES_USE_SESSIONS: bool = False
+    # Maximum unread messages kept per user (or session), older unread messages are marked read (0 for unlimited)
+    MESSAGES_MAX_UNREAD_PER_SCOPE: int = 0
+    # Number of messages created in a scope between checks of the unread messages limit
+    MESSAGES_MAX_UNREAD_CHECK_INTERVAL: int = 100
+    # Default time to live for new messages (in seconds or timedelta), None for messages that never expire
+    MESSAGES_DEFAULT_TTL: Optional[Union[int, timedelta]] = None
+    # Database alias used for reading messages (e.g. read replica), requires drf_messages.routers.MessagesRouter
+    MESSAGES_READ_DB: Optional[str] = None
+    # Database alias storing the messages tables (instead of the default database), requires the router
+    MESSAGES_DATABASE: Optional[str] = None
+    # Seconds reads of a user stick to the primary database after writing messages
+    MESSAGES_READ_DB_STICKY_SECONDS: int = 5
+    # Maximum number of messages loaded (and marked read) when iterating storage, None for unlimited
+    MESSAGES_MAX_DISPLAY: Optional[int] = None
+    # Maximum number of messages deleted in a single statement when purging messages
+    MESSAGES_PURGE_BATCH_SIZE: int = 1000
+    # Import path of the full-text search backend used by the messages search filter, None for a LIKE search
+    MESSAGES_SEARCH_BACKEND: Optional[str] = None
+    # Database aliases messages are sharded across by user, requires drf_messages.routers.MessagesRouter
+    MESSAGES_SHARDS: Sequence[str] = ()
+    # Write messages added to the storage in the background, using a queue consumed by worker threads
+    MESSAGES_ASYNC_WRITES: bool = False
+    # Maximum number of messages waiting in the queue to be written
+    MESSAGES_ASYNC_QUEUE_SIZE: int = 1000
+    # Number of worker threads writing queued messages
+    MESSAGES_ASYNC_WORKERS: int = 2
+    # Behavior when the queue is full, "block" until there is room or "sync" to write the message immediately
+    MESSAGES_ASYNC_BACKPRESSURE: str = "block"
+    # Maximum seconds reads wait for the queued messages of the same user to be written, 0 to never wait
+    MESSAGES_ASYNC_READ_WAIT_SECONDS: float = 1
+    # Keep per user counts of messages by level, tag and view in the MessageStats table
+    MESSAGES_STATS: bool = False
+    # Seconds messages marked read are buffered in memory, to mark them read using a single update, 0 to disable
+    MESSAGES_READ_BUFFER_SECONDS: float = 0
+    # Mark all messages of a user or session read by raising a single read mark, instead of updating each message
+    MESSAGES_READ_MARKS: bool = False
+    # Import path of the message store used by the storage and views
+    MESSAGES_STORE: str = "drf_messages.stores.DatabaseMessageStore"
+    # Maximum unread messages counted by the peek view, None for an exact count
+    MESSAGES_PEEK_COUNT_CAP: Optional[int] = None
+    # Size in bytes above which the JSON data of messages is compressed, None to never compress
+    MESSAGES_PAYLOAD_COMPRESS_SIZE: Optional[int] = 1024
+    # Mark unread messages read before showing them, so parallel requests of a user never show the same message
+    MESSAGES_CONSUME_EXACTLY_ONCE: bool = False
 
     @classmethod
     def build_settings(cls):
@@ -41,5 +87,9 @@ def _update_setting(setting=None, value=None, **kwargs):
     if not messages_settings:
         return
 
-    if setting in map(lambda f: f.name, fields(DrfMessagesSettings)):
-        messages_settings.update_setting(setting, value)
+    for field in fields(DrfMessagesSettings):
+        if field.name == setting:
+            if not hasattr(settings, setting):
+                # setting was removed (e.g. when leaving override_settings), restore the default
+                value = field.default
+            messages_settings.update_setting(setting, value)
@@ -0,0 +1,44 @@
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+from drf_messages.conf import messages_settings
+
+# Leading byte of a stored payload, telling whether its JSON is compressed
+RAW_PAYLOAD = b"\x00"
+COMPRESSED_PAYLOAD = b"\x01"
+
+
+class PayloadField(models.BinaryField):
+    """
+    JSON data stored as bytes, compressed using zlib when longer than MESSAGES_PAYLOAD_COMPRESS_SIZE.
+    Supported by all Django versions and databases (unlike JSONField), but can not be filtered by its content.
+    """
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        encoded = json.dumps(value, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+        compress_size = messages_settings.MESSAGES_PAYLOAD_COMPRESS_SIZE
+        if compress_size is not None and len(encoded) > compress_size:
+            return COMPRESSED_PAYLOAD + zlib.compress(encoded)
+        return RAW_PAYLOAD + encoded
+
+    def from_db_value(self, value, expression, connection):  # pylint: disable=unused-argument
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if isinstance(value, memoryview):
+            value = bytes(value)
+        if isinstance(value, bytes):
+            flag, encoded = value[:1], value[1:]
+            return json.loads(zlib.decompress(encoded) if flag == COMPRESSED_PAYLOAD else encoded)
+        if isinstance(value, str):
+            # serialized by value_to_string (e.g. fixtures)
+            return json.loads(value)
+        return value
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj), cls=DjangoJSONEncoder)
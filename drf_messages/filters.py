@@ -9,8 +9,8 @@ REVERSED_LEVEL_TAGS = {
 
 
 class MessageFilterSet(FilterSet):
-    unread = BooleanFilter(field_name="read_at", lookup_expr="isnull", label="unread")
-    extra_tags = CharFilter(field_name="extra_tags__text")
+    unread = BooleanFilter(method="filter_unread", label="unread")
+    extra_tags = CharFilter(method="filter_extra_tags")
     level_tag = TypedChoiceFilter(choices=zip(LEVEL_TAGS.values(), LEVEL_TAGS.values()), lookup_expr="gte",
                                   field_name="level", label="level_tag", coerce=lambda k: REVERSED_LEVEL_TAGS.get(k))
     read = DateTimeFromToRangeFilter(field_name="read_at", label="read")
@@ -19,3 +19,13 @@ class MessageFilterSet(FilterSet):
     class Meta:
         model = Message
         fields = ("unread", "level_tag", "level", "extra_tags", "view", "read", "created")
+
+    @staticmethod
+    def filter_unread(queryset, name, value):
+        """Filter unread (or read) messages"""
+        return queryset.unread() if value else queryset.read()
+
+    @staticmethod
+    def filter_extra_tags(queryset, name, value):
+        """Filter messages with a tag"""
+        return queryset.with_tag(value)
@@ -0,0 +1,173 @@
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Count, Max
+from django.http import HttpRequest
+
+from drf_messages.conf import messages_settings
+from drf_messages.models import SEVERITY_ORDERING, MessageQuerySet
+from drf_messages.search import get_search_backend
+from drf_messages.stores import DatabaseMessageStore
+
+# Plan lines of a full table scan, per database vendor (lines containing any of the exceptions are ignored)
+SCAN_PATTERNS = {
+    "sqlite": (("SCAN ",), ("USING INDEX", "USING COVERING INDEX", "USING INTEGER PRIMARY KEY", "VIRTUAL TABLE",
+                            "CONSTANT ROW")),
+    "postgresql": (("Seq Scan",), ()),
+    "mysql": (("'ALL'", " ALL "), ()),
+}
+# Plan lines of sorting or grouping using a temporary structure, per database vendor
+TEMP_PATTERNS = {
+    "sqlite": ("USE TEMP B-TREE",),
+    "postgresql": ("Sort Key", "HashAggregate"),
+    "mysql": ("Using temporary", "Using filesort"),
+}
+
+
+class Command(BaseCommand):
+    help = "Print the SQL and query plan of the hot queries of drf_messages, and flag queries not using an index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, default=1,
+                            help="Primary key of the user the queries are built for (default 1).")
+        parser.add_argument("--session", default="0" * 32,
+                            help="Session key the queries are built for.")
+        parser.add_argument("--use-sessions", action="store_true",
+                            help="Build the queries with MESSAGES_USE_SESSIONS enabled.")
+        parser.add_argument("--database", default=None,
+                            help="Database alias to explain the queries in (defaults to the routed database).")
+        parser.add_argument("--check", action="store_true",
+                            help="Exit with an error when a query scans a messages table without an index.")
+
+    def handle(self, *args, **options):
+        with use_sessions(options["use_sessions"]):
+            queries = self.get_queries(options["user"], options["session"])
+
+        failed = []
+        for name, queryset, sql, params in queries:
+            using = options["database"] or queryset.db
+            plan = explain(using, sql, params)
+            scans, temps = find_flags(connections[using].vendor, plan)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {name} ({using}) =="))
+            self.stdout.write(sql % tuple(repr(param) for param in params))
+            self.stdout.write("\n".join(plan))
+            for line in scans:
+                self.stdout.write(self.style.ERROR(f"SCAN: {line.strip()}"))
+            for line in temps:
+                self.stdout.write(self.style.WARNING(f"TEMP: {line.strip()}"))
+            self.stdout.write("")
+            if scans:
+                failed.append(name)
+
+        if options["check"] and failed:
+            raise CommandError(f"Queries scanning a table without an index: {', '.join(failed)}")
+
+    @staticmethod
+    def get_queries(user_id: int, session_key: str) -> List[Tuple[str, MessageQuerySet, str, tuple]]:
+        """
+        Build the hot querysets used by drf_messages for a user and session.
+        The storage querysets are built by the database message store, as loaded by DBStorage.
+        :param user_id: Primary key of the user.
+        :param session_key: Session key.
+        :return: List of query name, queryset, SQL and params.
+        """
+        request = HttpRequest()
+        request.user = get_user_model()(pk=user_id)
+        request.session = SessionBase(session_key)
+        store = DatabaseMessageStore(request)
+        unread = store.unread()
+
+        querysets = [
+            ("with_context", store.all()),
+            ("get_unread_queryset", unread),
+            ("storage iteration", store.get_message_rows(store.get_unread_slice())),
+            ("storage iteration tags", store.get_message_tags(unread.db, [0])),
+            ("storage iteration broadcast tags", store.get_broadcast_tags(unread.db, [0])),
+            ("tag filter", unread.with_tag("tag")),
+            # the capped peek counts the rows of this query (as a subquery)
+            ("peek capped count", unread.order_by().values("id")[:100]),
+            ("peek max_level", unread.order_by("-level").values_list("level", flat=True)[:1]),
+            ("storage top", store.get_message_rows(store.get_unread_slice(slice(10), SEVERITY_ORDERING))),
+        ]
+        try:
+            from drf_messages.filters import MessageFilterSet  # pylint: disable=import-outside-toplevel
+            querysets.append(("filterset level_tag", MessageFilterSet({"level_tag": "info"}, queryset=unread).qs))
+        except ImportError:
+            pass
+        if get_search_backend() is not None:
+            querysets.append(("search", get_search_backend().search(unread, ["message"])))
+
+        queries = [
+            (name, queryset, *queryset.query.get_compiler(queryset.db).as_sql())
+            for name, queryset in querysets
+        ]
+        queries.append(("peek", unread, *aggregate_sql(unread, count=Count("id"), max_level=Max("level"))))
+        return queries
+
+
+@contextmanager
+def use_sessions(enabled: bool):
+    """
+    Enable MESSAGES_USE_SESSIONS while building queries, restoring the configured value afterwards.
+    :param enabled: Whether to enable MESSAGES_USE_SESSIONS, the configured value is kept when False.
+    """
+    configured = messages_settings.MESSAGES_USE_SESSIONS
+    if enabled:
+        messages_settings.update_setting("MESSAGES_USE_SESSIONS", True)
+    try:
+        yield
+    finally:
+        messages_settings.update_setting("MESSAGES_USE_SESSIONS", configured)
+
+
+def aggregate_sql(queryset: MessageQuerySet, **aggregates) -> Tuple[str, tuple]:
+    """
+    Compile the SQL of aggregating a queryset (as done by QuerySet.aggregate), without executing it.
+    :param queryset: Queryset to aggregate.
+    :param aggregates: Aggregate expressions by name.
+    :return: SQL and params.
+    """
+    query = queryset.query.chain()
+    query.clear_ordering(True)
+    query.clear_select_clause()
+    for alias, aggregate in aggregates.items():
+        query.add_annotation(aggregate, alias, is_summary=True)
+    return query.get_compiler(queryset.db).as_sql()
+
+
+def explain(using: str, sql: str, params: tuple) -> List[str]:
+    """
+    Get the query plan of an SQL query.
+    On PostgreSQL, sequential scans are disabled, so indexes are planned even for small tables.
+    :param using: Database alias.
+    :param sql: SQL query.
+    :param params: Query params.
+    :return: Lines of the query plan.
+    """
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+def find_flags(vendor: str, plan: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Find the lines of a query plan scanning a table, or using a temporary structure.
+    :param vendor: Database vendor.
+    :param plan: Lines of the query plan.
+    :return: Scan lines and temporary structure lines.
+    """
+    patterns, exceptions = SCAN_PATTERNS.get(vendor, ((), ()))
+    scans = [
+        line for line in plan
+        if any(pattern in line for pattern in patterns) and not any(exception in line for exception in exceptions)
+    ]
+    temps = [line for line in plan if any(pattern in line for pattern in TEMP_PATTERNS.get(vendor, ()))]
+    return scans, temps
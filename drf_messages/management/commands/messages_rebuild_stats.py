@@ -0,0 +1,42 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from drf_messages.models import Message, MessageStats
+from drf_messages.routers import fan_out, get_shard
+
+
+def rebuild_stats(using: str, user_id=None) -> int:
+    """
+    Recount the messages statistics from the messages in a database.
+    :param using: Database alias.
+    :param user_id: Primary key of the only user to recount, defaults to all users.
+    :return: Count of statistics rows written.
+    """
+    messages = Message.objects.using(using).all()
+    stats = MessageStats.objects.using(using).all()
+    if user_id is not None:
+        messages = messages.filter(user_id=user_id)
+        stats = stats.filter(user_id=user_id)
+
+    deltas = MessageStats.objects.breakdown(messages)
+    with transaction.atomic(using=using):
+        stats.delete()
+        stats.bulk_create((
+            MessageStats(user_id=user, kind=kind, key=key, count=count, unread=unread)
+            for (user, kind, key), (count, unread) in deltas.items()
+        ), batch_size=1000)
+    return len(deltas)
+
+
+class Command(BaseCommand):
+    help = "Rebuild the messages statistics table from the messages (of all shards in parallel)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, default=None,
+                            help="Primary key of the only user to rebuild the statistics of.")
+
+    def handle(self, *args, **options):
+        user_id = options["user"]
+        shards = None if user_id is None else [get_shard(user_id)]
+        counts = fan_out(lambda alias: rebuild_stats(alias, user_id), shards)
+        self.stdout.write(f"Rebuilt {sum(counts.values())} message statistics.")
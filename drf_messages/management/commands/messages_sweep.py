@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+
+from drf_messages.models import Broadcast, Message, MessageReadMark
+from drf_messages.routers import fan_out
+
+
+class Command(BaseCommand):
+    help = "Delete expired messages from the database in batches, and broadcasts without recipients " \
+           "(from all shards in parallel). Optionally, delete messages of users and sessions that no longer exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Maximum number of messages deleted in a single statement "
+                                 "(defaults to MESSAGES_PURGE_BATCH_SIZE).")
+        parser.add_argument("--orphans", action="store_true",
+                            help="Also delete messages of users and sessions that no longer exist "
+                                 "(e.g. deleted using raw SQL).")
+
+    def handle(self, *args, **options):
+        counts = fan_out(lambda alias: Message.objects.db_manager(alias).delete_expired(options["batch_size"]))
+        self.stdout.write(f"Deleted {sum(counts.values())} expired messages.")
+        counts = fan_out(lambda alias: Broadcast.objects.db_manager(alias).delete_orphans())
+        self.stdout.write(f"Deleted {sum(counts.values())} broadcasts without recipients.")
+        if options["orphans"]:
+            counts = fan_out(lambda alias: Message.objects.db_manager(alias).delete_orphans(options["batch_size"]))
+            self.stdout.write(f"Deleted {sum(counts.values())} messages of deleted users and sessions.")
+            counts = fan_out(lambda alias: MessageReadMark.objects.db_manager(alias).delete_orphans(options["batch_size"]))
+            self.stdout.write(f"Deleted {sum(counts.values())} read marks of deleted users and sessions.")
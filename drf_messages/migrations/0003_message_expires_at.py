@@ -0,0 +1,19 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_messages', '0002_message_session_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, help_text='When the message expires and is no longer shown.', null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 12:47
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_session_key(apps, schema_editor):
+    """Normalize messages to be filtered by session key only"""
+    Message = apps.get_model("drf_messages", "Message")
+    messages = Message.objects.using(schema_editor.connection.alias)
+    # messages created before session_key was added
+    messages.filter(session_key__isnull=True, session__isnull=False).update(session_key=F("session_id"))
+    # messages without a session
+    messages.filter(session_key__isnull=True).update(session_key="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_messages', '0003_message_expires_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_session_key, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='session_key',
+            field=models.CharField(blank=True, default='', help_text='The session key where the message was submitted to.', max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['user', 'session_key', 'read_at'], name='drf_messages_user_session'),
+        ),
+    ]
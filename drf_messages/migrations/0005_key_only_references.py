@@ -0,0 +1,33 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 12:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sessions', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('drf_messages', '0004_message_session_key_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='session',
+            field=models.ForeignKey(blank=True, db_constraint=False, default=None, help_text='The session where the message was submitted to.', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='messages', to='sessions.session'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='messagetag',
+            name='message',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='extra_tags', to='drf_messages.message'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_messages', '0005_key_only_references'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
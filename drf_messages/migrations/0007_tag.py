@@ -0,0 +1,60 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 12:54
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+import django.db.models.deletion
+
+# Number of message tags converted per statement
+CHUNK_SIZE = 1000
+
+
+def normalize_tags(apps, schema_editor):
+    """Intern the text of existing message tags into the tags table, in chunks"""
+    Tag = apps.get_model("drf_messages", "Tag")
+    MessageTag = apps.get_model("drf_messages", "MessageTag")
+    using = schema_editor.connection.alias
+    tags = Tag.objects.using(using)
+    message_tags = MessageTag.objects.using(using)
+
+    texts = message_tags.order_by("text").values_list("text", flat=True).distinct().iterator()
+    while True:
+        chunk = [text for _, text in zip(range(CHUNK_SIZE), texts)]
+        if not chunk:
+            break
+        tags.bulk_create((Tag(text=text) for text in chunk), ignore_conflicts=True)
+
+    tag_id = Subquery(tags.filter(text=OuterRef("text")).values("pk")[:1])
+    while True:
+        batch = list(message_tags.filter(tag__isnull=True).values_list("pk", flat=True)[:CHUNK_SIZE])
+        if not batch:
+            break
+        message_tags.filter(pk__in=batch).update(tag=tag_id)
+
+    # a tag is attached to a message only once
+    duplicates = message_tags.values("message", "tag").annotate(count=Count("pk"), first=Min("pk")).filter(count__gt=1)
+    for duplicate in duplicates.iterator():
+        message_tags.filter(message=duplicate["message"], tag=duplicate["tag"]).exclude(pk=duplicate["first"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_messages', '0006_message_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(help_text='Custom tag for messages.', max_length=128, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='messagetag',
+            name='tag',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='message_tags', to='drf_messages.tag'),
+        ),
+        migrations.RunPython(normalize_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 12:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_messages', '0007_tag'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='messagetag',
+            name='text',
+        ),
+        migrations.AlterField(
+            model_name='messagetag',
+            name='tag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_tags', to='drf_messages.tag'),
+        ),
+        migrations.AddIndex(
+            model_name='messagetag',
+            index=models.Index(fields=['tag', 'message'], name='drf_messages_tag_message'),
+        ),
+        migrations.AddConstraint(
+            model_name='messagetag',
+            constraint=models.UniqueConstraint(fields=('message', 'tag'), name='drf_messages_message_tag'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='messages', through='drf_messages.MessageTag', to='drf_messages.Tag'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 13:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('drf_messages', '0008_message_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('level', 'Level'), ('tag', 'Tag'), ('view', 'View')], help_text='The message attribute counted.', max_length=8)),
+                ('key', models.CharField(help_text='The value of the message attribute counted.', max_length=128)),
+                ('count', models.IntegerField(default=0, help_text='Number of messages.')),
+                ('unread', models.IntegerField(default=0, help_text='Number of unread messages.')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='message_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'message stats',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='messagestats',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'key'), name='drf_messages_stats_key'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 13:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('drf_messages', '0009_messagestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageReadMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, default='', help_text='The session key of the scope, empty for all sessions.', max_length=40)),
+                ('last_read_id', models.BigIntegerField(help_text='Messages with this ID or lower are read.')),
+                ('read_at', models.DateTimeField(help_text='When the messages were marked read.')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='message_read_marks', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='messagereadmark',
+            constraint=models.UniqueConstraint(fields=('user', 'session_key'), name='drf_messages_read_mark_scope'),
+        ),
+    ]
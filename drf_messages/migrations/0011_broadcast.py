@@ -0,0 +1,32 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 13:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_messages', '0010_messagereadmark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.CharField(blank=True, help_text='The actual text of the message.', max_length=1024)),
+                ('level', models.IntegerField(help_text='An integer describing the type of the message.')),
+                ('view', models.CharField(blank=True, default='', help_text='The view where the message was submitted from.', max_length=64)),
+                ('expires_at', models.DateTimeField(blank=True, default=None, help_text='When the message expires and is no longer shown.', null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('tags', models.ManyToManyField(blank=True, related_name='broadcasts', to='drf_messages.Tag')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='broadcast',
+            field=models.ForeignKey(blank=True, db_constraint=False, default=None, help_text='The broadcast this message was sent by.', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='recipients', to='drf_messages.broadcast'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# pylint: disable=invalid-name, line-too-long
+# Generated by Django 3.2.25 on 2026-10-19 13:23
+
+from django.db import migrations
+import drf_messages.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_messages', '0012_message_unread_level_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='data',
+            field=drf_messages.fields.PayloadField(blank=True, default=None, help_text='Structured JSON data of the message (e.g. links and object IDs).', null=True),
+        ),
+    ]
@@ -1,17 +1,55 @@
-from typing import Sequence, Union
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple, Union
 
+import django
 from django.contrib.auth import get_user_model
 from django.contrib.messages import get_messages
 from django.contrib.messages.storage.base import LEVEL_TAGS, BaseStorage
 from django.contrib.messages.storage.base import Message as DjangoMessage
 from django.contrib.sessions.models import Session
-from django.db import models
-from django.db.models import Q
+from django.db import connections, models, router, transaction
+from django.db.models import Exists, Max, OuterRef, Q
 from django.utils import timezone
 from django.utils.functional import cached_property
 
 from drf_messages import logger
+from drf_messages.broadcasts import Broadcast
 from drf_messages.conf import messages_settings
+from drf_messages.fields import PayloadField
+from drf_messages.read_marks import MessageReadMark, unread_q
+from drf_messages.reads import get_pending_read_at, get_pending_reads, is_buffered, read_buffer
+from drf_messages.routers import pin_primary
+from drf_messages.stats import MessageStats
+from drf_messages.tags import MessageTag, Tag
+
+# Count of messages created in each (user, session key) scope since its last unread limit check
+_scope_inserts = defaultdict(int)
+_scope_inserts_lock = threading.Lock()
+_SCOPE_INSERTS_MAX_SIZE = 10000
+# Maximum number of unread messages evicted by a single statement when enforcing the unread limit of a scope
+UNREAD_EVICTION_BATCH_SIZE = 1000
+# Ordering of the most severe messages first (newest first per level), matching the unread severity index
+SEVERITY_ORDERING = ("-level", "-created")
+# Last read time used to claim messages, claims of this process use distinct read times
+_last_claim_time = None
+_claim_time_lock = threading.Lock()
+
+
+def claim_time() -> datetime:
+    """
+    Get the current time as the read time of claimed messages, distinct from the read times of previous claims.
+    The messages claimed by a call are the candidates marked read with its read time.
+    :return: Aware datetime
+    """
+    global _last_claim_time  # pylint: disable=global-statement
+    with _claim_time_lock:
+        now = timezone.now()
+        if _last_claim_time is not None and now <= _last_claim_time:
+            now = _last_claim_time + timedelta(microseconds=1)
+        _last_claim_time = now
+        return now
 
 
 class MessageQuerySet(models.QuerySet):
@@ -32,38 +70,321 @@ class MessageQuerySet(models.QuerySet):
         :return: Number of messages updated
         """
         # mark that messages have been read from the request
-        result = self.filter(read_at__isnull=True).update(read_at=timezone.now())
-        logger.debug(f"Marked {result} messages as read for session {self.request_context.session.session_key}")
-        if result > 0 and self.request_context:
-            storage = get_messages(self.request_context)
-            if isinstance(storage, BaseStorage):
-                storage.used = True
-            else:
-                logger.error("Message storage is None. Make sure to include "
-                             "\"django.contrib.messages.middleware.MessageMiddleware\" in the MIDDLEWARE setting.")
+        unread = self.filter(unread_q())
+        if messages_settings.MESSAGES_STATS:
+            using = self._db or router.db_for_write(self.model, **self._hints)
+            with transaction.atomic(using=using, savepoint=False):
+                MessageStats.objects.record_read(unread.using(using))
+                result = unread.using(using).update(read_at=timezone.now())
+        else:
+            result = unread.update(read_at=timezone.now())
+        pin_primary(self._hints.get("user_id"))
+        logger.debug(f"Marked {result} messages as read")
+        if result > 0:
+            self._set_used()
         return result
 
+    def buffer_read(self, ids: Sequence[int]) -> int:
+        """
+        Mark unread messages of the queryset user with these IDs as read.
+        When MESSAGES_READ_BUFFER_SECONDS is set, the IDs are buffered and marked read later, in a single update.
+        :param ids: Primary keys of unread messages.
+        :return: Number of messages marked (or buffered) as read
+        """
+        if not is_buffered():
+            return self.filter(pk__in=ids).mark_read()
+        if not ids:
+            return 0
+        read_buffer.add(self._db or router.db_for_write(self.model, **self._hints), self._hints.get("user_id"), ids)
+        self._set_used()
+        return len(ids)
+
+    def claim(self, key: slice = slice(None)) -> List[int]:
+        """
+        Mark unread messages as read, exactly once when parallel requests claim messages of the same user.
+        Rows locked by other requests are skipped where supported (SELECT ... FOR UPDATE SKIP LOCKED),
+        otherwise the candidates are marked read using a single conditional update, and the messages claimed
+        are the candidates marked read with the read time of this call.
+        :param key: Slice of the unread messages to claim.
+        :return: IDs of the messages marked read by this call, in the order of the queryset.
+        """
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        unread = self.using(using).filter(unread_q())
+        now = claim_time()
+        if connections[using].features.has_select_for_update_skip_locked:
+            with transaction.atomic(using=using):
+                claimed = list(unread.select_for_update(skip_locked=True).values_list("pk", flat=True)[key])
+                unread.filter(pk__in=claimed).update(read_at=now)
+                if messages_settings.MESSAGES_STATS:
+                    MessageStats.objects.record_claimed(self.model.objects.using(using).filter(pk__in=claimed))
+        else:
+            # candidates are selected before the transaction, so it starts with a write (avoiding SQLite deadlocks)
+            candidates = list(unread.values_list("pk", flat=True)[key])
+            with transaction.atomic(using=using):
+                unread.filter(pk__in=candidates).update(read_at=now)
+                stamped = set(self.model.objects.using(using).filter(pk__in=candidates, read_at=now)
+                              .values_list("pk", flat=True))
+                claimed = [pk for pk in candidates if pk in stamped]
+                if messages_settings.MESSAGES_STATS:
+                    MessageStats.objects.record_claimed(self.model.objects.using(using).filter(pk__in=claimed))
+        pin_primary(self._hints.get("user_id"))
+        logger.debug(f"Claimed {len(claimed)} messages as read")
+        if claimed:
+            self._set_used()
+        return claimed
+
+    def _set_used(self):
+        if not self.request_context:
+            return
+        storage = get_messages(self.request_context)
+        if isinstance(storage, BaseStorage):
+            storage.used = True
+        else:
+            logger.error("Message storage is None. Make sure to include "
+                         "\"django.contrib.messages.middleware.MessageMiddleware\" in the MIDDLEWARE setting.")
+
+    def unread(self) -> "MessageQuerySet":
+        """
+        Filter only unread messages, excluding messages with a buffered read.
+        :return: MessageQuerySet object
+        """
+        queryset = self.filter(read_at__isnull=True)
+        if messages_settings.MESSAGES_READ_MARKS:
+            queryset = queryset.filter(self._read_mark_q())
+        pending = get_pending_reads(self._hints.get("user_id"))
+        return queryset.exclude(pk__in=pending) if pending else queryset
+
+    def with_read_marks(self) -> "MessageQuerySet":
+        """
+        Annotate when messages below the read mark of their scope were marked read, see Message.read_time.
+        :return: MessageQuerySet object
+        """
+        if not messages_settings.MESSAGES_READ_MARKS:
+            return self
+        return self.annotate(read_mark_at=MessageReadMark.objects.marked_read_at())
+
+    def read(self) -> "MessageQuerySet":
+        """
+        Filter only read messages, including messages with a buffered read or below the read mark of their scope.
+        :return: MessageQuerySet object
+        """
+        if messages_settings.MESSAGES_READ_MARKS:
+            return self.exclude(pk__in=self.unread().values("pk"))
+        pending = get_pending_reads(self._hints.get("user_id"))
+        return self.filter(Q(read_at__isnull=False) | Q(pk__in=pending)) if pending else \
+            self.filter(read_at__isnull=False)
+
+    def _read_mark_q(self) -> Q:
+        """Condition of messages above the read mark of their scope, using the PK index for a request context"""
+        user_id = self._hints.get("user_id")
+        if self.request_context is None or user_id is None:
+            return Q(id__gt=MessageReadMark.objects.watermark())
+        marks = MessageReadMark.objects
+        if messages_settings.MESSAGES_USE_SESSIONS and hasattr(self.request_context, "session"):
+            session_key = self.request_context.session.session_key or ""
+            if session_key:
+                return Q(session_key="", id__gt=marks.get_watermark(user_id, "")) | \
+                    Q(session_key=session_key, id__gt=marks.get_watermark(user_id, session_key))
+        return Q(id__gt=marks.get_watermark(user_id, ""))
+
+    def mark_all_read(self, last_id: Optional[int] = None) -> int:
+        """
+        Mark all messages of the request context as read.
+        When MESSAGES_READ_MARKS, the read mark of the context scope is raised instead of updating the messages.
+        :param last_id: Primary key of the newest message read (defaults to the newest message of the context).
+        :return: Number of messages marked as read, or 1 when the read mark was raised
+        """
+        user_id = self._hints.get("user_id")
+        if not messages_settings.MESSAGES_READ_MARKS or self.request_context is None or user_id is None:
+            return (self if last_id is None else self.filter(pk__lte=last_id)).mark_read()
+        if last_id is None:
+            last_id = self.aggregate(last_id=Max("pk"))["last_id"]
+            if last_id is None:
+                return 0
+
+        session_keys = [""]
+        if messages_settings.MESSAGES_USE_SESSIONS and hasattr(self.request_context, "session") and \
+                self.request_context.session.session_key:
+            session_keys.append(self.request_context.session.session_key)
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        with transaction.atomic(using=using, savepoint=False):
+            if messages_settings.MESSAGES_STATS:
+                MessageStats.objects.record_read(self.using(using).filter(unread_q(), pk__lte=last_id))
+            MessageReadMark.objects.db_manager(using).advance(user_id, session_keys, last_id)
+        pin_primary(user_id)
+        self._set_used()
+        return 1
+
+    mark_all_read.alters_data = True
+    mark_all_read.queryset_only = True
+
+    def with_tag(self, text: str) -> "MessageQuerySet":
+        """
+        Filter messages having a tag, using an indexed semi-join (without duplicating messages).
+        :param text: Text of the tag.
+        :return: Filtered queryset
+        """
+        tagged = Exists(MessageTag.objects.filter(message=OuterRef("pk"), tag__text=text))
+        broadcast_tagged = Exists(Broadcast.tags.through.objects.filter(
+            broadcast_id=OuterRef("broadcast_id"), tag__text=text))
+        if django.VERSION < (3, 0):
+            return self.annotate(has_tag=tagged, has_broadcast_tag=broadcast_tagged) \
+                .filter(Q(has_tag=True) | Q(has_broadcast_tag=True))
+        return self.filter(tagged | broadcast_tagged)
+
+    def delete(self):
+        """
+        Delete messages and their tags using set-based statements, without loading the messages.
+        :return: Number of objects deleted and a dictionary with the number of deletions per object type.
+        """
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        with transaction.atomic(using=using, savepoint=False):
+            if messages_settings.MESSAGES_STATS:
+                MessageStats.objects.record_deleted(self.using(using))
+            tags = MessageTag.objects.using(using).filter(message__in=self.values("pk"))
+            tags_count, _ = tags.delete()
+            count, deleted = super(MessageQuerySet, self).delete()
+        if tags_count:
+            deleted[MessageTag._meta.label] = tags_count
+        return count + tags_count, deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def purge(self, batch_size: Optional[int] = None) -> int:
+        """
+        Delete messages and their tags in batches, so each statement and transaction is kept short.
+        :param batch_size: Maximum number of messages deleted at once (defaults to MESSAGES_PURGE_BATCH_SIZE).
+        :return: Number of messages deleted
+        """
+        batch_size = batch_size or messages_settings.MESSAGES_PURGE_BATCH_SIZE
+        queryset = self.order_by()
+        total = 0
+        while True:
+            batch = list(queryset.values_list("pk", flat=True)[:batch_size])
+            if not batch:
+                return total
+            _, deleted = queryset.filter(pk__in=batch).delete()
+            total += deleted.get(self.model._meta.label, 0)
+
+    purge.alters_data = True
+    purge.queryset_only = True
+
 
 class MessageManager(models.Manager):
 
+    def get_queryset(self) -> MessageQuerySet:
+        return MessageQuerySet(self.model, using=self._db, hints=self._hints)
+
     def with_context(self, request):
         """
         Filter only messages for a request context:
         When MESSAGES_USE_SESSIONS, messages for that session or without a session specified,
         otherwise messages from all sessions.
         """
-        queryset = MessageQuerySet(self.model, using=self._db, request_context=request).filter(
-            user=request.user if hasattr(request, "user") and request.user.is_authenticated else None
+        user = request.user if hasattr(request, "user") and request.user.is_authenticated else None
+        # the user hint is used by the router to route reads of recently written messages
+        hints = {**self._hints, "user_id": getattr(user, "pk", None)}
+        queryset = MessageQuerySet(self.model, using=self._db, hints=hints, request_context=request).filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+            user=user,
         )
         if messages_settings.MESSAGES_USE_SESSIONS and hasattr(request, "session"):
-            return queryset.filter(
-                Q(session_key=request.session.session_key)
-                | Q(session__session_key=request.session.session_key)
-                | Q(session__isnull=True)
-            )
+            # messages without a session are stored with an empty session key, so a single index lookup is needed
+            return queryset.filter(session_key__in=(request.session.session_key or "", ""))
         else:
             return queryset
 
+    def enforce_unread_limit(self, user, session_key="", created=1) -> int:
+        """
+        Mark as read the oldest unread messages of a user (or session) exceeding MESSAGES_MAX_UNREAD_PER_SCOPE.
+        The check is amortized, and runs once every MESSAGES_MAX_UNREAD_CHECK_INTERVAL messages created in a scope.
+        Each check evicts at most UNREAD_EVICTION_BATCH_SIZE messages, a larger backlog is evicted by the next checks.
+        :param user: User object (from settings.AUTH_USER_MODEL).
+        :param session_key: Session key of the scope, used only when MESSAGES_USE_SESSIONS.
+        :param created: Number of messages that were just created in that scope.
+        :return: Number of messages marked as read
+        """
+        limit = messages_settings.MESSAGES_MAX_UNREAD_PER_SCOPE
+        if not limit:
+            return 0
+        if not messages_settings.MESSAGES_USE_SESSIONS:
+            session_key = ""
+
+        scope = (getattr(user, "pk", user), session_key)
+        interval = max(messages_settings.MESSAGES_MAX_UNREAD_CHECK_INTERVAL, 1)
+        with _scope_inserts_lock:
+            _scope_inserts[scope] += created
+            if _scope_inserts[scope] < interval:
+                return 0
+            del _scope_inserts[scope]
+            if len(_scope_inserts) > _SCOPE_INSERTS_MAX_SIZE:
+                _scope_inserts.clear()
+
+        queryset = self.filter(user=user, read_at__isnull=True)
+        if messages_settings.MESSAGES_USE_SESSIONS:
+            queryset = queryset.filter(session_key=session_key)
+        # find the newest message exceeding the limit, everything older than it is evicted
+        cutoff = next(iter(queryset.order_by("-pk").values_list("pk", flat=True)[limit:limit + 1]), None)
+        if cutoff is None:
+            return 0
+        # bound the statement to the oldest UNREAD_EVICTION_BATCH_SIZE messages of the evicted range
+        upper = next(iter(queryset.filter(pk__lte=cutoff).order_by("pk").values_list("pk", flat=True)
+                          [UNREAD_EVICTION_BATCH_SIZE - 1:UNREAD_EVICTION_BATCH_SIZE]), cutoff)
+
+        result = queryset.filter(pk__lte=upper).mark_read()
+        if upper != cutoff:
+            # more messages exceed the limit, they are evicted by the check of the next message created in the scope
+            with _scope_inserts_lock:
+                _scope_inserts[scope] = interval
+        logger.info(f"Evicted {result} unread messages exceeding the limit of {limit} for user {scope[0]}")
+        return result
+
+    def delete_expired(self, batch_size: Optional[int] = None) -> int:
+        """
+        Delete expired messages in batches, to keep each delete statement short.
+        :param batch_size: Maximum number of messages deleted at once (defaults to MESSAGES_PURGE_BATCH_SIZE).
+        :return: Number of messages deleted
+        """
+        total = self.filter(expires_at__lte=timezone.now()).purge(batch_size)
+        logger.info(f"Deleted {total} expired messages")
+        return total
+
+    def delete_orphans(self, batch_size: Optional[int] = None) -> int:
+        """
+        Delete messages of users and sessions that no longer exist, as messages reference them by key only
+        (e.g. deleted by raw SQL, skipping the pre_delete signals purging their messages).
+        Users and sessions are looked up in their own database, for a batch of referenced keys at a time.
+        :param batch_size: Maximum number of keys looked up, and messages deleted, at once
+            (defaults to MESSAGES_PURGE_BATCH_SIZE).
+        :return: Number of messages deleted
+        """
+        batch_size = batch_size or messages_settings.MESSAGES_PURGE_BATCH_SIZE
+        total = 0
+        for field, model in (("user_id", get_user_model()), ("session_id", Session)):
+            keys = self.exclude(**{field: None}).order_by(field).values_list(field, flat=True).distinct()
+            batch = list(keys[:batch_size])
+            while batch:
+                existing = set(model._default_manager.filter(pk__in=batch).values_list("pk", flat=True))
+                missing = [key for key in batch if key not in existing]
+                if missing:
+                    total += self.filter(**{f"{field}__in": missing}).purge(batch_size)
+                batch = list(keys.filter(**{f"{field}__gt": batch[-1]})[:batch_size])
+        logger.info(f"Deleted {total} messages of deleted users and sessions")
+        return total
+
+    @staticmethod
+    def _get_expires_at(expires_at: Optional[datetime]) -> Optional[datetime]:
+        """
+        Get expiry time for a new message, fallback to the MESSAGES_DEFAULT_TTL.
+        :param expires_at: Explicit expiry time, or None for the default.
+        :return: Expiry time or None when the message never expires.
+        """
+        ttl = messages_settings.MESSAGES_DEFAULT_TTL
+        if expires_at is None and ttl is not None:
+            return timezone.now() + (ttl if isinstance(ttl, timedelta) else timedelta(seconds=ttl))
+        return expires_at
+
     def _create_extra_tags(self, message, extra_tags):
         """
         Create message tags from list or string.
@@ -71,85 +392,129 @@ class MessageManager(models.Manager):
         :param extra_tags: String or List of string tags.
         :return: None
         """
-        if isinstance(extra_tags, (list, tuple, set)):
-            MessageTag.objects.bulk_create((
-                MessageTag(message=message, text=str(tag))
-                for tag in extra_tags
-            ))
-        else:
-            MessageTag.objects.create(message=message, text=str(extra_tags))
+        if not isinstance(extra_tags, (list, tuple, set)):
+            extra_tags = [extra_tags]
+        MessageTag.objects.create_tags(message, extra_tags, new=True)
 
-    def create_message(self, request, message, level, extra_tags=None):
+    def bulk_create_messages(self, messages: Sequence[Tuple["Message", Sequence[str]]]) -> List["Message"]:
+        """
+        Create messages with their extra tags in bulk, using a single transaction.
+        Tagged messages are created one by one when the database cannot return the IDs of bulk inserted rows.
+        :param messages: Pairs of unsaved message object and the text of its tags.
+        :return: Created message objects.
+        """
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        features = connections[using].features
+        # renamed in Django 3.0
+        can_return_rows = getattr(features, "can_return_rows_from_bulk_insert",
+                                  getattr(features, "can_return_ids_from_bulk_insert", False))
+        with transaction.atomic(using=using, savepoint=False):
+            if can_return_rows:
+                self.get_queryset().using(using).bulk_create([message for message, _ in messages])
+            else:
+                # keep the creation order, by bulk creating the untagged messages between tagged messages
+                untagged = []
+                for message, tags in messages:
+                    if not tags:
+                        untagged.append(message)
+                        continue
+                    self.get_queryset().using(using).bulk_create(untagged)
+                    untagged = []
+                    message.save(force_insert=True, using=using)
+                self.get_queryset().using(using).bulk_create(untagged)
+            MessageTag.objects.bulk_create_tags([pair for pair in messages if pair[1]], using=using, new=True)
+            if messages_settings.MESSAGES_STATS:
+                MessageStats.objects.record_created([message for message, _ in messages], using=using)
+
+        scopes = defaultdict(int)
+        for message, _ in messages:
+            scopes[(message.user_id, message.session_key)] += 1
+        manager = self.db_manager(using)
+        for (user_id, session_key), created in scopes.items():
+            manager.enforce_unread_limit(user_id, session_key, created)
+            pin_primary(user_id)
+        return [message for message, _ in messages]
+
+    def create_message(self, request, message, level, extra_tags=None, expires_at=None, data=None):
         """
         Create a new message to the database.
         :param request: Request context.
         :param message: Text body of the message.
         :param level: Integer describing the type of the message.
         :param extra_tags: One or more tags to attach to the message.
+        :param expires_at: When the message expires (defaults to MESSAGES_DEFAULT_TTL from now).
+        :param data: JSON serializable data of the message (e.g. links and object IDs).
         :return: Message object.
         """
         # extract session
         if hasattr(request, "session"):
-            session_key = request.session.session_key
+            session_key = request.session.session_key or ""
         else:
-            session_key = None
+            session_key = ""
 
         session = Session.objects.filter(session_key=session_key).first()
 
-        # create message
-        message_obj = self.create(
+        # create message, the user hint routes it to the user's shard
+        manager = self.db_manager(hints={**self._hints, "user_id": request.user.pk})
+        message_obj = manager.create(
             user=request.user,
             session=session,
             session_key=session_key,
             view=request.resolver_match.view_name if request.resolver_match else '',
             message=message,
             level=level,
+            expires_at=self._get_expires_at(expires_at),
+            data=data,
         )
         # create extra tags
         if extra_tags:
             self._create_extra_tags(message_obj, extra_tags)
+        if messages_settings.MESSAGES_STATS:
+            MessageStats.objects.record_created([message_obj], using=message_obj._state.db)
 
+        manager.enforce_unread_limit(message_obj.user, session_key)
+        pin_primary(message_obj.user_id)
         return message_obj
 
-    def create_user_message(self, user, message, level, extra_tags=None):
+    def create_user_message(self, user, message, level, extra_tags=None, expires_at=None, data=None):
         """
         Create a new message to the database.
         :param user: User object (from settings.AUTH_USER_MODEL).
         :param message: Text body of the message.
         :param level: Integer describing the type of the message.
         :param extra_tags: One or more tags to attach to the message.
+        :param expires_at: When the message expires (defaults to MESSAGES_DEFAULT_TTL from now).
+        :param data: JSON serializable data of the message (e.g. links and object IDs).
         :return: Message object.
         """
-        # create message
-        message_obj = self.create(
+        # create message, the user hint routes it to the user's shard
+        manager = self.db_manager(hints={**self._hints, "user_id": getattr(user, "pk", user)})
+        message_obj = manager.create(
             user=user,
             message=message,
             level=level,
+            expires_at=self._get_expires_at(expires_at),
+            data=data,
         )
         # create extra tags
         if extra_tags:
             self._create_extra_tags(message_obj, extra_tags)
+        if messages_settings.MESSAGES_STATS:
+            MessageStats.objects.record_created([message_obj], using=message_obj._state.db)
 
+        manager.enforce_unread_limit(user)
+        pin_primary(message_obj.user_id)
         return message_obj
 
 
-class MessageTag(models.Model):
-    message = models.ForeignKey("drf_messages.Message", on_delete=models.CASCADE, related_name="extra_tags")
-
-    text = models.CharField(max_length=128, help_text="Custom tags for the message.")
-
-    def __str__(self):
-        return self.text
-
-    def __repr__(self):
-        return self.text
-
-
 class Message(models.Model):
-    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="messages")
-    session = models.ForeignKey(Session, on_delete=models.CASCADE, null=True, blank=True, default=None,
-                                related_name="messages", help_text="The session where the message was submitted to.")
-    session_key = models.CharField(max_length=40, null=True, blank=True,
+    # messages are purged in batches when the user or session is deleted (see drf_messages.signals)
+    user = models.ForeignKey(get_user_model(), on_delete=models.DO_NOTHING, db_constraint=False,
+                             related_name="messages")
+    session = models.ForeignKey(Session, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                                default=None, related_name="messages",
+                                help_text="The session where the message was submitted to.")
+    session_key = models.CharField(max_length=40, blank=True, default="",
                                    help_text="The session key where the message was submitted to.")
     view = models.CharField(max_length=64, blank=True, default="",
                             help_text="The view where the message was submitted from.")
@@ -158,13 +523,30 @@ class Message(models.Model):
     level = models.IntegerField(help_text="An integer describing the type of the message.")
 
     read_at = models.DateTimeField(blank=True, null=True, default=None, help_text="When the message was read.")
+    expires_at = models.DateTimeField(blank=True, null=True, default=None, db_index=True,
+                                      help_text="When the message expires and is no longer shown.")
 
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    tags = models.ManyToManyField(Tag, through=MessageTag, related_name="messages", blank=True)
+    # recipients of a broadcast store its text and tags in the broadcast, and only their read state
+    # recipients are purged in batches when the broadcast is deleted (see Broadcast.delete)
+    broadcast = models.ForeignKey(Broadcast, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                                  default=None, related_name="recipients",
+                                  help_text="The broadcast this message was sent by.")
+    # deferred when listing messages, see MessagesViewSet.get_queryset
+    data = PayloadField(null=True, blank=True, default=None,
+                        help_text="Structured JSON data of the message (e.g. links and object IDs).")
 
     objects = MessageManager()
 
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            models.Index(fields=["user", "session_key", "read_at"], name="drf_messages_user_session"),
+            # most severe unread messages of a user (and their highest level), without scanning all unread messages
+            models.Index(fields=["user", "read_at", "level", "created"], name="drf_messages_unread_severity"),
+        ]
 
     @cached_property
     def level_tag(self) -> str:
@@ -176,8 +558,15 @@ class Message(models.Model):
         Mark as read now.
         """
         # mark that messages have been read from the request
-        self.read_at = timezone.now()
-        self.save()
+        if is_buffered() and self.read_at is None:
+            read_buffer.add(router.db_for_write(self.__class__, instance=self), self.user_id, [self.pk])
+        else:
+            if messages_settings.MESSAGES_STATS and self.read_at is None:
+                using = router.db_for_write(self.__class__, instance=self)
+                MessageStats.objects.record_read(Message.objects.using(using).filter(unread_q(), pk=self.pk))
+            self.read_at = timezone.now()
+            self.save()
+            pin_primary(self.user_id)
         logger.debug(f"Marked 1 message as read for session {request.session.session_key}")
         storage = get_messages(request)
         if isinstance(storage, BaseStorage):
@@ -186,34 +575,62 @@ class Message(models.Model):
             logger.error("Message storage is None. Make sure to include "
                          "\"django.contrib.messages.middleware.MessageMiddleware\" in the MIDDLEWARE setting.")
 
+    @property
+    def read_time(self) -> Optional[datetime]:
+        """
+        When the message was read, individually, by the read mark of its scope (see with_read_marks),
+        or by a read buffered by this process.
+        """
+        return self.read_at or getattr(self, "read_mark_at", None) or get_pending_read_at(self.user_id, self.pk)
+
+    @property
+    def text(self) -> str:
+        """Text of the message, or of its broadcast"""
+        return self.broadcast.message if self.broadcast_id else self.message
+
+    @property
+    def all_tags(self):
+        """Tags manager of the message, or of its broadcast (a manager, so prefetched tags are used)"""
+        return self.broadcast.tags if self.broadcast_id else self.tags
+
     def get_django_message(self) -> DjangoMessage:
         """
         Parse drf_messages message to django message format.
         :return: django.contrib.messages.storage.base.Message instance
         """
+        source = self.broadcast if self.broadcast_id else self
+        if "tags" in getattr(source, "_prefetched_objects_cache", {}):
+            # use prefetched tags, instead of a query per message
+            texts = [tag.text for tag in source.tags.all()]
+        else:
+            texts = source.tags.through.objects.using(source._state.db) \
+                .filter(**{source.tags.source_field_name: source}).order_by("pk").values_list("tag__text", flat=True)
         return DjangoMessage(
-            message=self.message,
+            message=self.text,
             level=self.level,
-            extra_tags=" ".join(self.extra_tags.values_list("text", flat=True))
+            extra_tags=" ".join(texts)
         )
 
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            if messages_settings.MESSAGES_STATS:
+                MessageStats.objects.record_deleted(Message.objects.using(using).filter(pk=self.pk))
+            tags_count, _ = self.extra_tags.using(using).delete()
+            count, deleted = super(Message, self).delete(using=using, keep_parents=keep_parents)
+        if tags_count:
+            deleted[MessageTag._meta.label] = tags_count
+        return count + tags_count, deleted
+
     def add_tag(self, text: Union[str, Sequence[str]]) -> None:
         """
         Add extra tags to message.
         :param text: string or sequence of strings (e.g. add_tag(f"tag {i}" for i in range(10)))
         """
-        if isinstance(text, str):
-            MessageTag.objects.create(text=text, message=self)
-        else:
-            MessageTag.objects.bulk_create(
-                MessageTag(
-                    text=t,
-                    message=self,
-                ) for t in text
-            )
+        MessageTag.objects.create_tags(self, [text] if isinstance(text, str) else text)
 
     def __str__(self):
-        return self.message
+        return self.text
 
     def __repr__(self):
-        return self.message
+        return self.text
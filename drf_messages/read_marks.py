@@ -0,0 +1,126 @@
+from typing import Optional, Sequence
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from drf_messages.conf import messages_settings
+
+
+def unread_q(prefix: str = "") -> Q:
+    """
+    Condition of messages not marked as read, individually or by the read mark of their scope.
+    :param prefix: Lookup prefix of the message (e.g. "message__" for message tags).
+    :return: Q object
+    """
+    condition = Q(**{f"{prefix}read_at__isnull": True})
+    if messages_settings.MESSAGES_READ_MARKS:
+        condition &= Q(**{f"{prefix}id__gt": MessageReadMark.objects.watermark(prefix)})
+    return condition
+
+
+class MessageReadMarkManager(models.Manager):
+
+    @staticmethod
+    def scope_marks(prefix: str = "") -> models.QuerySet:
+        """
+        Read marks of the scope of each message (correlated to the outer query).
+        :param prefix: Lookup prefix of the message in the outer query (e.g. "message__" for message tags).
+        :return: QuerySet of MessageReadMark, a single mark at most.
+        """
+        marks = MessageReadMark.objects.filter(user_id=OuterRef(f"{prefix}user_id"))
+        if messages_settings.MESSAGES_USE_SESSIONS:
+            return marks.filter(session_key=OuterRef(f"{prefix}session_key"))
+        return marks.filter(session_key="")
+
+    def watermark(self, prefix: str = "") -> Coalesce:
+        """
+        Expression of the read mark of the scope of each message (correlated to the outer query).
+        :param prefix: Lookup prefix of the message in the outer query (e.g. "message__" for message tags).
+        :return: Expression of the last read message ID, 0 when there is no read mark.
+        """
+        marks = self.scope_marks(prefix)
+        return Coalesce(Subquery(marks.values("last_read_id")[:1]), 0, output_field=models.BigIntegerField())
+
+    def marked_read_at(self, prefix: str = "") -> Subquery:
+        """
+        Expression of when each message was marked read by the read mark of its scope (correlated to the outer query).
+        That is when the read mark was last raised, messages read individually keep their own ``read_at``.
+        :param prefix: Lookup prefix of the message in the outer query (e.g. "message__" for message tags).
+        :return: Expression of the read time of the read mark, null when the message is above it.
+        """
+        marks = self.scope_marks(prefix).filter(last_read_id__gte=OuterRef(f"{prefix}id"))
+        return Subquery(marks.values("read_at")[:1])
+
+    @staticmethod
+    def get_watermark(user_id, session_key: str) -> Coalesce:
+        """
+        Expression of the read mark of a scope, evaluated once per query.
+        :param user_id: Primary key of the user.
+        :param session_key: Session key of the scope, empty for all sessions.
+        :return: Expression of the last read message ID, 0 when there is no read mark.
+        """
+        marks = MessageReadMark.objects.filter(user_id=user_id, session_key=session_key)
+        return Coalesce(Subquery(marks.values("last_read_id")[:1]), 0, output_field=models.BigIntegerField())
+
+    def delete_orphans(self, batch_size: Optional[int] = None) -> int:
+        """
+        Delete read marks of users and sessions that no longer exist, as read marks reference them by key only.
+        :param batch_size: Maximum number of keys looked up, and read marks deleted, at once
+            (defaults to MESSAGES_PURGE_BATCH_SIZE).
+        :return: Number of read marks deleted
+        """
+        batch_size = batch_size or messages_settings.MESSAGES_PURGE_BATCH_SIZE
+        total = 0
+        # read marks of all sessions of a user have an empty session key
+        for field, model, blank in (("user_id", get_user_model(), None), ("session_key", Session, "")):
+            keys = self.exclude(**{field: blank}).order_by(field).values_list(field, flat=True).distinct()
+            batch = list(keys[:batch_size])
+            while batch:
+                existing = set(model._default_manager.filter(pk__in=batch).values_list("pk", flat=True))
+                missing = [key for key in batch if key not in existing]
+                if missing:
+                    total += self.filter(**{f"{field}__in": missing}).delete()[0]
+                batch = list(keys.filter(**{f"{field}__gt": batch[-1]})[:batch_size])
+        return total
+
+    def advance(self, user_id, session_keys: Sequence[str], last_id: int) -> None:
+        """
+        Raise the read marks of the scopes of a user, using a single row upsert per scope.
+        :param user_id: Primary key of the user.
+        :param session_keys: Session keys of the scopes, empty for all sessions.
+        :param last_id: Primary key of the newest message read.
+        """
+        now = timezone.now()
+        for session_key in session_keys:
+            marks = self.filter(user_id=user_id, session_key=session_key)
+            if marks.update(last_read_id=Greatest(F("last_read_id"), last_id), read_at=now):
+                continue
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(user_id=user_id, session_key=session_key, last_read_id=last_id, read_at=now)
+            except IntegrityError:
+                # created concurrently
+                marks.update(last_read_id=Greatest(F("last_read_id"), last_id), read_at=now)
+
+
+class MessageReadMark(models.Model):
+    user = models.ForeignKey(get_user_model(), on_delete=models.DO_NOTHING, db_constraint=False,
+                             related_name="message_read_marks")
+    session_key = models.CharField(max_length=40, blank=True, default="",
+                                   help_text="The session key of the scope, empty for all sessions.")
+    last_read_id = models.BigIntegerField(help_text="Messages with this ID or lower are read.")
+    read_at = models.DateTimeField(help_text="When the messages were marked read.")
+
+    objects = MessageReadMarkManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "session_key"], name="drf_messages_read_mark_scope"),
+        ]
+
+    def __str__(self):
+        return f"Read up to {self.last_read_id}"
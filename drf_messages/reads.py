@@ -0,0 +1,154 @@
+import atexit
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from django.utils import timezone
+
+from drf_messages import logger
+from drf_messages.conf import messages_settings
+from drf_messages.routers import pin_primary
+
+# Maximum number of buffered message IDs, the buffer is flushed when it is reached
+READ_BUFFER_MAX_SIZE = 1000
+
+
+class ReadBuffer:
+    """
+    IDs of messages read by this process, waiting to be marked as read in the database.
+    Reads of all requests within MESSAGES_READ_BUFFER_SECONDS are coalesced into a single update per database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # when messages were read by their IDs, per database alias and user ID
+        self.ids: Dict[Tuple[str, object], Dict[int, datetime]] = defaultdict(dict)
+        self.size = 0
+        self.started: Optional[float] = None
+
+    def add(self, using: str, user_id, ids) -> None:
+        """
+        Buffer messages of a user as read, flushing the buffer when it reaches READ_BUFFER_MAX_SIZE messages.
+        :param using: Database alias of the messages.
+        :param user_id: Primary key of the user of the messages.
+        :param ids: Primary keys of the read messages.
+        """
+        now = timezone.now()
+        with self.lock:
+            pending = self.ids[(using, user_id)]
+            self.size -= len(pending)
+            for pk in ids:
+                pending.setdefault(pk, now)
+            self.size += len(pending)
+            if self.started is None:
+                self.started = time.monotonic()
+            full = self.size >= READ_BUFFER_MAX_SIZE
+        if full:
+            self.flush()
+
+    def pending(self, user_id) -> Set[int]:
+        """
+        Get the IDs of buffered messages of a user.
+        :param user_id: Primary key of the user.
+        :return: Set of message IDs.
+        """
+        with self.lock:
+            return {pk for (_, user), ids in self.ids.items() if user == user_id for pk in ids}
+
+    def read_at(self, user_id, pk: int) -> Optional[datetime]:
+        """
+        Get when a buffered message of a user was read.
+        :param user_id: Primary key of the user.
+        :param pk: Primary key of the message.
+        :return: Read time, or None when the message is not buffered.
+        """
+        with self.lock:
+            return next((ids[pk] for (_, user), ids in self.ids.items() if user == user_id and pk in ids), None)
+
+    def is_due(self) -> bool:
+        """
+        Check whether the buffer should be flushed.
+        :return: True when the buffer is full, or the oldest read is older than MESSAGES_READ_BUFFER_SECONDS.
+        """
+        if self.size >= READ_BUFFER_MAX_SIZE:
+            return True
+        return self.started is not None and \
+            time.monotonic() - self.started >= messages_settings.MESSAGES_READ_BUFFER_SECONDS
+
+    def flush(self) -> int:
+        """
+        Mark all buffered messages as read, using a single update per database.
+        :return: Number of messages marked as read.
+        """
+        from drf_messages.models import Message  # pylint: disable=import-outside-toplevel
+
+        with self.lock:
+            buffered, self.ids, self.size, self.started = self.ids, defaultdict(dict), 0, None
+
+        databases = defaultdict(set)
+        for (using, user_id), ids in buffered.items():
+            databases[using].update(ids)
+        result = 0
+        for using, ids in databases.items():
+            result += Message.objects.using(using).filter(pk__in=ids).mark_read()
+        for _, user_id in buffered:
+            pin_primary(user_id)
+        if result:
+            logger.debug(f"Flushed {result} buffered read messages")
+        return result
+
+
+read_buffer = ReadBuffer()
+
+
+def is_buffered() -> bool:
+    """
+    Check whether marking messages as read is buffered.
+    :return: True when MESSAGES_READ_BUFFER_SECONDS is set.
+    """
+    return bool(messages_settings.MESSAGES_READ_BUFFER_SECONDS)
+
+
+def get_pending_reads(user_id) -> Set[int]:
+    """
+    Get the IDs of messages of a user read by this process, but not yet marked as read in the database.
+    :param user_id: Primary key of the user.
+    :return: Set of message IDs.
+    """
+    if not read_buffer.size:
+        return set()
+    return read_buffer.pending(user_id)
+
+
+def get_pending_read_at(user_id, pk: int) -> Optional[datetime]:
+    """
+    Get when a message of a user was read by this process, if it is not yet marked as read in the database.
+    :param user_id: Primary key of the user.
+    :param pk: Primary key of the message.
+    :return: Read time, or None when the message is not buffered.
+    """
+    if not read_buffer.size:
+        return None
+    return read_buffer.read_at(user_id, pk)
+
+
+def flush_reads(force: bool = False) -> int:
+    """
+    Mark the buffered messages as read when the buffer is due (called at the end of each request).
+    :param force: Flush even if the buffer is not due (e.g. in tests).
+    :return: Number of messages marked as read.
+    """
+    if read_buffer.size and (force or read_buffer.is_due()):
+        return read_buffer.flush()
+    return 0
+
+
+@atexit.register
+def shutdown() -> None:
+    """Mark all messages buffered by this process as read (called on process exit)"""
+    try:
+        flush_reads(force=True)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to flush buffered read messages")
@@ -0,0 +1,182 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, router
+
+from drf_messages.conf import messages_settings
+
+APP_LABEL = "drf_messages"
+
+T = TypeVar("T")
+
+
+def _pin_key(user_id) -> str:
+    return f"drf_messages:pin:{user_id}"
+
+
+def get_primary() -> str:
+    """
+    Get the database alias messages are written to (when not sharded).
+    :return: MESSAGES_DATABASE, or the default database when not configured.
+    """
+    return messages_settings.MESSAGES_DATABASE or DEFAULT_DB_ALIAS
+
+
+def is_separate() -> bool:
+    """
+    Check whether messages may be stored in another database than users and sessions.
+    :return: True when MESSAGES_DATABASE or MESSAGES_SHARDS is configured.
+    """
+    return bool(messages_settings.MESSAGES_DATABASE or messages_settings.MESSAGES_SHARDS)
+
+
+def pin_primary(user_id) -> None:
+    """
+    Route reads of that user's messages to the primary database for MESSAGES_READ_DB_STICKY_SECONDS.
+    Should be called after writing messages of the user, so following reads can see the written data.
+    :param user_id: Primary key of the user.
+    """
+    if messages_settings.MESSAGES_READ_DB and user_id is not None:
+        cache.set(_pin_key(user_id), True, messages_settings.MESSAGES_READ_DB_STICKY_SECONDS)
+
+
+def is_pinned(user_id) -> bool:
+    """
+    Check whether reads of that user's messages must be routed to the primary database.
+    :param user_id: Primary key of the user.
+    :return: True when the user has recently written messages.
+    """
+    return user_id is not None and bool(cache.get(_pin_key(user_id)))
+
+
+def get_shards() -> List[str]:
+    """
+    Get the database aliases of all messages shards.
+    :return: List of MESSAGES_SHARDS, or only the primary database when sharding is not configured.
+    """
+    return list(messages_settings.MESSAGES_SHARDS) or [get_primary()]
+
+
+def get_shard(user_id) -> str:
+    """
+    Get the database alias storing the messages of a user, by a stable hash of the user ID.
+    :param user_id: Primary key of the user (messages without a user are stored in the first shard).
+    :return: Database alias.
+    """
+    shards = get_shards()
+    if user_id is None:
+        return shards[0]
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def group_by_shard(user_ids) -> Dict[str, list]:
+    """
+    Group user IDs by the shard storing their messages.
+    :param user_ids: Primary keys of users.
+    :return: Dictionary of user IDs list per database alias.
+    """
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(get_shard(user_id), []).append(user_id)
+    return groups
+
+
+def fan_out(func: Callable[[str], T], shards: Optional[List[str]] = None) -> Dict[str, T]:
+    """
+    Call a function for each shard in parallel, using a thread per shard.
+    :param func: Function called with the database alias of a shard.
+    :param shards: Database aliases to call the function for (defaults to all shards).
+    :return: Dictionary of function result per database alias.
+    """
+    shards = get_shards() if shards is None else shards
+    if len(shards) <= 1:
+        return {alias: func(alias) for alias in shards}
+
+    def call(alias):
+        try:
+            return func(alias)
+        finally:
+            # connections are per thread, and would be left open by the worker threads
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="drf_messages_shard") as executor:
+        return dict(zip(shards, executor.map(call, shards)))
+
+
+def _get_user_id(hints):
+    """Extract the user of the messages queried from router hints"""
+    if "user_id" in hints:
+        return hints["user_id"]
+    instance = hints.get("instance")
+    if instance is None:
+        return None
+    if hasattr(instance, "message_id"):
+        # message tag, avoid loading its message while routing the query of the message itself
+        field = instance._meta.get_field("message")
+        if not field.is_cached(instance):
+            return None
+        instance = field.get_cached_value(instance)
+    return getattr(instance, "user_id", None)
+
+
+def _get_shard(hints) -> str:
+    """Get the shard of the messages queried from router hints"""
+    instance = hints.get("instance")
+    if "user_id" not in hints and instance is not None and instance._state.db in messages_settings.MESSAGES_SHARDS:
+        # related objects are stored in the shard of the instance
+        return instance._state.db
+    return get_shard(_get_user_id(hints))
+
+
+def _is_related_to_message(hints) -> bool:
+    """Check whether a query of another app's model is for an object related to a message (e.g. its user)"""
+    instance = hints.get("instance")
+    return instance is not None and instance._meta.app_label == APP_LABEL and is_separate()
+
+
+class MessagesRouter:
+    """
+    Database router for drf_messages models.
+    When MESSAGES_SHARDS is configured, routes queries to the shard of the user whose messages are queried.
+    Otherwise, routes read queries to MESSAGES_READ_DB (usually a read replica), except for users that have recently
+    written messages, whose reads stick to the primary database (MESSAGES_DATABASE) to read their own writes.
+    Users and sessions related to messages are routed to their own database, as messages reference them by key only.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            # route without the message instance, which would route to the database of the message
+            return router.db_for_read(model) if _is_related_to_message(hints) else None
+        if messages_settings.MESSAGES_SHARDS:
+            return _get_shard(hints)
+        if not messages_settings.MESSAGES_READ_DB:
+            return messages_settings.MESSAGES_DATABASE
+        if is_pinned(_get_user_id(hints)):
+            return get_primary()
+        return messages_settings.MESSAGES_READ_DB
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return router.db_for_write(model) if _is_related_to_message(hints) else None
+        if messages_settings.MESSAGES_SHARDS:
+            return _get_shard(hints)
+        if not messages_settings.MESSAGES_READ_DB:
+            return messages_settings.MESSAGES_DATABASE
+        # avoid writing to the replica the instance was read from
+        return get_primary()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if APP_LABEL in (obj1._meta.app_label, obj2._meta.app_label) and (
+                messages_settings.MESSAGES_READ_DB or is_separate()):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not messages_settings.MESSAGES_DATABASE:
+            return None
+        if app_label == APP_LABEL:
+            return db in get_shards()
+        # the messages database is dedicated to the messages tables
+        return False if db == messages_settings.MESSAGES_DATABASE else None
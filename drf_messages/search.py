@@ -0,0 +1,180 @@
+import re
+from typing import List, Optional
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.utils import OperationalError
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+
+from drf_messages import logger
+from drf_messages.conf import messages_settings
+from drf_messages.models import Broadcast, Message, MessageQuerySet
+
+
+class BaseSearchBackend:
+    """
+    Full-text search backend for messages text.
+    Backends are used by MessageSearchFilter when configured by MESSAGES_SEARCH_BACKEND.
+    """
+    # database vendor supported by the backend
+    vendor: str = None
+
+    def install(self, connection) -> None:
+        """
+        Create the search index, called after each migration of the database.
+        :param connection: Database connection to install the index in.
+        """
+
+    def search(self, queryset: MessageQuerySet, terms: List[str]) -> MessageQuerySet:
+        """
+        Filter messages matching all search terms (as prefixes), ordered by rank.
+        :param queryset: Messages to search.
+        :param terms: Search terms.
+        :return: Filtered queryset annotated with "search_rank".
+        """
+        raise NotImplementedError("subclasses of BaseSearchBackend must provide a search() method")
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Search using FTS5 shadow tables of the messages and broadcasts tables, kept in sync by triggers.
+    """
+    vendor = "sqlite"
+    table = "drf_messages_message_fts"
+    # text of broadcast messages is stored in their broadcast
+    broadcast_table = "drf_messages_broadcast_fts"
+
+    @staticmethod
+    def _get_table_statements(table: str, source: str) -> dict:
+        return {
+            table: f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+                   f"USING fts5(message, content='{source}', content_rowid='id')",
+            f"{table}_insert": f"CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON {source} BEGIN "
+                               f"INSERT INTO {table}(rowid, message) VALUES (new.id, new.message); END",
+            f"{table}_delete": f"CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON {source} BEGIN "
+                               f"INSERT INTO {table}({table}, rowid, message) "
+                               f"VALUES ('delete', old.id, old.message); END",
+            f"{table}_update": f"CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF message "
+                               f"ON {source} BEGIN "
+                               f"INSERT INTO {table}({table}, rowid, message) "
+                               f"VALUES ('delete', old.id, old.message); "
+                               f"INSERT INTO {table}(rowid, message) VALUES (new.id, new.message); END",
+        }
+
+    def _get_statements(self) -> dict:
+        return {
+            **self._get_table_statements(self.table, Message._meta.db_table),
+            **self._get_table_statements(self.broadcast_table, Broadcast._meta.db_table),
+        }
+
+    def install(self, connection) -> None:
+        statements = self._get_statements()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE name IN (%s)" % ", ".join(["%s"] * len(statements)),
+                           list(statements))
+            existing = {row[0] for row in cursor.fetchall()}
+            if existing == set(statements):
+                return
+
+            # triggers are dropped whenever the messages table is rebuilt by a migration
+            try:
+                for statement in statements.values():
+                    cursor.execute(statement)
+            except OperationalError as error:
+                logger.error(f"Failed to create full-text search table, make sure SQLite supports FTS5: {error}")
+                return
+            for table in (self.table, self.broadcast_table):
+                cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+        logger.info(f"Installed full-text search tables {self.table} and {self.broadcast_table}")
+
+    @staticmethod
+    def _get_query(terms: List[str]) -> str:
+        # quote each term to avoid FTS5 query syntax, and match as prefix
+        return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+    def search(self, queryset: MessageQuerySet, terms: List[str]) -> MessageQuerySet:
+        query = self._get_query(terms)
+        source = Message._meta.db_table
+        return queryset.filter(
+            Q(pk__in=RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", (query,))) |
+            Q(broadcast_id__in=RawSQL(f"SELECT rowid FROM {self.broadcast_table} "
+                                      f"WHERE {self.broadcast_table} MATCH %s", (query,))),
+        ).annotate(
+            # lower bm25 rank is a better match, of the message or of its broadcast
+            search_rank=RawSQL(f"COALESCE((SELECT -rank FROM {self.table} WHERE {self.table} MATCH %s "
+                               f"AND rowid = {source}.id), (SELECT -rank FROM {self.broadcast_table} "
+                               f"WHERE {self.broadcast_table} MATCH %s AND rowid = {source}.broadcast_id))",
+                               (query, query)),
+        ).order_by("-search_rank")
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Search using a tsvector of the messages and broadcasts text, backed by GIN indexes.
+    """
+    vendor = "postgresql"
+    config = "simple"
+    index = "drf_messages_message_fts"
+    # text of broadcast messages is stored in their broadcast
+    broadcast_index = "drf_messages_broadcast_fts"
+
+    def install(self, connection) -> None:
+        with connection.cursor() as cursor:
+            for index, model in ((self.index, Message), (self.broadcast_index, Broadcast)):
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index} ON {model._meta.db_table} USING GIN "
+                    f"(to_tsvector('{self.config}'::regconfig, COALESCE((message)::text, ''::text)))"
+                )
+
+    def search(self, queryset: MessageQuerySet, terms: List[str]) -> MessageQuerySet:
+        # pylint: disable=import-outside-toplevel
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        # keep only word characters to avoid tsquery syntax, and match as prefix
+        words = (re.sub(r"\W+", " ", term).split() for term in terms)
+        query = SearchQuery(" & ".join(f"{word}:*" for term in words for word in term),
+                            config=self.config, search_type="raw")
+        vector = SearchVector("message", config=self.config)
+        broadcasts = Broadcast.objects.annotate(search_vector=vector).filter(search_vector=query).values("pk")
+        return queryset.annotate(search_vector=vector).filter(
+            Q(search_vector=query) | Q(broadcast_id__in=broadcasts),
+        ).annotate(
+            search_rank=SearchRank(SearchVector("message", "broadcast__message", config=self.config), query),
+        ).order_by("-search_rank")
+
+
+def get_search_backend() -> Optional[BaseSearchBackend]:
+    """
+    Load the search backend configured by MESSAGES_SEARCH_BACKEND.
+    :return: Search backend object, or None when not configured.
+    """
+    if not messages_settings.MESSAGES_SEARCH_BACKEND:
+        return None
+    return import_string(messages_settings.MESSAGES_SEARCH_BACKEND)()
+
+
+def install_search_backend(using="default", **kwargs):
+    """Create the search index of the configured backend after migrating a database"""
+    backend = get_search_backend()
+    connection = connections[using]
+    if backend and connection.vendor == backend.vendor and router.allow_migrate_model(using, Message):
+        backend.install(connection)
+
+
+class MessageSearchFilter(SearchFilter):
+    """
+    Search filter using the full-text search backend configured by MESSAGES_SEARCH_BACKEND.
+    Fallbacks to DRF's search filter (using "search_fields") when no backend is configured for the database.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        backend = get_search_backend()
+        if backend is None or connections[queryset.db].vendor != backend.vendor:
+            return super(MessageSearchFilter, self).filter_queryset(request, queryset, view)
+
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return backend.search(queryset, terms)
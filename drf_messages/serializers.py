@@ -2,17 +2,40 @@ from django.contrib.messages.storage.base import LEVEL_TAGS
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from drf_messages.models import Message, MessageTag
+from drf_messages.models import Message
 
 
 class MessageSerializer(serializers.ModelSerializer):
-    extra_tags = serializers.SlugRelatedField(slug_field="text", queryset=MessageTag.objects.all(), many=True)
+    message = serializers.CharField(source="text", read_only=True, help_text="The actual text of the message.")
+    extra_tags = serializers.SlugRelatedField(slug_field="text", source="all_tags", read_only=True, many=True)
     level = serializers.ChoiceField(choices=tuple(LEVEL_TAGS.items()))
     level_tag = serializers.ChoiceField(choices=tuple(LEVEL_TAGS.values()))
+    read_at = serializers.DateTimeField(source="read_time", read_only=True,
+                                        help_text="When the message was read, individually or by its read mark.")
 
     class Meta:
         model = Message
-        fields = ("id", "message", "level", "level_tag", "extra_tags", "view", "read_at", "created")
+        fields = ("id", "message", "level", "level_tag", "extra_tags", "view", "read_at", "expires_at", "created")
+
+    def __init__(self, *args, fields=None, **kwargs):
+        """
+        :param fields: Names of the fields to include (a sparse fieldset), None for all fields.
+        :exception ValidationError: Unknown field names.
+        """
+        super(MessageSerializer, self).__init__(*args, **kwargs)
+        if fields is not None:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise ValidationError({"fields": f"Unknown fields: {', '.join(sorted(unknown))}."})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class MessageDataSerializer(MessageSerializer):
+    data = serializers.JSONField(read_only=True, help_text="Structured JSON data of the message.")
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ("data",)
 
 
 class MessagePeekSerializer(serializers.Serializer):
@@ -21,9 +44,28 @@ class MessagePeekSerializer(serializers.Serializer):
                                         help_text="Highest unread message level.")
     max_level_tag = serializers.ChoiceField(read_only=True, choices=tuple(LEVEL_TAGS.values()), allow_blank=True,
                                             help_text="Highest unread message level tag.")
+    capped = serializers.BooleanField(read_only=True, help_text="Whether there are more unread messages than counted.")
 
     def update(self, instance, validated_data):
         raise ValidationError("Updating MessagePeek objects is not allowed.")
 
     def create(self, validated_data):
         raise ValidationError("Creating MessagePeek objects is not allowed.")
+
+
+class MessageStatsCountSerializer(serializers.Serializer):
+    key = serializers.CharField(read_only=True, help_text="Level, tag or view counted.")
+    count = serializers.IntegerField(read_only=True, help_text="Count of messages.")
+    unread = serializers.IntegerField(read_only=True, help_text="Count of unread messages.")
+
+
+class MessageStatsSerializer(serializers.Serializer):
+    levels = MessageStatsCountSerializer(many=True, read_only=True, help_text="Counts of messages per level.")
+    tags = MessageStatsCountSerializer(many=True, read_only=True, help_text="Counts of messages per tag.")
+    views = MessageStatsCountSerializer(many=True, read_only=True, help_text="Counts of messages per view.")
+
+    def update(self, instance, validated_data):
+        raise ValidationError("Updating MessageStats objects is not allowed.")
+
+    def create(self, validated_data):
+        raise ValidationError("Creating MessageStats objects is not allowed.")
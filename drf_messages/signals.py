@@ -0,0 +1,89 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import router, transaction
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from drf_messages import logger
+from drf_messages.conf import messages_settings
+from drf_messages.models import Message, MessageReadMark, MessageStats
+from drf_messages.routers import group_by_shard
+
+# Users deleted by each thread, per database alias of the deleting transaction
+_pending = threading.local()
+
+
+class PendingPurge:
+    """
+    Messages of users to purge after the transaction deleting the users is committed.
+    Collecting the keys of all deleted users allows purging messages using a few set-based statements,
+    instead of loading the related messages of each deleted user.
+    """
+
+    def __init__(self):
+        self.keys = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key) -> None:
+        self.keys.add(key)
+
+    def __call__(self):
+        keys, self.keys = list(self.keys), set()
+        batch_size = messages_settings.MESSAGES_PURGE_BATCH_SIZE
+        deleted = []
+        for i in range(0, len(keys), batch_size):
+            # users of deletes rolled back (by a savepoint or a transaction) still exist, their messages are kept
+            batch = keys[i:i + batch_size]
+            existing = set(get_user_model()._default_manager.filter(pk__in=batch).values_list("pk", flat=True))
+            deleted.extend(key for key in batch if key not in existing)
+
+        # messages of a user are stored only in the user's shard
+        for alias, shard_keys in group_by_shard(deleted).items():
+            for i in range(0, len(shard_keys), batch_size):
+                queryset = Message.objects.using(alias).filter(user_id__in=shard_keys[i:i + batch_size])
+                count = queryset.purge(batch_size)
+                logger.debug(f"Purged {count} messages of deleted users from {alias}")
+            if messages_settings.MESSAGES_STATS:
+                MessageStats.objects.using(alias).filter(user_id__in=shard_keys).delete()
+            if messages_settings.MESSAGES_READ_MARKS:
+                MessageReadMark.objects.using(alias).filter(user_id__in=shard_keys).delete()
+
+
+def schedule_purge(key, using: str) -> None:
+    """
+    Purge messages of a deleted user when the current transaction is committed.
+    :param key: Primary key of the deleted user.
+    :param using: Database alias of the deleting transaction.
+    """
+    pending = getattr(_pending, using, None)
+    if pending is None:
+        pending = PendingPurge()
+        setattr(_pending, using, pending)
+    pending.add(key)
+    # callbacks of a rolled back savepoint are discarded, so a callback is registered for each user,
+    # the first callback executed after commit purges the messages of all collected users
+    transaction.on_commit(pending, using=using)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL, dispatch_uid="drf_messages_purge_user")
+def _purge_user_messages(sender, instance, using, **kwargs):
+    schedule_purge(instance.pk, using)
+
+
+@receiver(user_logged_out, dispatch_uid="drf_messages_purge_session")
+def _purge_session_messages(sender, request, user, **kwargs):
+    # sessions are not tracked by a pre_delete receiver, which would disable their fast delete (e.g. clearsessions),
+    # messages of expired sessions are deleted by "messages_sweep --orphans"
+    session_key = getattr(getattr(request, "session", None), "session_key", None)
+    if user is None or not session_key:
+        return
+    using = router.db_for_write(Message, user_id=user.pk)
+    count = Message.objects.using(using).filter(user_id=user.pk, session_key=session_key).purge()
+    if messages_settings.MESSAGES_READ_MARKS:
+        MessageReadMark.objects.using(using).filter(user_id=user.pk, session_key=session_key).delete()
+    logger.debug(f"Purged {count} messages of session {session_key} on logout")
@@ -0,0 +1,138 @@
+from collections import defaultdict
+from typing import Dict, Sequence, Tuple
+
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.db.models import Count, F
+
+from drf_messages.read_marks import unread_q
+
+# Number of statistics created or updated in a single statement
+STATS_BATCH_SIZE = 1000
+
+
+class MessageStatsManager(models.Manager):
+
+    def add(self, deltas: Dict[Tuple[int, str, str], Tuple[int, int]], using: str) -> None:
+        """
+        Add to the counts of messages statistics, creating the missing statistics.
+        :param deltas: Count and unread count to add, per user ID, kind and key of statistic.
+        :param using: Database alias of the messages.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        queryset = self.using(using)
+        queryset.bulk_create((
+            self.model(user_id=user_id, kind=kind, key=key)
+            for (user_id, kind, key), (count, _) in deltas.items() if count > 0
+        ), ignore_conflicts=True, batch_size=STATS_BATCH_SIZE)
+        # users with the same change of a statistic (e.g. recipients of a broadcast) are updated together
+        users = defaultdict(list)
+        for (user_id, kind, key), delta in deltas.items():
+            users[(kind, key, delta)].append(user_id)
+        for (kind, key, (count, unread)), user_ids in users.items():
+            for i in range(0, len(user_ids), STATS_BATCH_SIZE):
+                queryset.filter(user_id__in=user_ids[i:i + STATS_BATCH_SIZE], kind=kind, key=key).update(
+                    count=F("count") + count,
+                    unread=F("unread") + unread,
+                )
+
+    def record_created(self, messages: Sequence["Message"], using: str) -> None:
+        """
+        Count new messages in the level and view statistics of their users (tags are counted when attached).
+        :param messages: Created message objects.
+        :param using: Database alias of the messages.
+        """
+        deltas = defaultdict(lambda: (0, 0))
+        for message in messages:
+            unread = int(message.read_at is None)
+            for kind, key in ((MessageStats.LEVEL, message.level), (MessageStats.VIEW, message.view)):
+                count, unread_count = deltas[(message.user_id, kind, str(key))]
+                deltas[(message.user_id, kind, str(key))] = (count + 1, unread_count + unread)
+        self.add(deltas, using)
+
+    def record_tagged(self, message_tags: Sequence[Tuple["Message", str]], using: str) -> None:
+        """
+        Count tags newly attached to messages in the tag statistics of their users.
+        :param message_tags: Pairs of message object and the text of a tag attached to it.
+        :param using: Database alias of the messages.
+        """
+        deltas = defaultdict(lambda: (0, 0))
+        for message, text in message_tags:
+            count, unread = deltas[(message.user_id, MessageStats.TAG, text)]
+            deltas[(message.user_id, MessageStats.TAG, text)] = (count + 1, unread + int(message.read_at is None))
+        self.add(deltas, using)
+
+    @staticmethod
+    def breakdown(queryset: "MessageQuerySet") -> Dict[Tuple[int, str, str], Tuple[int, int]]:
+        """
+        Count messages of a queryset by the users statistics they are counted in.
+        :param queryset: Messages to count.
+        :return: Count and unread count, per user ID, kind and key of statistic.
+        """
+        queryset = queryset.order_by()
+        unread = Count("pk", filter=unread_q())
+        deltas = defaultdict(lambda: (0, 0))
+        for kind in (MessageStats.LEVEL, MessageStats.VIEW):
+            for row in queryset.values_list("user_id", kind).annotate(count=Count("pk"), unread=unread):
+                deltas[(row[0], kind, str(row[1]))] = (row[2], row[3])
+        tags = queryset.model.tags.through.objects.using(queryset.db).filter(message__in=queryset.values("pk")).order_by()
+        for user_id, text, count, unread_count in tags.values_list("message__user_id", "tag__text").annotate(
+                count=Count("pk"), unread=Count("pk", filter=unread_q("message__"))):
+            deltas[(user_id, MessageStats.TAG, text)] = (count, unread_count)
+        broadcast_tags = queryset.filter(broadcast__tags__isnull=False).values_list("user_id", "broadcast__tags__text")
+        for user_id, text, count, unread_count in broadcast_tags.annotate(count=Count("pk"), unread=unread):
+            count_before, unread_before = deltas[(user_id, MessageStats.TAG, text)]
+            deltas[(user_id, MessageStats.TAG, text)] = (count_before + count, unread_before + unread_count)
+        return deltas
+
+    def record_read(self, queryset: "MessageQuerySet") -> None:
+        """
+        Uncount unread messages about to be marked read from the unread count of statistics.
+        :param queryset: Unread messages about to be marked read.
+        """
+        deltas = self.breakdown(queryset)
+        self.add({key: (0, -unread) for key, (_, unread) in deltas.items()}, queryset.db)
+
+    def record_claimed(self, queryset: "MessageQuerySet") -> None:
+        """
+        Uncount messages just marked read (by MessageQuerySet.claim) from the unread count of statistics.
+        :param queryset: Messages that were unread until marked read by this transaction.
+        """
+        deltas = self.breakdown(queryset)
+        self.add({key: (0, -count) for key, (count, _) in deltas.items()}, queryset.db)
+
+    def record_deleted(self, queryset: "MessageQuerySet") -> None:
+        """
+        Uncount messages about to be deleted from statistics.
+        :param queryset: Messages about to be deleted.
+        """
+        deltas = self.breakdown(queryset)
+        self.add({key: (-count, -unread) for key, (count, unread) in deltas.items()}, queryset.db)
+
+
+class MessageStats(models.Model):
+    LEVEL = "level"
+    TAG = "tag"
+    VIEW = "view"
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.DO_NOTHING, db_constraint=False,
+                             related_name="message_stats")
+    kind = models.CharField(max_length=8, choices=((LEVEL, "Level"), (TAG, "Tag"), (VIEW, "View")),
+                            help_text="The message attribute counted.")
+    key = models.CharField(max_length=128, help_text="The value of the message attribute counted.")
+
+    count = models.IntegerField(default=0, help_text="Number of messages.")
+    unread = models.IntegerField(default=0, help_text="Number of unread messages.")
+
+    objects = MessageStatsManager()
+
+    class Meta:
+        verbose_name_plural = "message stats"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "kind", "key"], name="drf_messages_stats_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.key}: {self.count}"
@@ -1,15 +1,24 @@
-from typing import Union
+from functools import wraps
+from typing import List, Optional, Sequence, Tuple, Union
 
+from django.contrib.messages import get_messages
 from django.contrib.messages.storage.base import Message as DjangoMessage, BaseStorage
 
 from drf_messages import logger
 from drf_messages.conf import messages_settings
-from drf_messages.models import Message, MessageQuerySet
+from drf_messages.models import SEVERITY_ORDERING, Message
+from drf_messages.routers import pin_primary
+from drf_messages.stores import BaseMessageStore, DatabaseMessageStore, get_store
+from drf_messages.writer import PendingMessage, write_messages
+
+# Text of the message summarizing the messages exceeding the limit of a batch
+BATCH_SUMMARY = "And {count} more messages."
 
 
 class DBStorage(BaseStorage):
     """
-    Message storage backend to persistent messages storage in the database, with relation to the request's session.
+    Message storage backend to persistent messages storage in the message store (MESSAGES_STORE),
+    with relation to the request's session.
     When no session is provided, fallbacks to a temporary storage in memory.
     """
 
@@ -20,67 +29,104 @@ class DBStorage(BaseStorage):
             self._fallback = not bool(hasattr(request, "session") and request.session.session_key)
         else:
             self._fallback = not bool(hasattr(request, "user") and request.user.is_authenticated)
+        self.store: BaseMessageStore = get_store(request)
+        # messages collected by a batch, written when the batch is committed
+        self._batch: Optional[List[PendingMessage]] = None
+        self._batch_limit: Optional[int] = None
 
-    def get_queryset(self) -> MessageQuerySet:
+    def get_queryset(self):
         """
         Get queryset of all messages for that request session.
-        :return: MessageQuerySet object
+        :return: MessageQuerySet object (a sequence of messages for stores other than the database)
         """
-        return Message.objects.with_context(self.request)
+        return self.store.all()
 
-    def get_unread_queryset(self) -> MessageQuerySet:
+    def get_unread_queryset(self):
         """
         Get queryset of unread messages for that request session.
-        :return: MessageQuerySet object
+        :return: MessageQuerySet object (a sequence of messages for stores other than the database)
         """
-        return self.get_queryset().filter(read_at__isnull=True)
+        return self.store.unread()
 
     def __iter__(self):
         if self._fallback:
             self.used = True
             yield from self._queued_messages
+        elif messages_settings.MESSAGES_CONSUME_EXACTLY_ONCE:
+            # messages are marked read before they are shown, so parallel requests never show the same message
+            for _, message in self.store.consume(slice(messages_settings.MESSAGES_MAX_DISPLAY or None)):
+                self.used = True
+                yield message
         else:
-            # parse to Django original Message objects
-            for message in self.get_unread_queryset().prefetch_related("extra_tags"):
-                yield message.get_django_message()
-
-            # update last read
-            self.get_unread_queryset().mark_read()
+            read_ids = []
+            for pk, message in self.store.load_unread(slice(messages_settings.MESSAGES_MAX_DISPLAY or None)):
+                read_ids.append(pk)
+                yield message
+
+            # update last read, only for displayed messages when limited
+            self.used = self.used or bool(read_ids)
+            if messages_settings.MESSAGES_MAX_DISPLAY:
+                self.store.mark_read(read_ids)
+            else:
+                self.store.mark_all_read(read_ids)
 
     def __getitem__(self, key):
         if self._fallback:
             self.used = True
             return self._queued_messages[key]
         else:
-            qs_slice = self.get_unread_queryset().prefetch_related("extra_tags")[key]
-            if isinstance(qs_slice, Message):
-                qs_slice.mark_read(self.request)
-                return qs_slice.get_django_message()
-
-            # update last read
-            self.get_unread_queryset().filter(pk__in=qs_slice).mark_read()
-            # parse to Django original Message objects
-            return [
-                message.get_django_message()
-                for message in qs_slice
-            ]
+            loaded = self._load_read(key if isinstance(key, slice) else slice(key, key + 1))
+            if not isinstance(key, slice) and not loaded:
+                raise IndexError("Message index out of range")
+            if isinstance(key, slice):
+                return [message for _, message in loaded]
+            return loaded[0][1]
+
+    def _load_read(self, key: slice, ordering: Sequence[str] = ()) -> List[Tuple[int, DjangoMessage]]:
+        """
+        Load unread messages and mark them as read (before loading them when MESSAGES_CONSUME_EXACTLY_ONCE).
+        :param key: Slice of the unread messages.
+        :param ordering: Fields to order the unread messages by, newest first when empty.
+        :return: List of message ID and Django message object pairs.
+        """
+        if messages_settings.MESSAGES_CONSUME_EXACTLY_ONCE:
+            loaded = list(self.store.consume(key, ordering))
+        else:
+            loaded = list(self.store.load_unread(key, ordering))
+            self.store.mark_read([pk for pk, _ in loaded])
+
+        # update last read
+        self.used = self.used or bool(loaded)
+        return loaded
+
+    def top(self, n: int) -> List[DjangoMessage]:
+        """
+        Get the most severe unread messages, and mark them as read.
+        Read from the unread severity index of the messages, without sorting all unread messages.
+        :param n: Maximum number of messages.
+        :return: List of messages, highest level first (newest first among messages of the same level).
+        """
+        if self._fallback:
+            self.used = True
+            return sorted(reversed(self._queued_messages), key=lambda message: message.level, reverse=True)[:n]
+        return [message for _, message in self._load_read(slice(n), SEVERITY_ORDERING)]
 
     def __contains__(self, item: Union[str, int, DjangoMessage]):
         if isinstance(item, str):
             if self._fallback:
                 return any(item == m.message for m in self._queued_messages)
             else:
-                return self.get_unread_queryset().filter(message=item).exists()
+                return self.store.contains(message=item)
         elif isinstance(item, int):
             if self._fallback:
                 return any(item == m.level for m in self._queued_messages)
             else:
-                return self.get_unread_queryset().filter(level=item).exists()
+                return self.store.contains(level=item)
         elif isinstance(item, DjangoMessage):
             if self._fallback:
                 return item in self._queued_messages
             else:
-                return self.get_unread_queryset().filter(message=item.message, level=item.level).exists()
+                return self.store.contains(message=item.message, level=item.level)
         else:
             raise ValueError(f"Unsupported \"in\" condition with type {type(item)} in DBStorage")
 
@@ -88,19 +134,19 @@ class DBStorage(BaseStorage):
         if self._fallback:
             return len(self._queued_messages)
         else:
-            return self.get_unread_queryset().count()
+            return self.store.count_unread()
 
     def __bool__(self):
         if self._fallback:
             return bool(self._queued_messages)
         else:
-            return self.get_unread_queryset().exists()
+            return self.store.contains()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.get_queryset().mark_read()
+        self.store.mark_all_read()
 
     def _store(self, messages, response, *args, **kwargs):
         # messages are saved immediately when is created
@@ -113,32 +159,95 @@ class DBStorage(BaseStorage):
         else:
             return list(self.__iter__()), True
 
-    def add(self, level: int, message: str, extra_tags=''):
+    def add(self, level: int, message: str, extra_tags='', expires_at=None, data=None):
         if self._fallback:
             # save messaged to temporary storage in memory
             self._queued_messages.append(DjangoMessage(level, message, extra_tags=extra_tags))
         elif message and int(level) >= self.level:
-            Message.objects.create_message(self.request, message, level, extra_tags=extra_tags)
+            if self._batch is not None:
+                self._batch.append(PendingMessage.from_request(
+                    self.request, message, level, extra_tags=extra_tags, expires_at=expires_at, data=data))
+                return
+            self.store.add(level, message, extra_tags=extra_tags, expires_at=expires_at, data=data)
         elif not message:
             logger.debug(f"Skip message creation due to an empty string. (message=\'{message}\')")
         elif level < self.level:
             logger.debug(f"Skip message creation due to the level being too low (level={level} / min={self.level}).")
 
+    def start_batch(self, limit: Optional[int] = None) -> bool:
+        """
+        Start collecting added messages, to be written in bulk by commit_batch.
+        :param limit: Maximum number of messages written, the rest are collapsed into a summary message.
+        :return: True when a batch was started, False when already in a batch or not using the database store.
+        """
+        if self._fallback or self._batch is not None or not isinstance(self.store, DatabaseMessageStore):
+            return False
+        self._batch = []
+        self._batch_limit = limit
+        return True
+
+    def commit_batch(self) -> List[Message]:
+        """
+        Write the messages collected since start_batch in bulk, and stop collecting messages.
+        :return: Created message objects.
+        """
+        pending, self._batch = self._batch or [], None
+        if self._batch_limit is not None and len(pending) > self._batch_limit:
+            overflow = pending[self._batch_limit:]
+            pending = pending[:self._batch_limit] + [PendingMessage.from_request(
+                self.request, BATCH_SUMMARY.format(count=len(overflow)), max(message.level for message in overflow))]
+        if not pending:
+            return []
+        return write_messages(pending)
+
     def update(self, response) -> None:
+        self.store.close()
         # delete already read messages
         if messages_settings.MESSAGES_DELETE_READ and self.used and not self._fallback:
-            count, _ = self.get_queryset().filter(read_at__isnull=False).delete()
+            count = self.store.delete_read()
+            pin_primary(getattr(getattr(self.request, "user", None), "pk", None))
             logger.info(f"Cleared {count} messages for session {self.request.session}")
 
     def __str__(self):
         results = self.__repr__()
         self.used = True
         if not self._fallback:
-            self.get_unread_queryset().mark_read()
+            self.store.mark_all_read()
         return results
 
     def __repr__(self):
         if self._fallback:
             return ", ".join(m.message for m in self._queued_messages)
         else:
-            return ", ".join(self.get_unread_queryset().values_list("message", flat=True))
+            return ", ".join(message.message for _, message in self.store.load_unread())
+
+
+class MessageBatch:
+    """
+    Collect the messages added to the storage of a request, and write them in bulk on exit.
+    Can be used as a context manager, or as a decorator of views (accepting the request as the first argument).
+    """
+
+    def __init__(self, request=None, limit: Optional[int] = None):
+        self.request = request
+        self.limit = limit
+        self.storage: Optional[DBStorage] = None
+
+    def __enter__(self):
+        storage = get_messages(self.request)
+        # nested batches are written by the outermost batch
+        if isinstance(storage, DBStorage) and storage.start_batch(self.limit):
+            self.storage = storage
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.storage is not None:
+            self.storage.commit_batch()
+            self.storage = None
+
+    def __call__(self, view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            with MessageBatch(request, self.limit):
+                return view(request, *args, **kwargs)
+        return wrapped
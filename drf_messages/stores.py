@@ -0,0 +1,610 @@
+import itertools
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from django.contrib.messages.storage.base import LEVEL_TAGS
+from django.contrib.messages.storage.base import Message as DjangoMessage
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import router
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.forms import DateTimeField
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+
+from drf_messages import logger
+from drf_messages.conf import messages_settings
+from drf_messages.models import Broadcast, Message, MessageQuerySet, MessageStats, MessageTag, Tag
+from drf_messages.reads import flush_reads, is_buffered
+from drf_messages.writer import PendingMessage, get_writer, wait_for
+
+# Number of messages loaded (and their tags) per query when iterating storage
+ITERATION_CHUNK_SIZE = 100
+# Fields messages can be ordered by in the list filters
+ORDERING_FIELDS = ("level", "read_at", "created")
+# Date range list filters (with "_after" and "_before" bounds) and their message fields, as in MessageFilterSet
+RANGE_FILTERS = {"created": "created", "read": "read_at"}
+
+REVERSED_LEVEL_TAGS = {v: k for k, v in LEVEL_TAGS.items()}
+
+
+class BaseMessageStore:
+    """
+    Interface of the messages of a request context (the request user, and its session when MESSAGES_USE_SESSIONS).
+    Used by DBStorage and MessagesViewSet, the store is configured by MESSAGES_STORE.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def add(self, level: int, message: str, extra_tags="", expires_at=None, data=None) -> None:
+        """
+        Create a new message.
+        :param level: Integer describing the type of the message.
+        :param message: Text body of the message.
+        :param extra_tags: One or more tags to attach to the message.
+        :param expires_at: When the message expires (defaults to MESSAGES_DEFAULT_TTL from now).
+        :param data: JSON serializable data of the message.
+        """
+        raise NotImplementedError
+
+    def all(self) -> Sequence:
+        """
+        Get all messages.
+        :return: Sequence of message objects, newest first.
+        """
+        raise NotImplementedError
+
+    def unread(self) -> Sequence:
+        """
+        Get unread messages.
+        :return: Sequence of message objects, newest first.
+        """
+        raise NotImplementedError
+
+    def list(self, filters: Mapping[str, str]) -> Sequence:
+        """
+        Get messages matching list filters (as the query params of the messages list view).
+        Not used for the database store, its queryset is filtered by the filter backends of the messages list view.
+        :param filters: Values of filters: unread, level, level_tag, view, extra_tags, created and read ranges
+            (e.g. created_after and created_before), search and ordering.
+        :return: Sequence of message objects.
+        :exception ValidationError: Invalid filter values.
+        """
+        raise NotImplementedError
+
+    def get(self, pk) -> Optional[object]:
+        """
+        Get a message by its ID.
+        :param pk: Primary key of the message.
+        :return: Message object, or None when not found.
+        """
+        raise NotImplementedError
+
+    def load_unread(self, key: slice = slice(None), ordering: Sequence[str] = ()
+                    ) -> Iterator[Tuple[int, DjangoMessage]]:
+        """
+        Load unread messages, without marking them read.
+        :param key: Slice of the unread messages to load.
+        :param ordering: Fields to order the unread messages by (e.g. SEVERITY_ORDERING), newest first when empty.
+        :return: Iterator of message ID and Django message object pairs.
+        """
+        raise NotImplementedError
+
+    def consume(self, key: slice = slice(None), ordering: Sequence[str] = ()) -> Iterator[Tuple[int, DjangoMessage]]:
+        """
+        Mark unread messages as read and load them, so parallel requests never load the same message.
+        :param key: Slice of the unread messages to consume.
+        :param ordering: Fields to order the unread messages by (e.g. SEVERITY_ORDERING), newest first when empty.
+        :return: Iterator of message ID and Django message object pairs.
+        """
+        raise NotImplementedError
+
+    def count_unread(self) -> int:
+        """
+        Count unread messages.
+        :return: Number of unread messages.
+        """
+        raise NotImplementedError
+
+    def contains(self, message: Optional[str] = None, level: Optional[int] = None) -> bool:
+        """
+        Check whether an unread message with that text and level exists.
+        :param message: Text of the message, or None for any text.
+        :param level: Level of the message, or None for any level.
+        :return: True when exists.
+        """
+        raise NotImplementedError
+
+    def peek(self, cap: Optional[int] = None) -> Dict[str, Optional[int]]:
+        """
+        Summarize unread messages.
+        :param cap: Maximum number of unread messages counted, None for an exact count.
+        :return: Dictionary of count and max_level of unread messages, and whether the count was capped.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Optional[Dict[str, List[Dict]]]:
+        """
+        Count all messages of the user (from all sessions) by level, tag and view.
+        :return: Dictionary of levels, tags and views counts, or None when not available.
+        """
+        raise NotImplementedError
+
+    def mark_read(self, ids: Sequence[int]) -> int:
+        """
+        Mark messages as read.
+        :param ids: Primary keys of the messages.
+        :return: Number of messages marked as read.
+        """
+        raise NotImplementedError
+
+    def claim(self, ids: Sequence[int]) -> Set[int]:
+        """
+        Mark messages as read, so parallel requests never claim the same message.
+        :param ids: Primary keys of the messages.
+        :return: Primary keys of the messages marked read by this call.
+        """
+        raise NotImplementedError
+
+    def mark_all_read(self, ids: Optional[Sequence[int]] = None) -> int:
+        """
+        Mark all unread messages as read.
+        :param ids: Primary keys of the messages just read, only messages up to the newest of them are marked read.
+        :return: Number of messages marked as read.
+        """
+        raise NotImplementedError
+
+    def delete(self, message) -> None:
+        """
+        Delete a message.
+        :param message: Message object.
+        """
+        raise NotImplementedError
+
+    def delete_read(self) -> int:
+        """
+        Delete all read messages.
+        :return: Number of messages deleted.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Called at the end of the request"""
+
+
+class DatabaseMessageStore(BaseMessageStore):
+    """Message store of the Message model, in the database"""
+
+    def add(self, level: int, message: str, extra_tags="", expires_at=None, data=None) -> None:
+        if messages_settings.MESSAGES_ASYNC_WRITES and get_writer().put(PendingMessage.from_request(
+                self.request, message, level, extra_tags=extra_tags, expires_at=expires_at, data=data)):
+            return
+        Message.objects.create_message(self.request, message, level, extra_tags=extra_tags, expires_at=expires_at,
+                                       data=data)
+
+    def all(self) -> MessageQuerySet:
+        if messages_settings.MESSAGES_ASYNC_WRITES and messages_settings.MESSAGES_ASYNC_READ_WAIT_SECONDS:
+            # read your own messages, still queued to be written in the background
+            wait_for(getattr(getattr(self.request, "user", None), "pk", None))
+        return Message.objects.with_context(self.request)
+
+    def unread(self) -> MessageQuerySet:
+        return self.all().unread()
+
+    def get(self, pk) -> Optional[Message]:
+        return self.all().filter(pk=pk).first()
+
+    def get_unread_slice(self, key: slice = slice(None), ordering: Sequence[str] = ()) -> MessageQuerySet:
+        """
+        Get the unread messages loaded by load_unread.
+        :param key: Slice of the unread messages.
+        :param ordering: Ordering of the unread messages, the default ordering when empty.
+        :return: MessageQuerySet object
+        """
+        unread = self.unread()
+        return (unread.order_by(*ordering) if ordering else unread)[key]
+
+    @staticmethod
+    def get_message_rows(queryset: MessageQuerySet):
+        """
+        Select only the columns needed for Django message objects, including the text of broadcasts.
+        :param queryset: Messages to load.
+        :return: QuerySet of message ID, text, level, broadcast ID and broadcast text tuples.
+        """
+        return queryset.values_list("id", "message", "level", "broadcast_id", "broadcast__message")
+
+    @staticmethod
+    def get_message_tags(using: str, message_ids: Iterable[int]):
+        """
+        Select the tags of messages.
+        :param using: Database alias of the messages.
+        :param message_ids: Primary keys of the messages.
+        :return: QuerySet of message ID and tag text tuples.
+        """
+        return MessageTag.objects.using(using).filter(message_id__in=message_ids) \
+            .order_by("pk").values_list("message_id", "tag__text")
+
+    @staticmethod
+    def get_broadcast_tags(using: str, broadcast_ids: Iterable[int]):
+        """
+        Select the tags of broadcasts.
+        :param using: Database alias of the broadcasts.
+        :param broadcast_ids: Primary keys of the broadcasts.
+        :return: QuerySet of broadcast ID and tag text tuples.
+        """
+        return Broadcast.tags.through.objects.using(using).filter(broadcast_id__in=broadcast_ids) \
+            .order_by("pk").values_list("broadcast_id", "tag__text")
+
+    def _load_messages(self, queryset: MessageQuerySet) -> Iterator[Tuple[int, DjangoMessage]]:
+        """
+        Load only the columns needed for Django message objects, in chunks of ITERATION_CHUNK_SIZE messages.
+        :param queryset: Messages to load.
+        :return: Iterator of message ID and Django message object pairs.
+        """
+        rows = self.get_message_rows(queryset).iterator(chunk_size=ITERATION_CHUNK_SIZE)
+        for chunk in iter(lambda: list(itertools.islice(rows, ITERATION_CHUNK_SIZE)), []):
+            extra_tags = defaultdict(list)
+            for message_id, text in self.get_message_tags(queryset.db, [row[0] for row in chunk if not row[3]]):
+                extra_tags[message_id].append(text)
+            broadcast_tags = defaultdict(list)
+            broadcast_ids = {row[3] for row in chunk if row[3]}
+            if broadcast_ids:
+                for broadcast_id, text in self.get_broadcast_tags(queryset.db, broadcast_ids):
+                    broadcast_tags[broadcast_id].append(text)
+
+            for pk, message, level, broadcast_id, broadcast_message in chunk:
+                if broadcast_id:
+                    message, tags = broadcast_message, broadcast_tags[broadcast_id]
+                else:
+                    tags = extra_tags[pk]
+                yield pk, DjangoMessage(level=level, message=message, extra_tags=" ".join(tags))
+
+    def load_unread(self, key: slice = slice(None), ordering: Sequence[str] = ()
+                    ) -> Iterator[Tuple[int, DjangoMessage]]:
+        return self._load_messages(self.get_unread_slice(key, ordering))
+
+    def consume(self, key: slice = slice(None), ordering: Sequence[str] = ()) -> Iterator[Tuple[int, DjangoMessage]]:
+        unread = self.unread()
+        claimed = (unread.order_by(*ordering) if ordering else unread).claim(key)
+        if not claimed:
+            return iter(())
+        # claimed messages are loaded from the database they were claimed in
+        user_id = getattr(getattr(self.request, "user", None), "pk", None)
+        queryset = self.all().using(router.db_for_write(Message, user_id=user_id)).filter(pk__in=claimed)
+        return self._load_messages(queryset.order_by(*ordering) if ordering else queryset)
+
+    def count_unread(self) -> int:
+        return self.unread().count()
+
+    def contains(self, message: Optional[str] = None, level: Optional[int] = None) -> bool:
+        queryset = self.unread()
+        if message is not None:
+            queryset = queryset.filter(Q(message=message, broadcast__isnull=True) | Q(broadcast__message=message))
+        if level is not None:
+            queryset = queryset.filter(level=level)
+        return queryset.exists()
+
+    def peek(self, cap: Optional[int] = None) -> Dict[str, Optional[int]]:
+        unread = self.unread()
+        if cap is None:
+            return {**unread.aggregate(count=Count("id"), max_level=Max("level")), "capped": False}
+        # count at most cap + 1 rows, and find the highest level by walking the unread level index
+        count = unread.order_by().values("id")[:cap + 1].count()
+        max_level = unread.order_by("-level").values_list("level", flat=True).first() if count else None
+        return {"count": min(count, cap), "max_level": max_level, "capped": count > cap}
+
+    def stats(self) -> Optional[Dict[str, List[Dict]]]:
+        if not messages_settings.MESSAGES_STATS:
+            return None
+        user_id = getattr(getattr(self.request, "user", None), "pk", None)
+        breakdown = {MessageStats.LEVEL: [], MessageStats.TAG: [], MessageStats.VIEW: []}
+        queryset = MessageStats.objects.db_manager(hints={"user_id": user_id}) \
+            .filter(user_id=user_id, count__gt=0).order_by("kind", "key")
+        for stat in queryset.values("kind", "key", "count", "unread"):
+            breakdown[stat.pop("kind")].append(stat)
+        return {
+            "levels": breakdown[MessageStats.LEVEL],
+            "tags": breakdown[MessageStats.TAG],
+            "views": breakdown[MessageStats.VIEW],
+        }
+
+    def mark_read(self, ids: Sequence[int]) -> int:
+        return self.unread().buffer_read(ids)
+
+    def claim(self, ids: Sequence[int]) -> Set[int]:
+        if not ids:
+            return set()
+        return set(self.unread().filter(pk__in=ids).claim())
+
+    def mark_all_read(self, ids: Optional[Sequence[int]] = None) -> int:
+        if ids is None:
+            return self.unread().mark_all_read()
+        if not ids:
+            return 0
+        if is_buffered() and not messages_settings.MESSAGES_READ_MARKS:
+            return self.unread().buffer_read(ids)
+        return self.unread().mark_all_read(max(ids))
+
+    def delete(self, message: Message) -> None:
+        message.delete()
+
+    def delete_read(self) -> int:
+        count, _ = self.all().read().delete()
+        return count
+
+    def close(self) -> None:
+        # write buffered reads of this and previous requests, when due
+        flush_reads()
+
+
+@dataclass
+class MemoryMessage:
+    """Message stored by MemoryMessageStore, with the attributes of the Message model"""
+    id: int
+    user_id: object
+    session_key: str
+    view: str
+    message: str
+    level: int
+    extra_tags: List[str] = field(default_factory=list)
+    read_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    created: datetime = field(default_factory=timezone.now)
+    data: Any = None
+
+    @property
+    def pk(self) -> int:
+        return self.id
+
+    @property
+    def level_tag(self) -> str:
+        """Message level as text"""
+        return LEVEL_TAGS.get(self.level, '')
+
+    @property
+    def read_time(self) -> Optional[datetime]:
+        """When the message was read"""
+        return self.read_at
+
+    @property
+    def text(self) -> str:
+        """Text of the message"""
+        return self.message
+
+    @property
+    def all_tags(self) -> List[Tag]:
+        """Unsaved tag objects of the message"""
+        return [Tag(text=text) for text in self.extra_tags]
+
+    def get_django_message(self) -> DjangoMessage:
+        """
+        Create a Django message object from this message.
+        :return: Django message object
+        """
+        return DjangoMessage(level=self.level, message=self.message, extra_tags=" ".join(self.extra_tags))
+
+
+class MemoryMessageStore(BaseMessageStore):
+    """
+    Message store in the memory of the process, shared by all requests and threads.
+    Messages are lost when the process exits, intended for tests and local development.
+    """
+    _messages: Dict[int, MemoryMessage] = {}
+    _ids = itertools.count(1)
+    _lock = threading.RLock()
+
+    @classmethod
+    def clear(cls) -> None:
+        """Delete all messages of all users (e.g. between tests)"""
+        with cls._lock:
+            cls._messages.clear()
+
+    def _user_id(self):
+        user = getattr(self.request, "user", None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def _session_key(self) -> str:
+        if messages_settings.MESSAGES_USE_SESSIONS and hasattr(self.request, "session"):
+            return self.request.session.session_key or ""
+        return ""
+
+    def _in_context(self, message: MemoryMessage, now: datetime) -> bool:
+        if message.user_id != self._user_id() or (message.expires_at is not None and message.expires_at <= now):
+            return False
+        return not messages_settings.MESSAGES_USE_SESSIONS or message.session_key in ("", self._session_key())
+
+    def add(self, level: int, message: str, extra_tags="", expires_at=None, data=None) -> None:
+        if not extra_tags:
+            extra_tags = []
+        elif not isinstance(extra_tags, (list, tuple, set)):
+            extra_tags = [extra_tags]
+        with self._lock:
+            pk = next(self._ids)
+            self._messages[pk] = MemoryMessage(
+                id=pk,
+                user_id=self._user_id(),
+                session_key=self._session_key(),
+                view=self.request.resolver_match.view_name if self.request.resolver_match else "",
+                message=message,
+                level=level,
+                extra_tags=list(dict.fromkeys(map(str, extra_tags))),
+                expires_at=Message.objects._get_expires_at(expires_at),
+                data=data,
+            )
+            self._enforce_unread_limit()
+
+    def _enforce_unread_limit(self) -> None:
+        limit = messages_settings.MESSAGES_MAX_UNREAD_PER_SCOPE
+        if not limit:
+            return
+        session_key = self._session_key()
+        scope = [
+            message for message in self._messages.values()
+            if message.user_id == self._user_id() and message.read_at is None and (
+                not messages_settings.MESSAGES_USE_SESSIONS or message.session_key == session_key)
+        ]
+        now = timezone.now()
+        for message in scope[:-limit]:
+            message.read_at = now
+
+    def all(self) -> List[MemoryMessage]:
+        now = timezone.now()
+        with self._lock:
+            messages = [message for message in self._messages.values() if self._in_context(message, now)]
+        return sorted(messages, key=lambda message: (message.created, message.id), reverse=True)
+
+    def unread(self) -> List[MemoryMessage]:
+        return [message for message in self.all() if message.read_at is None]
+
+    def list(self, filters: Mapping[str, str]) -> List[MemoryMessage]:
+        messages = self.all()
+        if filters.get("unread") in ("true", "True", "1", "false", "False", "0"):
+            unread = filters["unread"] in ("true", "True", "1")
+            messages = [message for message in messages if (message.read_at is None) == unread]
+        if filters.get("level_tag") in REVERSED_LEVEL_TAGS:
+            messages = [message for message in messages if message.level >= REVERSED_LEVEL_TAGS[filters["level_tag"]]]
+        if filters.get("level"):
+            messages = [message for message in messages if str(message.level) == filters["level"]]
+        if filters.get("view"):
+            messages = [message for message in messages if message.view == filters["view"]]
+        if filters.get("extra_tags"):
+            messages = [message for message in messages if filters["extra_tags"] in message.extra_tags]
+        for name, attribute in RANGE_FILTERS.items():
+            after, before = self._parse_bound(filters, f"{name}_after"), self._parse_bound(filters, f"{name}_before")
+            if after is not None:
+                messages = [message for message in messages
+                            if getattr(message, attribute) is not None and getattr(message, attribute) >= after]
+            if before is not None:
+                messages = [message for message in messages
+                            if getattr(message, attribute) is not None and getattr(message, attribute) <= before]
+        for term in filters.get("search", "").replace(",", " ").split():
+            messages = [message for message in messages if term.lower() in message.message.lower()]
+
+        return self._order(messages, [term for term in filters.get("ordering", "").split(",")
+                                      if term.lstrip("-") in ORDERING_FIELDS])
+
+    @staticmethod
+    def _parse_bound(filters: Mapping[str, str], name: str) -> Optional[datetime]:
+        """
+        Parse a bound of a date range filter, as django-filter does.
+        :param filters: Values of filters.
+        :param name: Name of the bound (e.g. created_after).
+        :return: Aware datetime, or None when not filtered.
+        :exception ValidationError: Invalid date and time.
+        """
+        if not filters.get(name):
+            return None
+        try:
+            return DateTimeField().clean(filters[name])
+        except DjangoValidationError as e:
+            raise ValidationError({name: e.messages}) from e
+
+    @staticmethod
+    def _order(messages: List[MemoryMessage], ordering: Sequence[str]) -> List[MemoryMessage]:
+        """
+        Sort messages in place by fields, keeping the newest first order among equal messages.
+        :param messages: Messages, newest first.
+        :param ordering: Field names, prefixed by "-" for descending order.
+        :return: The sorted messages.
+        """
+        for term in reversed(ordering):
+            name = term.lstrip("-")
+            # messages without a value are ordered last, as in the database
+            messages.sort(key=lambda message: (getattr(message, name) is None, getattr(message, name) or 0),
+                          reverse=term.startswith("-"))
+        return messages
+
+    def get(self, pk) -> Optional[MemoryMessage]:
+        try:
+            message = self._messages.get(int(pk))
+        except (TypeError, ValueError):
+            return None
+        return message if message is not None and self._in_context(message, timezone.now()) else None
+
+    def load_unread(self, key: slice = slice(None), ordering: Sequence[str] = ()
+                    ) -> Iterator[Tuple[int, DjangoMessage]]:
+        for message in self._order(self.unread(), ordering)[key]:
+            yield message.id, message.get_django_message()
+
+    def consume(self, key: slice = slice(None), ordering: Sequence[str] = ()) -> Iterator[Tuple[int, DjangoMessage]]:
+        now = timezone.now()
+        with self._lock:
+            messages = self._order(self.unread(), ordering)[key]
+            for message in messages:
+                message.read_at = now
+        return iter([(message.id, message.get_django_message()) for message in messages])
+
+    def count_unread(self) -> int:
+        return len(self.unread())
+
+    def contains(self, message: Optional[str] = None, level: Optional[int] = None) -> bool:
+        return any(
+            (message is None or unread.message == message) and (level is None or unread.level == level)
+            for unread in self.unread()
+        )
+
+    def peek(self, cap: Optional[int] = None) -> Dict[str, Optional[int]]:
+        unread = self.unread()
+        count = len(unread) if cap is None else min(len(unread), cap)
+        return {"count": count, "max_level": max((message.level for message in unread), default=None),
+                "capped": count < len(unread)}
+
+    def stats(self) -> Optional[Dict[str, List[Dict]]]:
+        counts = {"levels": defaultdict(lambda: [0, 0]), "tags": defaultdict(lambda: [0, 0]),
+                  "views": defaultdict(lambda: [0, 0])}
+        with self._lock:
+            messages = [message for message in self._messages.values() if message.user_id == self._user_id()]
+        for message in messages:
+            keys = [("levels", str(message.level)), ("views", message.view)]
+            keys.extend(("tags", text) for text in message.extra_tags)
+            for kind, key in keys:
+                counts[kind][key][0] += 1
+                counts[kind][key][1] += int(message.read_at is None)
+        return {
+            kind: [dict(key=key, count=count, unread=unread) for key, (count, unread) in sorted(values.items())]
+            for kind, values in counts.items()
+        }
+
+    def mark_read(self, ids: Sequence[int]) -> int:
+        claimed = self.claim(ids)
+        logger.debug(f"Marked {len(claimed)} messages as read")
+        return len(claimed)
+
+    def claim(self, ids: Sequence[int]) -> Set[int]:
+        ids = set(ids)
+        now = timezone.now()
+        with self._lock:
+            messages = [message for message in self.unread() if message.id in ids]
+            for message in messages:
+                message.read_at = now
+        return {message.id for message in messages}
+
+    def mark_all_read(self, ids: Optional[Sequence[int]] = None) -> int:
+        if ids is not None and not ids:
+            return 0
+        last_id = max(ids) if ids else None
+        return self.mark_read([message.id for message in self.unread() if last_id is None or message.id <= last_id])
+
+    def delete(self, message: MemoryMessage) -> None:
+        with self._lock:
+            self._messages.pop(message.id, None)
+
+    def delete_read(self) -> int:
+        with self._lock:
+            messages = [message for message in self.all() if message.read_at is not None]
+            for message in messages:
+                self._messages.pop(message.id, None)
+        return len(messages)
+
+
+def get_store(request) -> BaseMessageStore:
+    """
+    Create the message store configured by MESSAGES_STORE for a request.
+    :param request: Request context.
+    :return: Message store object.
+    """
+    return import_string(messages_settings.MESSAGES_STORE)(request)
@@ -0,0 +1,110 @@
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from django.db import models, router
+
+from drf_messages.conf import messages_settings
+from drf_messages.stats import MessageStats
+
+
+class TagManager(models.Manager):
+
+    def intern(self, texts: Iterable[str], using: Optional[str] = None) -> Dict[str, int]:
+        """
+        Get the tags of texts, creating the missing tags in bulk.
+        :param texts: Text of tags.
+        :param using: Database alias to write the tags to.
+        :return: Dictionary of tag ID per text.
+        """
+        texts = list(dict.fromkeys(map(str, texts)))
+        queryset = self.using(using or router.db_for_write(self.model))
+        tags = dict(queryset.filter(text__in=texts).values_list("text", "pk"))
+        missing = [text for text in texts if text not in tags]
+        if missing:
+            # concurrent creation of the same tag is ignored, and the tag is selected again
+            queryset.bulk_create((self.model(text=text) for text in missing), ignore_conflicts=True)
+            tags.update(queryset.filter(text__in=missing).values_list("text", "pk"))
+        return tags
+
+
+class Tag(models.Model):
+    text = models.CharField(max_length=128, unique=True, help_text="Custom tag for messages.")
+
+    objects = TagManager()
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return self.text
+
+
+class MessageTagManager(models.Manager):
+
+    def get_queryset(self) -> models.QuerySet:
+        # the text of message tags is read from their tag, joined instead of queried per message tag
+        return super(MessageTagManager, self).get_queryset().select_related("tag")
+
+    def create_tags(self, message, texts: Iterable[str], new: bool = False) -> None:
+        """
+        Attach tags to a message, interning the tags text in bulk.
+        Tags already attached to the message are ignored.
+        :param message: The message to attach the tags to.
+        :param texts: Text of tags, in order.
+        :param new: Whether the message was just created (and has no tags yet).
+        """
+        using = message._state.db or router.db_for_write(self.model, instance=message)
+        self.bulk_create_tags([(message, texts)], using=using, new=new)
+
+    def bulk_create_tags(self, messages: Sequence[Tuple["Message", Iterable[str]]], using: str,
+                         new: bool = False) -> None:
+        """
+        Attach tags to many messages, interning the tags text of all messages at once.
+        Tags already attached to a message are ignored.
+        :param messages: Pairs of saved message object and the text of its tags, in order.
+        :param using: Database alias of the messages.
+        :param new: Whether the messages were just created (and have no tags yet).
+        """
+        messages = [(message, list(dict.fromkeys(map(str, texts)))) for message, texts in messages]
+        tags = Tag.objects.intern((text for _, texts in messages for text in texts), using=using)
+        message_tags = [
+            self.model(message=message, tag_id=tags[text])
+            for message, texts in messages for text in texts
+        ]
+        if messages_settings.MESSAGES_STATS:
+            existing = set() if new else set(self.using(using).filter(
+                message__in=[message for message, _ in messages], tag__in=tags.values(),
+            ).values_list("message_id", "tag_id"))
+            texts = {tag_id: text for text, tag_id in tags.items()}
+            MessageStats.objects.record_tagged([
+                (message_tag.message, texts[message_tag.tag_id]) for message_tag in message_tags
+                if (message_tag.message.pk, message_tag.tag_id) not in existing
+            ], using=using)
+        self.using(using).bulk_create(message_tags, ignore_conflicts=True)
+
+
+class MessageTag(models.Model):
+    # tags are deleted along with messages by MessageQuerySet.delete and Message.delete
+    message = models.ForeignKey("drf_messages.Message", on_delete=models.DO_NOTHING, related_name="extra_tags")
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="message_tags")
+
+    objects = MessageTagManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["message", "tag"], name="drf_messages_message_tag"),
+        ]
+        indexes = [
+            # semi-join of messages filtered by tag
+            models.Index(fields=["tag", "message"], name="drf_messages_tag_message"),
+        ]
+
+    @property
+    def text(self) -> str:
+        """Text of the tag"""
+        return self.tag.text
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return self.text
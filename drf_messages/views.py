@@ -1,15 +1,39 @@
 # pylint: disable=import-outside-toplevel, inconsistent-return-statements, no-member
+from typing import Optional, Set
+
 from django.contrib.messages import get_messages
 from django.contrib.messages.storage.base import LEVEL_TAGS
-from django.db.models import Count, Max
+from django.db.models import QuerySet
+from django.http import Http404
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from drf_messages.conf import messages_settings
-from drf_messages.serializers import MessageSerializer, MessagePeekSerializer
+from drf_messages.models import SEVERITY_ORDERING
+from drf_messages.search import MessageSearchFilter
+from drf_messages.serializers import MessageDataSerializer, MessageSerializer, MessagePeekSerializer, \
+    MessageStatsSerializer
 from drf_messages.storage import DBStorage
+from drf_messages.stores import DatabaseMessageStore
+
+# Columns loaded for each field of the messages API (the ID and read state, including the user of buffered reads,
+# are always loaded)
+FIELD_COLUMNS = {
+    "id": ("id",),
+    "message": ("message", "broadcast", "broadcast__message"),
+    "level": ("level",),
+    "level_tag": ("level",),
+    "extra_tags": ("broadcast",),
+    "view": ("view",),
+    "read_at": ("read_at",),
+    "expires_at": ("expires_at",),
+    "created": ("created",),
+    "data": ("data",),
+}
 
 
 def get_filter_class():
@@ -21,6 +45,23 @@ def get_filter_class():
         return
 
 
+class MessageOrderingFilter(OrderingFilter):
+    """
+    DRF's ordering filter, ordering "-level" by severity (newest first per level),
+    so the most severe unread messages are read from the unread severity index.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super(MessageOrderingFilter, self).get_ordering(request, queryset, view)
+        return list(SEVERITY_ORDERING) if ordering == ["-level"] else ordering
+
+
+def get_filter_backends():
+    """Use the full-text message search and severity ordering filters in place of DRF's filters"""
+    replacements = {SearchFilter: MessageSearchFilter, OrderingFilter: MessageOrderingFilter}
+    return [replacements.get(backend, backend) for backend in api_settings.DEFAULT_FILTER_BACKENDS]
+
+
 class MessagesViewSet(viewsets.mixins.ListModelMixin,
                       viewsets.mixins.RetrieveModelMixin,
                       viewsets.mixins.DestroyModelMixin,
@@ -29,46 +70,140 @@ class MessagesViewSet(viewsets.mixins.ListModelMixin,
     List, Retrieve and Delete messages for this session.
     """
     serializer_class = MessageSerializer
-    search_fields = ("message",)
+    search_fields = ("message", "broadcast__message")
     ordering_fields = ("level", "read_at", "created")
     filterset_class = get_filter_class()
+    filter_backends = get_filter_backends()
 
-    def get_queryset(self):
+    def get_storage(self) -> DBStorage:
         """
-        Get queryset for all relevant messages
-        :return: QuerySet for drf_messages.Message
+        Get the messages storage of the request.
+        :return: DBStorage object
         :exception ValueError: Messages storage is not configured properly.
         """
         messages: DBStorage = get_messages(self.request)
         if not isinstance(messages, DBStorage):
             raise ValueError("\"drf_messages\" is not installed properly. "
                              "Make sure MESSAGE_STORAGE is set to \"drf_messages.storage.DBStorage\"")
+        return messages
 
-        return messages.get_queryset()
+    def get_queryset(self):
+        """
+        Get queryset for all relevant messages
+        :return: QuerySet for drf_messages.Message (a sequence of messages for stores other than the database)
+        :exception ValueError: Messages storage is not configured properly.
+        """
+        queryset = self.get_storage().get_queryset()
+        if not isinstance(queryset, QuerySet):
+            return queryset
+        # messages read by the read mark of their scope have no read at of their own
+        queryset = queryset.with_read_marks()
+        fields = self.get_requested_fields()
+        if fields is None:
+            if not self.include_data():
+                queryset = queryset.defer("data")
+            # text and tags of broadcast messages are stored in their broadcast
+            return queryset.select_related("broadcast").prefetch_related("tags", "broadcast__tags")
+
+        # load only the columns of the requested fields, and query the tags only when requested
+        columns = {"id", "user", "read_at"}.union(*(FIELD_COLUMNS.get(name, ()) for name in fields))
+        queryset = queryset.only(*columns)
+        if "broadcast" in columns:
+            queryset = queryset.select_related("broadcast")
+        if "extra_tags" in fields:
+            queryset = queryset.prefetch_related("tags", "broadcast__tags")
+        return queryset
+
+    def get_requested_fields(self) -> Optional[Set[str]]:
+        """
+        Get the fields requested by the client using ``?fields=`` (comma separated), when listing or retrieving.
+        :return: Set of field names, or None for all fields.
+        :exception ValidationError: No fields or unknown field names.
+        """
+        if self.action not in ("list", "retrieve") or "fields" not in self.request.query_params:
+            return None
+        fields = {name.strip() for name in self.request.query_params["fields"].split(",") if name.strip()}
+        if not fields or not fields.issubset(FIELD_COLUMNS):
+            unknown = ", ".join(sorted(fields - set(FIELD_COLUMNS))) or "none requested"
+            raise ValidationError({"fields": f"Unknown fields ({unknown}), "
+                                             f"valid fields are: {', '.join(FIELD_COLUMNS)}."})
+        return fields
+
+    def include_data(self) -> bool:
+        """
+        Check whether the data of messages is loaded, it is deferred unless retrieving a message or requested.
+        :return: True when requested using ``?fields=``, or when retrieving a message without requesting fields.
+        """
+        fields = self.get_requested_fields()
+        return self.action == "retrieve" if fields is None else "data" in fields
+
+    def get_serializer_class(self):
+        serializer_class = super(MessagesViewSet, self).get_serializer_class()
+        if serializer_class is MessageSerializer and self.include_data():
+            return MessageDataSerializer
+        return serializer_class
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs["fields"] = fields
+        return super(MessagesViewSet, self).get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        if isinstance(queryset, QuerySet):
+            return super(MessagesViewSet, self).filter_queryset(queryset)
+        # stores other than the database filter their own messages
+        return self.get_storage().store.list(self.request.query_params)
+
+    def get_object(self):
+        storage = self.get_storage()
+        if isinstance(storage.store, DatabaseMessageStore):
+            return super(MessagesViewSet, self).get_object()
+        obj = storage.store.get(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if obj is None:
+            raise Http404("No message matches the given query.")
+        self.check_object_permissions(self.request, obj)
+        return obj
 
     def check_object_permissions(self, request, obj):
         super(MessagesViewSet, self).check_object_permissions(request, obj)
         # restrict deletion of unread messages.
-        if not messages_settings.MESSAGES_ALLOW_DELETE_UNREAD and self.action == "destroy" and obj.read_at is None:
+        if not messages_settings.MESSAGES_ALLOW_DELETE_UNREAD and self.action == "destroy" and obj.read_time is None:
             raise PermissionDenied("You do not have the permission to delete unread messages")
 
+    def perform_destroy(self, instance):
+        self.get_storage().store.delete(instance)
+
     def list(self, request, *args, **kwargs):
-        response = super(MessagesViewSet, self).list(request, *args, **kwargs)
-        # update read at
         queryset = self.filter_queryset(self.get_queryset())
-
         page = self.paginate_queryset(queryset)
-        if page is not None:
-            queryset.filter(pk__in=map(lambda x: x.pk, page)).mark_read()
-        else:
-            queryset.mark_read()
+        messages = list(queryset) if page is None else page
+        unread_ids = [message.pk for message in messages if message.read_time is None]
+        if messages_settings.MESSAGES_CONSUME_EXACTLY_ONCE:
+            # unread messages claimed by a parallel request are shown only by that request
+            storage = self.get_storage()
+            claimed = storage.store.claim(unread_ids)
+            storage.used = storage.used or bool(claimed)
+            messages = [message for message in messages if message.read_time is not None or message.pk in claimed]
+            unread_ids = []
+        data = self.get_serializer(messages, many=True).data
+        response = Response(data) if page is None else self.get_paginated_response(data)
+        # update read at of the listed messages, after serializing them as unread
+        self._mark_read(unread_ids)
         return response
 
     def retrieve(self, request, *args, **kwargs):
-        response = super(MessagesViewSet, self).retrieve(request, *args, **kwargs)
-        # update read at
-        self.get_object().mark_read(self.request)
-        return response
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        # update read at, after serializing the message as unread
+        if instance.read_time is None:
+            self._mark_read([instance.pk])
+        return Response(data)
+
+    def _mark_read(self, ids):
+        storage = self.get_storage()
+        if storage.store.mark_read(ids):
+            storage.used = True
 
     @action(methods=["GET"], detail=False, description="Get unread messages count and level without reading them.",
             serializer_class=MessagePeekSerializer, pagination_class=None, filterset_class=None)
@@ -76,12 +211,36 @@ class MessagesViewSet(viewsets.mixins.ListModelMixin,
         """
         Get summary about unread message without reading them.
         """
-        summary = self.get_queryset().filter(read_at__isnull=True).aggregate(
-            count=Count("id"),
-            max_level=Max("level"),
-        )
+        summary = self.get_storage().store.peek(cap=self.get_peek_cap())
         serializer = MessagePeekSerializer({
             **summary,
             "max_level_tag": LEVEL_TAGS.get(summary.get("max_level"), '')
         })
         return Response(serializer.data, status.HTTP_200_OK)
+
+    def get_peek_cap(self) -> Optional[int]:
+        """
+        Get the maximum number of unread messages counted by the peek view.
+        :return: The ``cap`` query parameter (up to MESSAGES_PEEK_COUNT_CAP), or MESSAGES_PEEK_COUNT_CAP.
+        """
+        cap = messages_settings.MESSAGES_PEEK_COUNT_CAP
+        if "cap" not in self.request.query_params:
+            return cap
+        try:
+            requested = int(self.request.query_params["cap"])
+        except ValueError:
+            requested = 0
+        if requested < 1:
+            raise ValidationError({"cap": "A positive integer is required."})
+        return requested if cap is None else min(requested, cap)
+
+    @action(methods=["GET"], detail=False, description="Get counts of the user messages by level, tag and view.",
+            serializer_class=MessageStatsSerializer, pagination_class=None, filterset_class=None)
+    def stats(self, request):
+        """
+        Get counts of all messages of the user (from all sessions) by level, tag and view.
+        """
+        stats = self.get_storage().store.stats()
+        if stats is None:
+            raise NotFound("Messages statistics are not enabled.")
+        return Response(MessageStatsSerializer(stats).data, status.HTTP_200_OK)
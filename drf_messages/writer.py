@@ -0,0 +1,229 @@
+import atexit
+import queue
+import threading
+from collections import defaultdict
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from django.contrib.sessions.models import Session
+from django.db import close_old_connections, connections, router
+
+from drf_messages import logger
+from drf_messages.conf import messages_settings
+from drf_messages.models import Message
+
+# Maximum number of queued messages persisted by a worker in a single batch
+WRITE_BATCH_SIZE = 100
+
+_STOP = object()
+
+
+class PendingMessage(NamedTuple):
+    """Message waiting in the queue to be persisted"""
+    user_id: int
+    session_key: str
+    view: str
+    message: str
+    level: int
+    extra_tags: Sequence[str]
+    expires_at: object
+    data: Any = None
+
+    @classmethod
+    def from_request(cls, request, message, level, extra_tags=None, expires_at=None, data=None) -> "PendingMessage":
+        """
+        Capture a new message of a request, without querying the database.
+        :param request: Request context.
+        :param message: Text body of the message.
+        :param level: Integer describing the type of the message.
+        :param extra_tags: One or more tags to attach to the message.
+        :param expires_at: When the message expires (defaults to MESSAGES_DEFAULT_TTL from now).
+        :param data: JSON serializable data of the message.
+        :return: PendingMessage object.
+        """
+        if not extra_tags:
+            extra_tags = []
+        elif not isinstance(extra_tags, (list, tuple, set)):
+            extra_tags = [extra_tags]
+        return cls(
+            user_id=request.user.pk,
+            session_key=(request.session.session_key or "") if hasattr(request, "session") else "",
+            view=request.resolver_match.view_name if request.resolver_match else "",
+            message=message,
+            level=level,
+            extra_tags=[str(tag) for tag in extra_tags],
+            expires_at=Message.objects._get_expires_at(expires_at),
+            data=data,
+        )
+
+
+def write_messages(messages: List[PendingMessage]) -> List[Message]:
+    """
+    Persist pending messages in bulk, grouped by the database (or shard) of each user.
+    :param messages: Messages to persist.
+    :return: Created message objects.
+    """
+    sessions = set(Session.objects.filter(
+        session_key__in={message.session_key for message in messages if message.session_key},
+    ).values_list("session_key", flat=True))
+
+    shards = defaultdict(list)
+    for pending in messages:
+        message = Message(
+            user_id=pending.user_id,
+            session_id=pending.session_key if pending.session_key in sessions else None,
+            session_key=pending.session_key,
+            view=pending.view,
+            message=pending.message,
+            level=pending.level,
+            expires_at=pending.expires_at,
+            data=pending.data,
+        )
+        shards[router.db_for_write(Message, user_id=pending.user_id)].append((message, pending.extra_tags))
+
+    created = []
+    for using, shard_messages in shards.items():
+        created.extend(Message.objects.db_manager(using).bulk_create_messages(shard_messages))
+    logger.debug(f"Wrote {len(messages)} pending messages")
+    return created
+
+
+class MessageWriter:
+    """
+    Persist messages in the background, using a bounded queue consumed by a pool of worker threads.
+    Workers group queued messages into bulk inserts of up to WRITE_BATCH_SIZE messages.
+    """
+
+    def __init__(self, queue_size: int, workers: int, backpressure: str = "block"):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.backpressure = backpressure
+        # number of queued messages per user, for reads waiting for their own writes
+        self.pending = defaultdict(int)
+        self.condition = threading.Condition()
+        self.threads = [
+            threading.Thread(target=self._work, name=f"drf_messages_writer_{i}", daemon=True)
+            for i in range(max(workers, 1))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, message: PendingMessage) -> bool:
+        """
+        Queue a message to be persisted by the workers.
+        When the queue is full, blocks until there is room, or refuses the message (backpressure "sync").
+        :param message: Message to persist.
+        :return: True when queued, otherwise the message should be persisted synchronously.
+        """
+        with self.condition:
+            self.pending[message.user_id] += 1
+        try:
+            self.queue.put(message, block=self.backpressure == "block")
+        except queue.Full:
+            self._done([message])
+            logger.warning("Messages write queue is full, writing message synchronously")
+            return False
+        return True
+
+    def wait_for(self, user_id, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the queued messages of a user to be persisted.
+        :param user_id: Primary key of the user.
+        :param timeout: Maximum seconds to wait, None for no limit.
+        :return: True when no messages of the user are pending.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending.get(user_id), timeout)
+
+    def flush(self) -> None:
+        """Wait for all queued messages to be persisted"""
+        self.queue.join()
+
+    def close(self) -> None:
+        """Persist all queued messages and stop the workers"""
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def _done(self, messages: List[PendingMessage]) -> None:
+        with self.condition:
+            for message in messages:
+                self.pending[message.user_id] -= 1
+                if not self.pending[message.user_id]:
+                    del self.pending[message.user_id]
+            self.condition.notify_all()
+
+    def _work(self):
+        stop = False
+        while not stop:
+            batch = []
+            item = self.queue.get()
+            while True:
+                if item is _STOP:
+                    stop = True
+                    self.queue.task_done()
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= WRITE_BATCH_SIZE:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    # connections of the worker threads are not closed at the end of requests
+                    close_old_connections()
+                    write_messages(batch)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception(f"Failed to write {len(batch)} queued messages")
+                finally:
+                    self._done(batch)
+                    for _ in batch:
+                        self.queue.task_done()
+        connections.close_all()
+
+
+_writer: Optional[MessageWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> MessageWriter:
+    """
+    Get the message writer of this process, starting its workers on first use.
+    :return: MessageWriter object.
+    """
+    global _writer  # pylint: disable=global-statement
+    with _writer_lock:
+        if _writer is None:
+            _writer = MessageWriter(
+                queue_size=messages_settings.MESSAGES_ASYNC_QUEUE_SIZE,
+                workers=messages_settings.MESSAGES_ASYNC_WORKERS,
+                backpressure=messages_settings.MESSAGES_ASYNC_BACKPRESSURE,
+            )
+        return _writer
+
+
+def wait_for(user_id) -> None:
+    """
+    Wait (up to MESSAGES_ASYNC_READ_WAIT_SECONDS) for the messages of a user queued by this process to be persisted.
+    :param user_id: Primary key of the user.
+    """
+    if _writer is not None and not _writer.wait_for(user_id, messages_settings.MESSAGES_ASYNC_READ_WAIT_SECONDS):
+        logger.warning(f"Timed out waiting for queued messages of user {user_id} to be written")
+
+
+def flush() -> None:
+    """Wait for all messages queued by this process to be persisted (e.g. in tests)"""
+    if _writer is not None:
+        _writer.flush()
+
+
+@atexit.register
+def shutdown() -> None:
+    """Persist all messages queued by this process and stop the writer workers (called on process exit)"""
+    global _writer  # pylint: disable=global-statement
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
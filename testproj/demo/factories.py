@@ -4,11 +4,19 @@ from factory.django import DjangoModelFactory
 from factory.fuzzy import FuzzyChoice
 
 from demo.user_factories import UserFactory
-from drf_messages.models import Message, MessageTag
+from drf_messages.models import Message, MessageTag, Tag
 
 
-class MessageTagFactory(DjangoModelFactory):
+class TagFactory(DjangoModelFactory):
     text = Faker("word")
+
+    class Meta:
+        model = Tag
+        django_get_or_create = ("text",)
+
+
+class MessageTagFactory(DjangoModelFactory):
+    tag = SubFactory(TagFactory)
     message = SubFactory("demo.factories.MessageFactory")
 
     class Meta:
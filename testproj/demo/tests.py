@@ -1,19 +1,51 @@
 # pylint: disable=missing-function-docstring, protected-access, no-member, not-context-manager
+import difflib
+import json
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
 from typing import Tuple, List
+from unittest import mock
 
 from django.contrib import messages
+from django.contrib.auth import get_user_model
 from django.contrib.messages import get_messages, set_level
 from django.contrib.messages.storage.base import Message as DjangoMessage
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
 from django.db.models import F
-from django.test import override_settings, modify_settings, TestCase, TransactionTestCase
+from django.http import HttpResponse, QueryDict
+from django.test import override_settings, modify_settings, RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework import status
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.request import Request
 from rest_framework.test import APITestCase
 
 from demo.factories import MessageFactory
-from demo.user_factories import UserFactory
-from drf_messages.models import Message
+from demo.user_factories import UserFactory, AdminFactory
+import drf_messages
+from drf_messages import writer
+from drf_messages.conf import messages_settings
+from drf_messages.admin import TagListFilter
+from drf_messages.fields import COMPRESSED_PAYLOAD, RAW_PAYLOAD
+from drf_messages.management.commands.messages_explain import find_flags
+from drf_messages.models import Broadcast, Message, MessageReadMark, MessageStats, MessageTag, Tag, _scope_inserts
+from drf_messages.reads import flush_reads, read_buffer
+from drf_messages.routers import get_shard
 from drf_messages.storage import DBStorage
+from drf_messages.stores import DatabaseMessageStore, MemoryMessageStore
+from drf_messages.views import MessagesViewSet
 
 
 class MessageDRFViewsTests(APITestCase):
@@ -53,7 +85,7 @@ class MessageDRFViewsTests(APITestCase):
         self.assertEqual(response.data.get("level"), self.message.level)
         self.assertEqual(response.data.get("level_tag"), self.message.level_tag)
         self.assertEqual(response.data.get("view"), self.message.view)
-        self.assertEqual(response.data.get("extra_tags"), list(self.message.extra_tags.values_list("text", flat=True)))
+        self.assertEqual(response.data.get("extra_tags"), list(self.message.tags.values_list("text", flat=True)))
         self.assertTrue(response.data.get("created"))
         self.assertEqual(response.data.get("read_at"), None)
         self.message.refresh_from_db()
@@ -67,6 +99,7 @@ class MessageDRFViewsTests(APITestCase):
             count=1,
             max_level=self.message.level,
             max_level_tag=self.message.level_tag,
+            capped=False,
         ))
         # create higher level message
         Message.objects.create_user_message(self.user, "warning message", messages.ERROR)
@@ -77,6 +110,7 @@ class MessageDRFViewsTests(APITestCase):
             count=2,
             max_level=40,
             max_level_tag="error",
+            capped=False,
         ))
 
     @override_settings(MESSAGES_DELETE_READ=True)
@@ -286,6 +320,31 @@ class StorageTestCase(TestCase):
         self.assertEqual(len(storage), 5, msg="Messages not marked as read after slicing")
         self.assertTrue(storage.used)
 
+    def test_iteration_queries(self):
+        Message.objects.bulk_create(MessageFactory.build(user=self.user) for _ in range(9))
+        storage: DBStorage = get_messages(self.request)
+        with self.assertNumQueries(3):  # messages, tags and update
+            loaded = list(iter(storage))  # avoid len() call of list(storage)
+        self.assertEqual(len(loaded), 10)
+        self.assertTrue(all(isinstance(message, DjangoMessage) for message in loaded))
+        self.assertEqual(loaded[-1].extra_tags, "test")
+
+    @override_settings(MESSAGES_MAX_DISPLAY=3)
+    def test_iteration_max_display(self):
+        Message.objects.bulk_create(MessageFactory.build(user=self.user) for _ in range(4))
+        storage: DBStorage = get_messages(self.request)
+        self.assertEqual(len(list(storage)), 3)
+        self.assertEqual(len(storage), 2, msg="Only displayed messages should be marked read")
+
+    def test_get_item(self):
+        storage: DBStorage = get_messages(self.request)
+        message = storage[0]
+        self.assertEqual(message.message, "Hello world!")
+        self.assertEqual(message.extra_tags, "test")
+        self.assertEqual(len(storage), 0)
+        with self.assertRaises(IndexError):
+            _ = storage[0]
+
     def test_contains_message_obj(self):
         message = Message.objects.get(user=self.user)
         storage: DBStorage = get_messages(self.request)
@@ -504,3 +563,1562 @@ class SessionEngineTestCase(TestCase):
                 with self.settings(SESSION_ENGINE=engine):
                     Message.objects.all().delete()
                     self.subtest_message_with_session_engine(1, 1 if is_db else 0)
+
+
+class UnreadLimitTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        _scope_inserts.clear()
+
+    @override_settings(MESSAGES_MAX_UNREAD_PER_SCOPE=3, MESSAGES_MAX_UNREAD_CHECK_INTERVAL=1)
+    def test_evict_oldest_unread(self):
+        created = [Message.objects.create_user_message(self.user, f"message {i}", messages.INFO) for i in range(5)]
+        unread = Message.objects.filter(user=self.user, read_at__isnull=True)
+        self.assertEqual(set(unread.values_list("pk", flat=True)), {m.pk for m in created[2:]})
+
+    @override_settings(MESSAGES_MAX_UNREAD_PER_SCOPE=3, MESSAGES_MAX_UNREAD_CHECK_INTERVAL=5)
+    def test_amortized_check(self):
+        with self.assertNumQueries(1):
+            Message.objects.create_user_message(self.user, "message", messages.INFO)  # no check on first insert
+
+        for _ in range(3):
+            Message.objects.create_user_message(self.user, "message", messages.INFO)
+        self.assertEqual(Message.objects.filter(user=self.user, read_at__isnull=True).count(), 4)
+        # fifth message triggers the check
+        Message.objects.create_user_message(self.user, "message", messages.INFO)
+        self.assertEqual(Message.objects.filter(user=self.user, read_at__isnull=True).count(), 3)
+
+    @override_settings(MESSAGES_MAX_UNREAD_PER_SCOPE=2, MESSAGES_MAX_UNREAD_CHECK_INTERVAL=100)
+    def test_bounded_eviction(self):
+        backlog = MessageFactory.create_batch(9, user=self.user)
+        unread = Message.objects.filter(user=self.user, read_at__isnull=True)
+        with mock.patch("drf_messages.models.UNREAD_EVICTION_BATCH_SIZE", 3):
+            # a statement evicts at most 3 of the oldest messages, and the next creation continues the eviction
+            self.assertEqual(Message.objects.enforce_unread_limit(self.user, created=100), 3)
+            self.assertEqual(set(unread.values_list("pk", flat=True)), {m.pk for m in backlog[3:]})
+            Message.objects.create_user_message(self.user, "message", messages.INFO)
+            self.assertEqual(unread.count(), 4)
+            Message.objects.create_user_message(self.user, "message", messages.INFO)
+            self.assertEqual(unread.count(), 2)
+            # the backlog is evicted, checks are amortized again
+            with self.assertNumQueries(1):
+                Message.objects.create_user_message(self.user, "message", messages.INFO)
+
+    @override_settings(MESSAGES_MAX_UNREAD_PER_SCOPE=0, MESSAGES_MAX_UNREAD_CHECK_INTERVAL=1)
+    def test_unlimited(self):
+        for _ in range(5):
+            Message.objects.create_user_message(self.user, "message", messages.INFO)
+        self.assertEqual(Message.objects.filter(user=self.user, read_at__isnull=True).count(), 5)
+
+
+class MessageExpiryTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.response = self.client.get(reverse('demo:blank'))
+        self.request = self.response.wsgi_request
+
+    def test_expired_message_hidden(self):
+        Message.objects.create_user_message(self.user, "expired", messages.INFO,
+                                            expires_at=timezone.now() - timedelta(minutes=1))
+        Message.objects.create_user_message(self.user, "valid", messages.INFO,
+                                            expires_at=timezone.now() + timedelta(minutes=1))
+        storage: DBStorage = get_messages(self.request)
+        self.assertEqual(len(storage), 1)
+        self.assertTrue("valid" in storage)
+        self.assertFalse("expired" in storage)
+
+    @override_settings(MESSAGES_DEFAULT_TTL=60)
+    def test_default_ttl(self):
+        get_messages(self.request).add(messages.INFO, "Hello world!")
+        message = Message.objects.get(user=self.user)
+        self.assertAlmostEqual(message.expires_at, timezone.now() + timedelta(seconds=60), delta=timedelta(seconds=5))
+
+    def test_storage_expires_at(self):
+        expires_at = timezone.now() + timedelta(hours=1)
+        get_messages(self.request).add(messages.INFO, "Hello world!", expires_at=expires_at)
+        self.assertEqual(Message.objects.get(user=self.user).expires_at, expires_at)
+
+    def test_sweep_command(self):
+        Message.objects.bulk_create(
+            MessageFactory.build(user=self.user, expires_at=timezone.now() - timedelta(minutes=1)) for _ in range(5)
+        )
+        Message.objects.create_user_message(self.user, "valid", messages.INFO)
+        out = StringIO()
+        call_command("messages_sweep", batch_size=2, stdout=out)
+        self.assertIn("Deleted 5 expired messages", out.getvalue())
+        self.assertEqual(list(Message.objects.values_list("message", flat=True)), ["valid"])
+
+
+@override_settings(MESSAGES_READ_DB="replica")
+class ReadReplicaTestCase(TestCase):
+    databases = {"default", "replica"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.response = self.client.get(reverse('demo:test'))  # creates a message on the primary database
+        self.request = self.response.wsgi_request
+
+    def test_read_your_writes(self):
+        storage: DBStorage = get_messages(self.request)
+        self.assertEqual(storage.get_unread_queryset().db, "default")
+        self.assertEqual(len(storage), 1)
+
+    def test_read_from_replica(self):
+        cache.clear()  # sticky window is over
+        storage: DBStorage = get_messages(self.request)
+        self.assertEqual(storage.get_unread_queryset().db, "replica")
+        self.assertEqual(len(storage), 0)  # replica is not synced in tests
+        response = self.client.get(reverse('drf_messages:messages-peek'))
+        self.assertEqual(response.data.get("count"), 0)
+
+    def test_mark_read_sticks_to_primary(self):
+        cache.clear()
+        message = Message.objects.using("default").get(user=self.user)
+        message.mark_read(self.request)
+        storage: DBStorage = get_messages(self.request)
+        self.assertEqual(storage.get_queryset().db, "default")
+        self.assertIsNotNone(storage.get_queryset().get(pk=message.pk).read_at)
+
+    @override_settings(MESSAGES_READ_DB_STICKY_SECONDS=0)
+    def test_writes_to_primary(self):
+        messages.info(self.request, "Hello again!")
+        self.assertEqual(Message.objects.using("default").filter(user=self.user).count(), 2)
+        self.assertEqual(Message.objects.using("replica").filter(user=self.user).count(), 0)
+
+
+@override_settings(MESSAGES_USE_SESSIONS=True)
+class SessionQueryPlanTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.response = self.client.get(reverse('demo:test'))
+        self.request = self.response.wsgi_request
+
+    def test_session_filter_uses_index(self):
+        storage: DBStorage = get_messages(self.request)
+        plan = storage.get_unread_queryset().explain()
+        self.assertIn("drf_messages_user_session", plan)
+        self.assertNotIn("SCAN drf_messages_message\n", f"{plan}\n")
+
+    def test_messages_without_session(self):
+        Message.objects.create_user_message(self.user, "user message", messages.INFO)
+        storage: DBStorage = get_messages(self.request)
+        self.assertEqual(len(storage), 2)
+        self.assertEqual(Message.objects.get(message="user message").session_key, "")
+
+
+class MessageCascadeTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        Message.objects.bulk_create(MessageFactory.build(user=self.user) for _ in range(5))
+        for message in Message.objects.all():
+            message.add_tag(["tag1", "tag2"])
+
+    @staticmethod
+    def _message_queries(queries):
+        return [q["sql"] for q in queries if "drf_messages_message" in q["sql"]]
+
+    def test_delete_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.user.delete()
+
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(MessageTag.objects.exists())
+        # messages are never loaded into memory
+        self.assertFalse(any('"drf_messages_message"."message"' in sql for sql in self._message_queries(queries)))
+
+    def test_clear_sessions(self):
+        session_keys = []
+        for _ in range(5):
+            session = SessionStore()
+            session.create()
+            session_keys.append(session.session_key)
+            Message.objects.bulk_create(
+                MessageFactory.build(user=self.user, session_id=session.session_key) for _ in range(3)
+            )
+        Session.objects.update(expire_date=timezone.now() - timedelta(days=1))
+
+        # sessions are fast deleted, their messages are deleted by the orphans sweep
+        with CaptureQueriesContext(connection) as queries:
+            call_command("clearsessions")
+        self.assertFalse(self._message_queries(queries))
+        self.assertFalse([query for query in queries if query["sql"].startswith("SELECT")])
+
+        out = StringIO()
+        call_command("messages_sweep", "--orphans", stdout=out)
+        self.assertIn("Deleted 15 messages of deleted users and sessions", out.getvalue())
+        self.assertFalse(Message.objects.filter(session_key__in=session_keys).exists())
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 5)
+
+    def test_rolled_back_savepoint(self):
+        other = UserFactory()
+        Message.objects.bulk_create(MessageFactory.build(user=other) for _ in range(3))
+        user_id, other_id = self.user.pk, other.pk
+        with transaction.atomic():
+            self.user.delete()
+            try:
+                with transaction.atomic():
+                    other.delete()
+                    raise RuntimeError("rollback")
+            except RuntimeError:
+                pass
+
+        self.assertTrue(get_user_model().objects.filter(pk=other_id).exists())
+        self.assertEqual(Message.objects.filter(user_id=other_id).count(), 3)
+        self.assertFalse(Message.objects.filter(user_id=user_id).exists())
+
+    @override_settings(MESSAGES_PURGE_BATCH_SIZE=2)
+    def test_rolled_back_transaction(self):
+        users = UserFactory.create_batch(3)
+        Message.objects.bulk_create(MessageFactory.build(user=user) for user in users)
+        kept = users[0].pk
+        try:
+            with transaction.atomic():
+                users[0].delete()
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+        with transaction.atomic():
+            get_user_model().objects.filter(pk__in=[user.pk for user in users[1:]] + [self.user.pk]).delete()
+            # messages are purged after commit
+            self.assertTrue(Message.objects.filter(user__in=users[1:]).exists())
+        self.assertEqual(list(Message.objects.values_list("user_id", flat=True)), [kept])
+
+    @override_settings(MESSAGES_READ_MARKS=True, MESSAGES_USE_SESSIONS=True)
+    def test_sweep_orphan_read_marks(self):
+        session = SessionStore()
+        session.create()
+        MessageReadMark.objects.create(user=self.user, session_key=session.session_key, last_read_id=1,
+                                       read_at=timezone.now())
+        MessageReadMark.objects.create(user=self.user, session_key="", last_read_id=1, read_at=timezone.now())
+        session.delete()
+        out = StringIO()
+        call_command("messages_sweep", "--orphans", stdout=out)
+        self.assertIn("Deleted 1 read marks of deleted users and sessions", out.getvalue())
+        self.assertEqual(list(MessageReadMark.objects.values_list("session_key", flat=True)), [""])
+
+    def test_sweep_orphans(self):
+        session = SessionStore()
+        session.create()
+        other = UserFactory()
+        Message.objects.bulk_create(MessageFactory.build(user=other, session_id=session.session_key) for _ in range(2))
+        # deleted without signals, as by raw SQL
+        get_user_model().objects.filter(pk=self.user.pk)._raw_delete("default")
+        Session.objects.filter(pk=session.session_key)._raw_delete("default")
+
+        out = StringIO()
+        call_command("messages_sweep", "--orphans", "--batch-size", "1", stdout=out)
+        self.assertIn("Deleted 7 messages of deleted users and sessions", out.getvalue())
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(MessageTag.objects.exists())
+
+    def test_delete_queryset(self):
+        with self.assertNumQueries(3):  # transaction, tags and messages
+            count, deleted = Message.objects.filter(user=self.user).delete()
+        self.assertEqual(count, 15)
+        self.assertEqual(deleted, {"drf_messages.Message": 5, "drf_messages.MessageTag": 10})
+        self.assertFalse(MessageTag.objects.exists())
+
+    def test_delete_instance(self):
+        message = Message.objects.first()
+        message.delete()
+        self.assertFalse(MessageTag.objects.filter(message_id=message.pk).exists())
+        self.assertEqual(Message.objects.count(), 4)
+
+
+class MessageAdminTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = AdminFactory()
+        cls.user = UserFactory()
+        Message.objects.bulk_create(MessageFactory.build(user=cls.user) for _ in range(5))
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelist(self):
+        response = self.client.get(reverse("admin:drf_messages_message_changelist"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, self.user.username)
+
+    def test_changelist_filters(self):
+        response = self.client.get(reverse("admin:drf_messages_message_changelist"),
+                                   dict(level=messages.INFO, read_at__isnull="True"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context["cl"].result_count, Message.objects.filter(level=messages.INFO).count())
+
+    def test_tag_filter_cap(self):
+        for i, message in enumerate(Message.objects.order_by("pk")[:3]):
+            message.add_tag(f"tag{i}")
+        with mock.patch("drf_messages.admin.TAG_FILTER_MAX_LOOKUPS", 2):
+            response = self.client.get(reverse("admin:drf_messages_message_changelist"), dict(tag="tag2"))
+        self.assertEqual(response.context["cl"].result_count, 1)
+        tag_filter = next(spec for spec in response.context["cl"].filter_specs if isinstance(spec, TagListFilter))
+        self.assertIn("first 2", tag_filter.title)
+        self.assertEqual([choice["display"] for choice in tag_filter.choices(response.context["cl"])
+                          if choice["selected"]], ["tag2"])
+
+    def test_search_invalid_user_id(self):
+        response = self.client.get(reverse("admin:drf_messages_message_changelist"), dict(q="nobody"))
+        self.assertEqual(response.context["cl"].result_count, 0)
+        self.assertContains(response, "Messages are searched by user ID")
+
+    def test_mark_read_action(self):
+        response = self.client.post(reverse("admin:drf_messages_message_changelist"), {
+            "action": "mark_read",
+            "_selected_action": list(Message.objects.values_list("pk", flat=True)[:3]),
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(Message.objects.filter(read_at__isnull=False).count(), 3)
+
+    def test_purge_action(self):
+        message = Message.objects.first()
+        message.add_tag("tag")
+        response = self.client.post(reverse("admin:drf_messages_message_changelist"), {
+            "action": "purge",
+            "_selected_action": [message.pk],
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(Message.objects.filter(pk=message.pk).exists())
+        self.assertFalse(MessageTag.objects.filter(message_id=message.pk).exists())
+
+
+class MessageSearchTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+        Message.objects.bulk_create([
+            MessageFactory.build(user=cls.user, message="Your order has shipped"),
+            MessageFactory.build(user=cls.user, message="Order order order"),
+            MessageFactory.build(user=cls.user, message="Password changed"),
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, text: str) -> List[str]:
+        response = self.client.get(reverse("drf_messages:messages-list"), dict(search=text))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result.get("message") for result in response.data.get("results")]
+
+    def test_prefix_search(self):
+        self.assertEqual(set(self.search("ord")), {"Your order has shipped", "Order order order"})
+        self.assertEqual(self.search("pass chan"), ["Password changed"])
+        self.assertEqual(self.search("shipped password"), [])
+
+    def test_search_rank(self):
+        self.assertEqual(self.search("order"), ["Order order order", "Your order has shipped"])
+
+    def test_search_syntax(self):
+        self.assertEqual(self.search('"order OR NOT*'), [])
+
+    def test_search_sync(self):
+        message = Message.objects.get(message="Password changed")
+        message.message = "Email changed"
+        message.save()
+        self.assertEqual(self.search("password"), [])
+        self.assertEqual(self.search("email"), ["Email changed"])
+
+        message.delete()
+        self.assertEqual(self.search("changed"), [])
+
+    @override_settings(MESSAGES_SEARCH_BACKEND=None)
+    def test_search_fallback(self):
+        self.assertEqual(self.search("has shipped"), ["Your order has shipped"])
+
+    def test_search_broadcast(self):
+        Broadcast.objects.create_broadcast(get_user_model().objects.filter(pk=self.user.pk), "Order system maintenance",
+                                           messages.WARNING)
+        self.assertEqual(set(self.search("maint")), {"Order system maintenance"})
+        self.assertEqual(set(self.search("order")),
+                         {"Order order order", "Your order has shipped", "Order system maintenance"})
+        with override_settings(MESSAGES_SEARCH_BACKEND=None):
+            self.assertEqual(self.search("maint"), ["Order system maintenance"])
+
+
+class MessageTagTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_intern_tags(self):
+        first = Message.objects.create_user_message(self.user, "first", messages.INFO, extra_tags=["a", "b", "a"])
+        second = Message.objects.create_user_message(self.user, "second", messages.INFO, extra_tags="a")
+        self.assertEqual(Tag.objects.filter(text__in=("a", "b")).count(), 2)
+        self.assertEqual(first.get_django_message().extra_tags, "a b")
+        self.assertEqual(second.get_django_message().extra_tags, "a")
+
+        # interning existing tags creates only the message tags
+        with self.assertNumQueries(2):
+            MessageTag.objects.create_tags(second, ["a", "b"])
+        self.assertEqual(second.get_django_message().extra_tags, "a b")
+
+    def test_tag_text_queries(self):
+        message = Message.objects.create_user_message(self.user, "tagged", messages.INFO, extra_tags=["a", "b", "c"])
+        # the tags are joined, not queried per message tag
+        with self.assertNumQueries(1):
+            self.assertCountEqual([tag.text for tag in message.extra_tags.all()], ["a", "b", "c"])
+        with self.assertNumQueries(1):
+            self.assertCountEqual([str(tag) for tag in MessageTag.objects.filter(message=message)], ["a", "b", "c"])
+
+    def test_filter_tags(self):
+        message = Message.objects.create_user_message(self.user, "tagged", messages.INFO, extra_tags=["a", "b"])
+        Message.objects.create_user_message(self.user, "other", messages.INFO, extra_tags="c")
+
+        self.assertEqual(list(Message.objects.all().with_tag("a")), [message])
+        response = self.client.get(reverse("drf_messages:messages-list"), dict(extra_tags="b"))
+        self.assertEqual(response.data.get("count"), 1)
+        self.assertCountEqual(response.data["results"][0].get("extra_tags"), ["a", "b"])
+
+
+@override_settings(MESSAGES_SHARDS=["shard_1", "shard_2"])
+class ShardingTestCase(TransactionTestCase):
+    databases = {"default", "shard_1", "shard_2"}
+
+    def setUp(self):
+        self.users = UserFactory.create_batch(4)
+        for user in self.users:
+            Message.objects.create_user_message(user, f"Hello {user.username}", messages.INFO, extra_tags="shard")
+
+    def test_messages_stored_in_user_shard(self):
+        for user in self.users:
+            shard = get_shard(user.pk)
+            other = ({"shard_1", "shard_2"} - {shard}).pop()
+            self.assertEqual(Message.objects.using(shard).filter(user=user).count(), 1)
+            self.assertFalse(Message.objects.using(other).filter(user=user).exists())
+            self.assertEqual(Message.objects.using(shard).get(user=user).get_django_message().extra_tags, "shard")
+        self.assertFalse(Message.objects.using("default").exists())
+        self.assertEqual(len({get_shard(user.pk) for user in UserFactory.create_batch(10)}), 2)
+
+    def test_read_from_user_shard(self):
+        for user in self.users:
+            self.client.force_login(user)
+            response = self.client.get(reverse("drf_messages:messages-list"))
+            self.assertEqual(response.data.get("count"), 1)
+            self.assertEqual(response.data["results"][0].get("message"), f"Hello {user.username}")
+            response = self.client.get(reverse("drf_messages:messages-detail",
+                                               kwargs=dict(pk=response.data["results"][0].get("id"))))
+            self.assertIsNotNone(Message.objects.using(get_shard(user.pk)).get(user=user).read_at)
+
+    def test_request_message(self):
+        user = self.users[0]
+        self.client.force_login(user)
+        self.client.get(reverse('demo:test'))
+        self.assertEqual(Message.objects.using(get_shard(user.pk)).filter(user=user).count(), 2)
+
+    def test_sweep_all_shards(self):
+        for alias in ("shard_1", "shard_2"):
+            Message.objects.using(alias).update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command("messages_sweep", stdout=out)
+        self.assertIn("Deleted 4 expired messages", out.getvalue())
+
+    def test_purge_deleted_user(self):
+        user = self.users[0]
+        user.delete()
+        self.assertFalse(Message.objects.using(get_shard(user.pk)).filter(user_id=user.pk).exists())
+        self.assertEqual(sum(Message.objects.using(alias).count() for alias in ("shard_1", "shard_2")), 3)
+
+    def test_admin_shard_filter(self):
+        self.client.force_login(AdminFactory())
+        for alias in ("shard_1", "shard_2"):
+            response = self.client.get(reverse("admin:drf_messages_message_changelist"), dict(shard=alias))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.context["cl"].result_count, Message.objects.using(alias).count())
+
+    def test_admin_default_shard(self):
+        self.client.force_login(AdminFactory())
+        response = self.client.get(reverse("admin:drf_messages_message_changelist"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context["cl"].result_count, Message.objects.using("shard_1").count())
+        self.assertIn("shard_1", response.context["title"])
+        shard_filter = next(spec for spec in response.context["cl"].filter_specs if spec.parameter_name == "shard")
+        self.assertEqual([choice["display"] for choice in shard_filter.choices(response.context["cl"])
+                          if choice["selected"]], ["shard_1"])
+
+    def test_admin_search_user_shard(self):
+        self.client.force_login(AdminFactory())
+        for user in self.users:
+            response = self.client.get(reverse("admin:drf_messages_message_changelist"), dict(q=user.pk))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(get_shard(user.pk), response.context["title"])
+            self.assertEqual([message.user_id for message in response.context["cl"].result_list], [user.pk])
+        response = self.client.get(reverse("admin:drf_messages_message_changelist"), dict(q="nobody"))
+        self.assertEqual(response.context["cl"].result_count, 0)
+
+
+@override_settings(MESSAGES_ASYNC_WRITES=True)
+class AsyncWriterTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        self.request = self.client.get(reverse('demo:blank')).wsgi_request
+
+    def tearDown(self):
+        writer.shutdown()
+
+    def test_background_write(self):
+        with self.assertNumQueries(0):
+            for i in range(20):
+                messages.info(self.request, f"Message {i}", extra_tags=["async", f"tag{i}"])
+        writer.flush()
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 20)
+        message = Message.objects.get(message="Message 3")
+        self.assertEqual(message.get_django_message().extra_tags, "async tag3")
+        self.assertEqual(Message.objects.filter(user=self.user).with_tag("async").count(), 20)
+
+    def test_read_your_writes(self):
+        messages.info(self.request, "Hello world!")
+        storage: DBStorage = get_messages(self.request)
+        self.assertEqual(len(storage), 1)
+        self.assertEqual([message.message for message in storage], ["Hello world!"])
+
+    @override_settings(MESSAGES_ASYNC_READ_WAIT_SECONDS=0)
+    def test_reads_do_not_wait(self):
+        messages.info(self.request, "Hello world!")
+        writer.flush()
+        with mock.patch.object(writer.get_writer(), "wait_for") as wait_for:
+            self.client.get(reverse("drf_messages:messages-list"))
+            list(get_messages(self.request))
+        wait_for.assert_not_called()
+
+    def test_backpressure_sync(self):
+        with override_settings(MESSAGES_ASYNC_BACKPRESSURE="sync"), \
+                mock.patch.object(writer.get_writer().queue, "put", side_effect=queue.Full):
+            messages.info(self.request, "Hello world!")
+        self.assertTrue(Message.objects.filter(user=self.user, message="Hello world!").exists())
+        self.assertTrue(writer.get_writer().wait_for(self.user.pk, timeout=0))
+
+    def test_shutdown_writes_queued_messages(self):
+        for i in range(5):
+            messages.info(self.request, f"Message {i}")
+        writer.shutdown()
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 5)
+
+
+class MessageBatchTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.request = self.client.get(reverse('demo:blank')).wsgi_request
+
+    def test_batch_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            with drf_messages.batch(self.request):
+                for i in range(1000):
+                    messages.success(self.request, f"Row {i}")
+                self.assertFalse(Message.objects.filter(user=self.user).exists())
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 1000)
+        # bulk inserts are split by the SQLite limit of query parameters
+        self.assertLess(len(queries), 20)
+
+    def test_batch_tags(self):
+        with drf_messages.batch(self.request):
+            messages.info(self.request, "first", extra_tags=["a", "b"])
+            messages.info(self.request, "second")
+            messages.info(self.request, "third", extra_tags="a")
+        self.assertEqual([m.extra_tags for m in get_messages(self.request)], ["a", "", "a b"])
+
+    def test_batch_limit(self):
+        with drf_messages.batch(self.request, limit=3):
+            for i in range(10):
+                messages.add_message(self.request, messages.ERROR if i == 5 else messages.INFO, f"Row {i}")
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 4)
+        summary = Message.objects.get(message="And 7 more messages.")
+        self.assertEqual(summary.level, messages.ERROR)
+
+    def test_nested_batch(self):
+        with drf_messages.batch(self.request):
+            with drf_messages.batch(self.request):
+                messages.info(self.request, "Hello world!")
+            self.assertFalse(Message.objects.filter(user=self.user).exists())
+        self.assertTrue(Message.objects.filter(user=self.user).exists())
+
+    def test_batch_decorator(self):
+        @drf_messages.batch(limit=1)
+        def view(request):
+            messages.info(request, "first")
+            messages.info(request, "second")
+            return Message.objects.filter(user=self.user).count()
+
+        self.assertEqual(view(self.request), 0)
+        self.assertEqual(Message.objects.filter(user=self.user).count(), 2)
+
+
+class ExplainCommandTestCase(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command("messages_explain", "--check", stdout=out)
+        for name in ("with_context", "get_unread_queryset", "tag filter", "peek", "peek capped count"):
+            self.assertIn(f"== {name} (default) ==", out.getvalue())
+        self.assertNotIn("SCAN:", out.getvalue())
+
+    def test_hot_queries_use_indexes_with_sessions(self):
+        out = StringIO()
+        call_command("messages_explain", "--check", "--use-sessions", stdout=out)
+        self.assertIn("drf_messages_user_session", out.getvalue())
+
+    def test_flag_scans(self):
+        scans, temps = find_flags("sqlite", [
+            "2 0 0 SCAN drf_messages_message",
+            "4 0 0 SEARCH drf_messages_message USING INDEX drf_messages_user_session (user_id=?)",
+            "8 0 0 SCAN drf_messages_message_fts VIRTUAL TABLE INDEX 0:M1",
+            "9 0 0 USE TEMP B-TREE FOR ORDER BY",
+        ])
+        self.assertEqual(scans, ["2 0 0 SCAN drf_messages_message"])
+        self.assertEqual(temps, ["9 0 0 USE TEMP B-TREE FOR ORDER BY"])
+
+
+@override_settings(MESSAGES_STATS=True, MESSAGES_ALLOW_DELETE_UNREAD=True)
+class MessageStatsTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_stats(self):
+        return set(MessageStats.objects.filter(count__gt=0).values_list("user_id", "kind", "key", "count", "unread"))
+
+    def test_incremental_stats(self):
+        request = self.client.get(reverse('demo:blank')).wsgi_request
+        first = Message.objects.create_user_message(self.user, "first", messages.INFO, extra_tags=["a", "b"])
+        Message.objects.create_message(request, "second", messages.ERROR, extra_tags="a")
+        with drf_messages.batch(request):
+            messages.info(request, "third", extra_tags="b")
+            messages.warning(request, "fourth")
+        first.add_tag("c")
+        first.add_tag("a")
+        first.mark_read(request)
+        self.client.get(reverse("drf_messages:messages-list"), dict(level_tag="warning"))
+        response = self.client.delete(reverse("drf_messages:messages-detail", args=(first.pk,)))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertIn((self.user.pk, MessageStats.TAG, "b", 1, 1), self.get_stats())
+        self.assertIn((self.user.pk, MessageStats.LEVEL, str(messages.WARNING), 1, 0), self.get_stats())
+        # incremental statistics match statistics rebuilt from the messages
+        stats = self.get_stats()
+        call_command("messages_rebuild_stats", stdout=StringIO())
+        self.assertEqual(self.get_stats(), stats)
+
+    def test_stats_view(self):
+        MessageFactory.create_batch(3, user=self.user, level=messages.INFO, extra_tags__tag__text="a")
+        MessageFactory(user=self.user, level=messages.ERROR, read_at=timezone.now(), extra_tags__tag__text="b")
+        MessageFactory(level=messages.INFO)
+        call_command("messages_rebuild_stats", "--user", str(self.user.pk), stdout=StringIO())
+
+        with self.assertNumQueries(3):  # session, user, and statistics
+            response = self.client.get(reverse("drf_messages:messages-stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get("levels"), [
+            dict(key=str(messages.INFO), count=3, unread=3),
+            dict(key=str(messages.ERROR), count=1, unread=0),
+        ])
+        self.assertEqual(response.data.get("tags"), [
+            dict(key="a", count=3, unread=3),
+            dict(key="b", count=1, unread=0),
+        ])
+        self.assertEqual(response.data.get("views"), [dict(key="", count=4, unread=3)])
+
+    @override_settings(MESSAGES_STATS=False)
+    def test_stats_disabled(self):
+        response = self.client.get(reverse("drf_messages:messages-stats"))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(MESSAGES_READ_BUFFER_SECONDS=60)
+class ReadBufferTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        read_buffer.flush()
+
+    def test_buffered_reads(self):
+        MessageFactory.create_batch(3, user=self.user, message="Unread message", read_at=None)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('demo:blank'))
+        self.assertContains(response, "Unread message", count=3)
+        self.assertFalse([query for query in queries if query["sql"].startswith("UPDATE")])
+        self.assertEqual(Message.objects.filter(user=self.user, read_at__isnull=True).count(), 3)
+
+        # buffered reads are not shown again
+        self.assertNotContains(self.client.get(reverse('demo:blank')), "Unread message")
+        self.assertEqual(self.client.get(reverse('drf_messages:messages-peek')).data.get("count"), 0)
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(unread=True))
+        self.assertEqual(response.data.get("count"), 0)
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(unread=False))
+        self.assertEqual(response.data.get("count"), 3)
+
+    def test_coalesced_flush(self):
+        messages_ids = [message.pk for message in MessageFactory.create_batch(4, user=self.user, read_at=None)]
+        self.client.get(reverse('drf_messages:messages-detail', args=(messages_ids[0],)))
+        self.client.get(reverse('drf_messages:messages-list'))
+        self.client.get(reverse('demo:blank'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(flush_reads(force=True), 4)
+        self.assertEqual(len([query for query in queries if query["sql"].startswith("UPDATE")]), 1)
+        self.assertFalse(Message.objects.filter(user=self.user, read_at__isnull=True).exists())
+
+    def test_buffered_read_state(self):
+        message = MessageFactory(user=self.user, read_at=None)
+        self.assertIsNone(self.client.get(reverse('drf_messages:messages-detail', args=(message.pk,))).data["read_at"])
+        self.assertIsNotNone(self.client.get(reverse('drf_messages:messages-detail', args=(message.pk,))).data["read_at"])
+        response = self.client.delete(reverse('drf_messages:messages-detail', args=(message.pk,)))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_flush_when_full(self):
+        messages_ids = [message.pk for message in MessageFactory.create_batch(3, user=self.user, read_at=None)]
+        with mock.patch("drf_messages.reads.READ_BUFFER_MAX_SIZE", 2):
+            read_buffer.add("default", self.user.pk, messages_ids[:1])
+            self.assertEqual(read_buffer.size, 1)
+            read_buffer.add("default", self.user.pk, messages_ids[1:])
+        self.assertEqual(read_buffer.size, 0)
+        self.assertFalse(Message.objects.filter(user=self.user, read_at__isnull=True).exists())
+
+    @override_settings(MESSAGES_READ_BUFFER_SECONDS=0.01)
+    def test_flush_when_due(self):
+        MessageFactory(user=self.user, read_at=None)
+        self.client.get(reverse('demo:blank'))
+        self.assertTrue(Message.objects.filter(user=self.user, read_at__isnull=True).exists())
+        time.sleep(0.02)
+        self.client.get(reverse('demo:blank'))
+        self.assertFalse(Message.objects.filter(user=self.user, read_at__isnull=True).exists())
+
+
+@override_settings(MESSAGES_READ_MARKS=True, MESSAGES_STATS=True)
+class ReadMarkTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_mark_all_read(self):
+        MessageFactory.create_batch(3, user=self.user, message="Unread message", read_at=None)
+        call_command("messages_rebuild_stats", stdout=StringIO())
+        request = self.client.get(reverse('drf_messages:messages-peek')).wsgi_request
+        with CaptureQueriesContext(connection) as queries:
+            with DBStorage(request) as storage:
+                self.assertEqual(len(storage), 3)
+        self.assertFalse([query for query in queries if query["sql"].startswith('UPDATE "drf_messages_message"')])
+        self.assertEqual(MessageReadMark.objects.get(user=self.user).last_read_id,
+                         Message.objects.filter(user=self.user).latest("pk").pk)
+
+        self.assertEqual(self.client.get(reverse('drf_messages:messages-peek')).data.get("count"), 0)
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(unread=False))
+        self.assertEqual(response.data.get("count"), 3)
+        self.client.get(reverse('demo:test'))
+        self.assertEqual(self.client.get(reverse('drf_messages:messages-peek')).data.get("count"), 1)
+
+        # statistics count messages below the read mark as read
+        stats = set(MessageStats.objects.values_list("kind", "key", "count", "unread"))
+        call_command("messages_rebuild_stats", stdout=StringIO())
+        self.assertEqual(set(MessageStats.objects.values_list("kind", "key", "count", "unread")), stats)
+
+    def test_read_state_of_read_mark(self):
+        message = MessageFactory(user=self.user, read_at=None)
+        request = self.client.get(reverse('drf_messages:messages-peek')).wsgi_request
+        with DBStorage(request) as storage:
+            list(storage)
+        message.refresh_from_db()
+        self.assertIsNone(message.read_at)
+
+        response = self.client.get(reverse('drf_messages:messages-detail', args=(message.pk,)))
+        self.assertEqual(response.data.get("read_at"),
+                         serializers.DateTimeField().to_representation(MessageReadMark.objects.get().read_at))
+        response = self.client.get(reverse('drf_messages:messages-list'))
+        self.assertIsNotNone(response.data["results"][0].get("read_at"))
+        response = self.client.delete(reverse('drf_messages:messages-detail', args=(message.pk,)))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    @override_settings(MESSAGES_USE_SESSIONS=True)
+    def test_session_scopes(self):
+        other_client = self.client_class()
+        other_client.force_login(self.user)
+        MessageFactory(user=self.user, session_key=self.client.session.session_key, message="First session")
+        MessageFactory(user=self.user, session_key=other_client.session.session_key, message="Second session")
+        MessageFactory(user=self.user, session_key="", message="All sessions")
+
+        self.assertContains(self.client.get(reverse('demo:blank')), "session", count=2)
+        self.assertEqual(MessageReadMark.objects.filter(user=self.user).count(), 2)
+        response = other_client.get(reverse('drf_messages:messages-list'), dict(unread=True))
+        self.assertEqual([message["message"] for message in response.data["results"]], ["Second session"])
+
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command("messages_explain", "--check", stdout=out)
+        # unread messages are a range of the primary key above the read mark
+        self.assertIn("rowid>?", out.getvalue())
+
+
+@override_settings(MESSAGES_STORE="drf_messages.stores.MemoryMessageStore")
+class MemoryStoreTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        MemoryMessageStore.clear()
+
+    def test_storage(self):
+        self.client.get(reverse('demo:test'))
+        self.assertFalse(Message.objects.exists())
+        request = self.client.get(reverse('drf_messages:messages-peek')).wsgi_request
+        storage = DBStorage(request)
+        self.assertEqual(len(storage), 1)
+        self.assertIn("Hello world!", storage)
+        self.assertNotIn(messages.ERROR, storage)
+
+        response = self.client.get(reverse('demo:blank'))
+        self.assertContains(response, "Hello world!")
+        self.assertNotContains(self.client.get(reverse('demo:blank')), "Hello world!")
+        self.assertEqual(len(storage), 0)
+
+    def test_views(self):
+        self.client.get(reverse('demo:test'))
+        self.client.get(reverse('demo:test'))
+        response = self.client.get(reverse('drf_messages:messages-peek'))
+        self.assertEqual(response.data, dict(count=2, max_level=messages.INFO, max_level_tag="info",
+                                              capped=False))
+
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(extra_tags="test", search="hello"))
+        self.assertEqual(response.data.get("count"), 2)
+        self.assertEqual(response.data["results"][0].get("extra_tags"), ["test"])
+        message_id = response.data["results"][0]["id"]
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(unread=True))
+        self.assertEqual(response.data.get("count"), 0)
+
+        response = self.client.get(reverse('drf_messages:messages-detail', args=(message_id,)))
+        self.assertEqual(response.data.get("message"), "Hello world!")
+        response = self.client.delete(reverse('drf_messages:messages-detail', args=(message_id,)))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(reverse('drf_messages:messages-detail', args=(message_id,)))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(reverse('drf_messages:messages-stats'))
+        self.assertEqual(response.data.get("tags"), [dict(key="test", count=1, unread=0)])
+
+    def test_concurrent_add(self):
+        request = self.client.get(reverse('demo:blank')).wsgi_request
+        storage = DBStorage(request)
+
+        def add_messages():
+            for i in range(100):
+                storage.add(messages.INFO, f"Message {i}")
+
+        threads = [threading.Thread(target=add_messages) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(storage), 800)
+        self.assertEqual(len({message.id for message in storage.get_queryset()}), 800)
+
+
+class StoreParityTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        MemoryMessageStore.clear()
+
+    @staticmethod
+    def format_time(value) -> str:
+        return timezone.localtime(value).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def list_messages(self, store: str) -> List[List[str]]:
+        """Add the same messages to a store, and list them using the filter matrix of the messages list view"""
+        with override_settings(MESSAGES_STORE=store):
+            request = self.client.get(reverse("drf_messages:messages-peek")).wsgi_request
+            storage = get_messages(request)
+            start = timezone.now()
+            messages.info(request, "first", extra_tags="a")
+            time.sleep(0.01)
+            middle = timezone.now()
+            time.sleep(0.01)
+            messages.warning(request, "second")
+            messages.error(request, "third", extra_tags="a")
+            storage.store.mark_read([message.pk for message in storage.store.all() if message.text != "second"])
+            time.sleep(0.01)
+            end = timezone.now()
+
+            start, middle, end = map(self.format_time, (start, middle, end))
+            matrix = [
+                {},
+                dict(created_after=middle),
+                dict(created_before=middle),
+                dict(created_after=start, created_before=end, ordering="level"),
+                dict(read_after=start),
+                dict(read_before=middle),
+                dict(read_after=middle, read_before=end, unread="false"),
+                dict(created_after=middle, level_tag="error"),
+                dict(created_before=end, extra_tags="a", ordering="-created"),
+            ]
+            results = []
+            for filters in matrix:
+                request.GET = QueryDict(mutable=True)
+                request.GET.update(filters)
+                view = MessagesViewSet(request=Request(request), action="list", format_kwarg=None, args=(), kwargs={})
+                results.append([message.text for message in view.filter_queryset(view.get_queryset())])
+            return results
+
+    def test_filter_parity(self):
+        results = self.list_messages("drf_messages.stores.DatabaseMessageStore")
+        self.assertEqual(results[1], ["third", "second"])
+        self.assertEqual(results[4], ["third", "first"])
+        self.assertEqual(results[5], [])
+        self.assertEqual(self.list_messages("drf_messages.stores.MemoryMessageStore"), results)
+
+    @override_settings(MESSAGES_STORE="drf_messages.stores.MemoryMessageStore")
+    def test_invalid_range(self):
+        response = self.client.get(reverse("drf_messages:messages-list"), dict(created_after="yesterday"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BroadcastTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+        cls.other = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_broadcast(self):
+        count = Broadcast.objects.create_broadcast([self.user, self.other.pk], "Announcement", messages.INFO,
+                                                   extra_tags="news")
+        self.assertEqual(count, 2)
+        self.assertEqual(Broadcast.objects.count(), 1)
+        self.assertEqual(Tag.objects.filter(text="news").count(), 1)
+        self.assertFalse(Message.objects.exclude(message="").exists())
+        self.assertFalse(MessageTag.objects.exists())
+        self.assertEqual(str(Message.objects.get(user=self.user)), "Announcement")
+
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(extra_tags="news"))
+        self.assertEqual(response.data.get("count"), 1)
+        self.assertEqual(response.data["results"][0].get("message"), "Announcement")
+        self.assertEqual(response.data["results"][0].get("extra_tags"), ["news"])
+
+        # reading is tracked per recipient
+        self.assertEqual(Message.objects.filter(user=self.user).unread().count(), 0)
+        self.assertEqual(Message.objects.filter(user=self.other).unread().count(), 1)
+        self.client.force_login(self.other)
+        response = self.client.get(reverse('demo:blank'))
+        self.assertContains(response, "Announcement")
+
+    def test_tags_order(self):
+        Tag.objects.intern(["news"])
+        Broadcast.objects.create_broadcast([self.user], "Announcement", messages.INFO, extra_tags=["urgent", "news"])
+        self.assertEqual(Message.objects.get(user=self.user).get_django_message().extra_tags, "urgent news")
+
+    @override_settings(MESSAGES_STATS=True)
+    def test_stats(self):
+        Broadcast.objects.create_broadcast([self.user, self.other], "Announcement", messages.INFO, extra_tags="news")
+        self.assertTrue(MessageStats.objects.filter(user=self.user, kind=MessageStats.TAG, key="news").exists())
+        stats = set(MessageStats.objects.values_list("user_id", "kind", "key", "count", "unread"))
+        call_command("messages_rebuild_stats", stdout=StringIO())
+        self.assertEqual(set(MessageStats.objects.values_list("user_id", "kind", "key", "count", "unread")), stats)
+
+    @override_settings(MESSAGES_STATS=True, MESSAGES_PURGE_BATCH_SIZE=1)
+    def test_delete_broadcast(self):
+        Broadcast.objects.create_broadcast([self.user, self.other], "Announcement", messages.INFO, extra_tags="news")
+        Broadcast.objects.create_broadcast([self.user], "Maintenance", messages.INFO)
+        count, deleted = Broadcast.objects.get(message="Announcement").delete()
+        self.assertEqual(deleted.get(Message._meta.label), 2)
+        self.assertEqual(list(Message.objects.values_list("user_id", flat=True)), [self.user.pk])
+        self.assertFalse(MessageStats.objects.filter(kind=MessageStats.TAG, key="news", count__gt=0).exists())
+
+        _, deleted = Broadcast.objects.all().delete()
+        self.assertEqual(deleted.get(Message._meta.label), 1)
+        self.assertFalse(Message.objects.exists())
+
+    def test_delete_orphans(self):
+        Broadcast.objects.create_broadcast([self.user, self.other], "Announcement", messages.INFO)
+        Message.objects.filter(user=self.user).delete()
+        self.assertEqual(Broadcast.objects.delete_orphans(), 0)
+        Message.objects.filter(user=self.other).delete()
+        out = StringIO()
+        call_command("messages_sweep", stdout=out)
+        self.assertIn("Deleted 1 broadcasts without recipients.", out.getvalue())
+        self.assertFalse(Broadcast.objects.exists())
+
+
+class PeekCapTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+        MessageFactory.create_batch(5, user=cls.user, level=messages.INFO)
+        MessageFactory(user=cls.user, level=messages.ERROR)
+        MessageFactory(user=cls.user, level=50, read_at=timezone.now())
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_cap_parameter(self):
+        response = self.client.get(reverse('drf_messages:messages-peek'), dict(cap=3))
+        self.assertEqual(response.data, dict(count=3, max_level=messages.ERROR, max_level_tag="error", capped=True))
+        response = self.client.get(reverse('drf_messages:messages-peek'), dict(cap=6))
+        self.assertEqual(response.data, dict(count=6, max_level=messages.ERROR, max_level_tag="error", capped=False))
+        response = self.client.get(reverse('drf_messages:messages-peek'), dict(cap="many"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(MESSAGES_PEEK_COUNT_CAP=2)
+    def test_cap_setting(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('drf_messages:messages-peek'), dict(cap=10))
+        self.assertEqual(response.data.get("count"), 2)
+        self.assertTrue(response.data.get("capped"))
+        self.assertIn("LIMIT 3", "".join(query["sql"] for query in queries))
+
+    def test_no_unread(self):
+        Message.objects.filter(user=self.user).update(read_at=timezone.now())
+        response = self.client.get(reverse('drf_messages:messages-peek'), dict(cap=3))
+        self.assertEqual(response.data, dict(count=0, max_level=None, max_level_tag="", capped=False))
+
+
+class SeverityTopTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+        now = timezone.now()
+        cls.old_error = MessageFactory(user=cls.user, level=messages.ERROR, message="old error")
+        cls.info = MessageFactory(user=cls.user, level=messages.INFO, message="info")
+        cls.warning = MessageFactory(user=cls.user, level=messages.WARNING, message="warning")
+        cls.new_error = MessageFactory(user=cls.user, level=messages.ERROR, message="new error")
+        MessageFactory(user=cls.user, level=50, message="read", read_at=now)
+        for minutes, message in enumerate((cls.old_error, cls.info, cls.warning, cls.new_error)):
+            Message.objects.filter(pk=message.pk).update(created=now - timedelta(minutes=10 - minutes))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.request = self.client.get(reverse('drf_messages:messages-peek')).wsgi_request
+
+    def test_storage_top(self):
+        storage = DBStorage(self.request)
+        self.assertEqual([message.message for message in storage.top(3)], ["new error", "old error", "warning"])
+        self.assertTrue(storage.used)
+        self.assertEqual([message.message for message in DBStorage(self.request)], ["info"])
+
+    @override_settings(MESSAGES_CONSUME_EXACTLY_ONCE=True)
+    def test_storage_top_consume(self):
+        self.assertEqual([message.message for message in DBStorage(self.request).top(2)], ["new error", "old error"])
+        self.assertEqual(len(DBStorage(self.request)), 2)
+
+    @override_settings(MESSAGES_STORE="drf_messages.stores.MemoryMessageStore")
+    def test_memory_store_top(self):
+        try:
+            storage = DBStorage(self.request)
+            for level in (messages.ERROR, messages.INFO, messages.ERROR):
+                storage.add(level, f"level {level}")
+            self.assertEqual([message.level for message in storage.top(2)], [messages.ERROR, messages.ERROR])
+            self.assertEqual(len(storage), 1)
+        finally:
+            MemoryMessageStore.clear()
+
+    def test_ordering_view(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('drf_messages:messages-list'), dict(ordering="-level", unread=True))
+        self.assertEqual([message["message"] for message in response.data["results"]],
+                         ["new error", "old error", "warning", "info"])
+        self.assertIn('ORDER BY "drf_messages_message"."level" DESC, "drf_messages_message"."created" DESC',
+                      "".join(query["sql"] for query in queries))
+
+    def test_explain(self):
+        out = StringIO()
+        call_command("messages_explain", "--check", stdout=out)
+        plan = out.getvalue().split("== storage top (default) ==")[1].split("==")[0]
+        self.assertIn("drf_messages_unread_severity", plan)
+        self.assertNotIn("TEMP:", plan)
+
+
+class QueryBudgetMixin:
+    """Assert the number of queries made by an operation, reporting the captured SQL when over budget"""
+
+    @staticmethod
+    def normalize_sql(sql: str) -> str:
+        # values differ between runs, keep only the shape of the query
+        return re.sub(r"\b\d+\b", "?", re.sub(r"'[^']*'", "?", sql))
+
+    @contextmanager
+    def assertQueryBudget(self, budget: int, label: str, baseline: List[str] = None):  # pylint: disable=invalid-name
+        """
+        Assert that the block makes no more queries than its budget.
+        :param budget: Maximum number of queries.
+        :param label: Name of the operation, shown on failure.
+        :param baseline: SQL of the same operation within budget (e.g. with less data), diffed on failure.
+        :return: Context of the captured queries.
+        """
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        if len(context) > budget:
+            queries = [self.normalize_sql(query["sql"]) for query in context.captured_queries]
+            if baseline is not None:
+                report = difflib.unified_diff([self.normalize_sql(sql) for sql in baseline], queries,
+                                              "baseline", label, lineterm="")
+            else:
+                report = (f"{index}. {sql}" for index, sql in enumerate(queries, 1))
+            self.fail(f"{label} made {len(context)} queries, over its budget of {budget}:\n" + "\n".join(report))
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    # number of messages of the user, the budgets must not grow with it
+    SIZES = (1, 10, 50)
+    # budgets include loading the session and the user of API requests
+    BUDGETS = {
+        "storage add": 6,
+        "storage iter": 3,
+        "storage len": 1,
+        "storage contains": 1,
+        "storage getitem": 3,
+        "storage update": 0,
+        "list": 6,
+        "list fields": 5,
+        "retrieve": 4,
+        "destroy": 6,
+        "peek": 3,
+        "stats": 2,
+        "filter unread": 6,
+        "filter level_tag": 6,
+        "filter extra_tags": 6,
+        "filter view": 3,
+        "filter read": 5,
+        "filter created": 6,
+        "search": 6,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.request = self.client.get(reverse('demo:blank')).wsgi_request
+        self.read_message = None
+
+    def get_operations(self):
+        storage = DBStorage(self.request)
+        list_url = reverse('drf_messages:messages-list')
+        return {
+            "storage add": lambda: storage.add(messages.INFO, "Hello world!", extra_tags="test"),
+            # list() would call len() first
+            "storage iter": lambda: [message for message in storage],
+            "storage len": lambda: len(storage),
+            "storage contains": lambda: "Hello world!" in storage,
+            "storage getitem": lambda: storage[0],
+            "storage update": lambda: storage.update(HttpResponse()),
+            "list": lambda: self.client.get(list_url),
+            "list fields": lambda: self.client.get(list_url, dict(fields="id,level,message")),
+            "retrieve": lambda: self.client.get(reverse('drf_messages:messages-detail', args=(self.read_message.pk,))),
+            "destroy": lambda: self.client.delete(reverse('drf_messages:messages-detail',
+                                                          args=(self.read_message.pk,))),
+            "peek": lambda: self.client.get(reverse('drf_messages:messages-peek')),
+            "stats": lambda: self.client.get(reverse('drf_messages:messages-stats')),
+            "filter unread": lambda: self.client.get(list_url, dict(unread=True)),
+            "filter level_tag": lambda: self.client.get(list_url, dict(level_tag="info")),
+            "filter extra_tags": lambda: self.client.get(list_url, dict(extra_tags="tag")),
+            "filter view": lambda: self.client.get(list_url, dict(view="demo:index")),
+            "filter read": lambda: self.client.get(list_url, dict(read_after="2020-01-01T00:00:00")),
+            "filter created": lambda: self.client.get(list_url, dict(created_after="2020-01-01T00:00:00")),
+            "search": lambda: self.client.get(list_url, dict(search="hello")),
+        }
+
+    def create_messages(self, size: int):
+        session_key = self.request.session.session_key if messages_settings.MESSAGES_USE_SESSIONS else ""
+        MessageFactory.create_batch(size, user=self.user, session_key=session_key, message="Hello world!",
+                                    extra_tags__tag__text="tag")
+        self.read_message = MessageFactory(user=self.user, session_key=session_key, read_at=timezone.now())
+
+    def assert_budgets(self):
+        baselines = {}
+        for size in self.SIZES:
+            for name, operation in self.get_operations().items():
+                with self.subTest(operation=name, size=size), transaction.atomic():
+                    self.create_messages(size)
+                    with self.assertQueryBudget(self.BUDGETS[name], f"{name} ({size} messages)",
+                                                baselines.get(name)) as context:
+                        operation()
+                    baselines.setdefault(name, [query["sql"] for query in context.captured_queries])
+                    transaction.set_rollback(True)
+
+    @override_settings(MESSAGES_USE_SESSIONS=False)
+    def test_budgets(self):
+        self.assert_budgets()
+
+    @override_settings(MESSAGES_USE_SESSIONS=True)
+    def test_budgets_with_sessions(self):
+        self.assert_budgets()
+
+
+class MessageDataTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_stored(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT data FROM drf_messages_message WHERE id = %s", [message.pk])
+            return bytes(cursor.fetchone()[0])
+
+    def test_create_with_data(self):
+        request = self.client.get(reverse('demo:blank')).wsgi_request
+        message = Message.objects.create_message(request, "Order shipped", messages.INFO, data={"order": 17})
+        Message.objects.create_user_message(self.user, "No data", messages.INFO)
+        DBStorage(request).add(messages.INFO, "Invoice ready", data={"links": ["/invoices/3/"]})
+        with drf_messages.batch(request):
+            DBStorage(request).add(messages.INFO, "Batched", data=[1, 2])
+
+        message.refresh_from_db()
+        self.assertEqual(message.data, {"order": 17})
+        self.assertEqual(self.get_stored(message)[:1], RAW_PAYLOAD)
+        self.assertEqual(dict(Message.objects.values_list("message", "data")), {
+            "Order shipped": {"order": 17}, "No data": None, "Invoice ready": {"links": ["/invoices/3/"]},
+            "Batched": [1, 2],
+        })
+
+    @override_settings(MESSAGES_PAYLOAD_COMPRESS_SIZE=100)
+    def test_compressed_data(self):
+        data = {"items": [{"id": i, "url": f"/items/{i}/"} for i in range(50)]}
+        message = Message.objects.create_user_message(self.user, "Large", messages.INFO, data=data)
+        stored = self.get_stored(message)
+        self.assertEqual(stored[:1], COMPRESSED_PAYLOAD)
+        self.assertLess(len(stored), len(json.dumps(data)))
+        self.assertEqual(Message.objects.get(pk=message.pk).data, data)
+
+    def test_deferred_data(self):
+        message = Message.objects.create_user_message(self.user, "Order shipped", messages.INFO, data={"order": 17})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('drf_messages:messages-list'))
+        self.assertNotIn("data", response.data["results"][0])
+        self.assertFalse([query for query in queries if '"drf_messages_message"."data"' in query["sql"]])
+
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(fields="data"))
+        self.assertEqual(response.data["results"][0].get("data"), {"order": 17})
+        response = self.client.get(reverse('drf_messages:messages-detail', args=(message.pk,)))
+        self.assertEqual(response.data.get("data"), {"order": 17})
+
+    @override_settings(MESSAGES_STORE="drf_messages.stores.MemoryMessageStore")
+    def test_memory_store(self):
+        request = self.client.get(reverse('demo:blank')).wsgi_request
+        DBStorage(request).add(messages.INFO, "Order shipped", data={"order": 17})
+        try:
+            response = self.client.get(reverse('drf_messages:messages-list'), dict(fields="data"))
+            self.assertEqual(response.data["results"][0].get("data"), {"order": 17})
+        finally:
+            MemoryMessageStore.clear()
+
+
+class SparseFieldsTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.message = MessageFactory(user=self.user, message="Hello world!", level=messages.INFO,
+                                      extra_tags__tag__text="test")
+
+    def test_list_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('drf_messages:messages-list'), dict(fields="id,level,message"))
+        self.assertEqual(response.data["results"], [dict(id=self.message.pk, level=messages.INFO,
+                                                         message="Hello world!")])
+        sql = "".join(query["sql"] for query in queries)
+        self.assertNotIn("drf_messages_tag", sql)
+        self.assertNotIn('"drf_messages_message"."view"', sql)
+        self.message.refresh_from_db()
+        self.assertIsNotNone(self.message.read_at)
+
+    def test_tags_and_broadcast_fields(self):
+        Broadcast.objects.create_broadcast([self.user], "Announcement", messages.WARNING, extra_tags="news")
+        response = self.client.get(reverse('drf_messages:messages-list'),
+                                   dict(fields="message,extra_tags", ordering="level"))
+        self.assertEqual(response.data["results"], [
+            dict(message="Hello world!", extra_tags=["test"]),
+            dict(message="Announcement", extra_tags=["news"]),
+        ])
+
+    def test_retrieve_fields(self):
+        url = reverse('drf_messages:messages-detail', args=(self.message.pk,))
+        response = self.client.get(url, dict(fields="level_tag"))
+        self.assertEqual(response.data, dict(level_tag="info"))
+        self.message.refresh_from_db()
+        self.assertIsNotNone(self.message.read_at)
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse('drf_messages:messages-list'), dict(fields="id,user"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("user", str(response.data.get("fields")))
+        for fields in (",", "", "bogus"):
+            response = self.client.get(reverse('drf_messages:messages-list'), dict(fields=fields))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn("extra_tags", str(response.data.get("fields")))
+        url = reverse('drf_messages:messages-detail', args=(self.message.pk,))
+        self.assertEqual(self.client.get(url, dict(fields="bogus")).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(MESSAGES_STORE="drf_messages.stores.MemoryMessageStore")
+    def test_memory_store(self):
+        self.client.get(reverse('demo:test'))
+        try:
+            response = self.client.get(reverse('drf_messages:messages-list'), dict(fields="message,extra_tags"))
+            self.assertEqual(response.data["results"], [dict(message="Hello world!", extra_tags=["test"])])
+        finally:
+            MemoryMessageStore.clear()
+
+
+@override_settings(MESSAGES_CONSUME_EXACTLY_ONCE=True)
+class ExactlyOnceTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.request = self.client.get(reverse('demo:blank')).wsgi_request
+
+    def test_storage_claims_before_showing(self):
+        MessageFactory.create_batch(3, user=self.user)
+        storage = DBStorage(self.request)
+        next(iter(storage))
+        # all messages are marked read before the first one is shown
+        self.assertFalse(Message.objects.filter(read_at__isnull=True).exists())
+        self.assertEqual(list(DBStorage(self.request)), [])
+
+    def test_storage_getitem(self):
+        first, second = MessageFactory.create_batch(2, user=self.user, read_at=None)
+        storage = DBStorage(self.request)
+        self.assertEqual(storage[0].message, second.message)
+        self.assertEqual(len(storage), 1)
+        self.assertEqual(storage[:5][0].message, first.message)
+        self.assertEqual(len(storage), 0)
+
+    def test_claim_once(self):
+        messages_ids = [message.pk for message in MessageFactory.create_batch(3, user=self.user)]
+        store = DatabaseMessageStore(self.request)
+        self.assertEqual(store.claim(messages_ids[:2]), set(messages_ids[:2]))
+        self.assertEqual(store.claim(messages_ids), {messages_ids[2]})
+        self.assertEqual(store.claim(messages_ids), set())
+
+    def test_claim_single_update(self):
+        messages_ids = [message.pk for message in MessageFactory.create_batch(3, user=self.user)]
+        Message.objects.filter(pk=messages_ids[1]).update(read_at=timezone.now())
+        with CaptureQueriesContext(connection) as context:
+            claimed = Message.objects.filter(user=self.user).order_by("pk").claim()
+        self.assertEqual(claimed, [messages_ids[0], messages_ids[2]])
+        self.assertEqual(len([query for query in context.captured_queries if query["sql"].startswith("UPDATE")]), 1)
+
+    def test_claim_skip_locked(self):
+        messages_ids = [message.pk for message in MessageFactory.create_batch(3, user=self.user)]
+        # SQLite ignores select_for_update, the locking path runs without the FOR UPDATE clause
+        with mock.patch.object(connection.features, "has_select_for_update_skip_locked", True):
+            store = DatabaseMessageStore(self.request)
+            self.assertEqual(store.claim(messages_ids[:2]), set(messages_ids[:2]))
+            self.assertEqual(store.claim(messages_ids), {messages_ids[2]})
+            self.assertEqual(store.claim(messages_ids), set())
+        self.assertFalse(Message.objects.filter(pk__in=messages_ids, read_at__isnull=True).exists())
+
+    def test_list_skips_messages_claimed_elsewhere(self):
+        unread = MessageFactory(user=self.user)
+        read = MessageFactory(user=self.user, read_at=timezone.now())
+        with mock.patch.object(DatabaseMessageStore, "claim", return_value=set()):
+            response = self.client.get(reverse('drf_messages:messages-list'))
+        self.assertEqual([message["id"] for message in response.data["results"]], [read.pk])
+
+        response = self.client.get(reverse('drf_messages:messages-list'))
+        self.assertEqual({message["id"] for message in response.data["results"]}, {unread.pk, read.pk})
+        unread.refresh_from_db()
+        self.assertIsNotNone(unread.read_at)
+
+    @override_settings(MESSAGES_STATS=True)
+    def test_stats(self):
+        Message.objects.create_user_message(self.user, "first", messages.INFO, extra_tags="a")
+        Message.objects.create_user_message(self.user, "second", messages.ERROR, extra_tags="a")
+        list(DBStorage(self.request))
+        stats = set(MessageStats.objects.values_list("user_id", "kind", "key", "count", "unread"))
+        self.assertIn((self.user.pk, MessageStats.TAG, "a", 2, 0), stats)
+        call_command("messages_rebuild_stats", stdout=StringIO())
+        self.assertEqual(set(MessageStats.objects.values_list("user_id", "kind", "key", "count", "unread")), stats)
+
+    @override_settings(MESSAGES_STORE="drf_messages.stores.MemoryMessageStore")
+    def test_memory_store(self):
+        try:
+            self.client.get(reverse('demo:test'))
+            self.client.get(reverse('demo:test'))
+            storage = DBStorage(self.client.get(reverse('drf_messages:messages-peek')).wsgi_request)
+            self.assertEqual([message.message for message in storage[:1]], ["Hello world!"])
+            self.assertEqual(len(storage), 1)
+            self.assertEqual(len(list(storage)), 1)
+            self.assertEqual(len(storage), 0)
+        finally:
+            MemoryMessageStore.clear()
+
+
+def consume_worker(user_id: int, results) -> None:
+    """Worker process of the stress test, consuming the messages of a user until none are left"""
+    request = RequestFactory().get("/")
+    request.user = get_user_model()(pk=user_id)
+    consumed = []
+    while True:
+        batch = [message.message for message in DBStorage(request)]
+        if not batch:
+            break
+        consumed.extend(batch)
+    connections["stress"].close()
+    results.put(consumed)
+
+
+@override_settings(MESSAGES_CONSUME_EXACTLY_ONCE=True, MESSAGES_DATABASE="stress", MESSAGES_MAX_DISPLAY=10)
+class ExactlyOnceStressTestCase(TransactionTestCase):
+    # messages are stored in a file-backed database, shared by all worker processes
+    databases = {"default", "stress"}
+    WORKERS = 4
+    MESSAGES = 400
+
+    def test_parallel_consumers(self):
+        user = UserFactory()
+        Message.objects.using("stress").bulk_create(
+            Message(user_id=user.pk, message=f"Message {i}", level=messages.INFO) for i in range(self.MESSAGES))
+        # connections must not be shared with the forked processes
+        connections["stress"].close()
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        workers = [context.Process(target=consume_worker, args=(user.pk, results)) for _ in range(self.WORKERS)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        consumed = [results.get(timeout=60) for _ in workers]
+        elapsed = time.monotonic() - started
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+        shown = [text for worker_consumed in consumed for text in worker_consumed]
+        drf_messages.logger.info(f"{self.WORKERS} processes consumed {len(shown)} messages in {elapsed:.2f}s "
+                                 f"({len(shown) / elapsed:.0f} messages per second)")
+        # no message is lost, and no message is shown twice
+        self.assertEqual(sorted(shown), sorted(f"Message {i}" for i in range(self.MESSAGES)))
+        self.assertFalse(Message.objects.using("stress").filter(read_at__isnull=True).exists())
+
+
+@override_settings(MESSAGES_DATABASE="messages")
+class MessagesDatabaseTestCase(TransactionTestCase):
+    databases = {"default", "messages"}
+
+    @classmethod
+    def setUpClass(cls):
+        super(MessagesDatabaseTestCase, cls).setUpClass()
+        # recreate the messages database as migrated by the router, without the tables of users and sessions
+        connections["messages"].close()
+        os.remove(connections["messages"].settings_dict["NAME"])
+        call_command("migrate", database="messages", verbosity=0)
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+
+    def test_migrate(self):
+        tables = set(connections["messages"].introspection.table_names())
+        self.assertIn(Message._meta.db_table, tables)
+        self.assertIn(MessageTag._meta.db_table, tables)
+        self.assertNotIn(get_user_model()._meta.db_table, tables)
+        self.assertNotIn(Session._meta.db_table, tables)
+
+    def test_storage(self):
+        self.client.get(reverse('demo:test'))
+        self.assertFalse(Message.objects.using("default").exists())
+        message = Message.objects.using("messages").get(user_id=self.user.pk)
+        self.assertEqual(message.get_django_message().extra_tags, "test")
+        # related users and sessions are loaded from the default database
+        self.assertEqual(message.user, self.user)
+        self.assertEqual(message.session.session_key, self.client.session.session_key)
+        self.assertEqual(list(self.user.messages.all()), [message])
+
+        response = self.client.get(reverse('demo:blank'))
+        self.assertContains(response, "Hello world!")
+        self.assertEqual(Message.objects.using("messages").get().read_at is not None, True)
+
+    def test_views(self):
+        Message.objects.create_user_message(self.user, "Hello", messages.INFO, extra_tags="a")
+        response = self.client.get(reverse('drf_messages:messages-peek'))
+        self.assertEqual(response.data.get("count"), 1)
+        response = self.client.get(reverse('drf_messages:messages-list'))
+        self.assertEqual(response.data["results"][0].get("extra_tags"), ["a"])
+        pk = response.data["results"][0].get("id")
+        response = self.client.delete(reverse('drf_messages:messages-detail', kwargs=dict(pk=pk)))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Message.objects.using("messages").exists())
+
+    def test_admin(self):
+        Message.objects.create_user_message(self.user, "Hello admin", messages.INFO)
+        self.client.force_login(AdminFactory())
+        response = self.client.get(reverse("admin:drf_messages_message_changelist"))
+        self.assertContains(response, "Hello admin")
+        self.assertContains(response, str(self.user))
+        message = Message.objects.using("messages").get()
+        response = self.client.get(reverse("admin:drf_messages_message_change", args=(message.pk,)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_purge_deleted_user(self):
+        Message.objects.create_user_message(self.user, "Hello", messages.INFO)
+        self.user.delete()
+        self.assertFalse(Message.objects.using("messages").exists())
@@ -91,9 +91,39 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': str(os.path.join(BASE_DIR, "db.sqlite3")),
-    }
+    },
+    # stands in for a read replica, used only when MESSAGES_READ_DB is set
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(os.path.join(BASE_DIR, "db.replica.sqlite3")),
+    },
+    # messages shards, used only when MESSAGES_SHARDS is set
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(os.path.join(BASE_DIR, "db.shard_1.sqlite3")),
+    },
+    'shard_2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(os.path.join(BASE_DIR, "db.shard_2.sqlite3")),
+    },
+    # file-backed even in tests, shared by the worker processes of the exactly-once consumption stress test
+    'stress': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(os.path.join(BASE_DIR, "db.stress.sqlite3")),
+        'TEST': {'NAME': str(os.path.join(BASE_DIR, "db.stress.test.sqlite3"))},
+    },
+    # dedicated messages database, used only when MESSAGES_DATABASE is set (file-backed as a separate SQLite file)
+    'messages': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(os.path.join(BASE_DIR, "db.messages.sqlite3")),
+        'TEST': {'NAME': str(os.path.join(BASE_DIR, "db.messages.test.sqlite3"))},
+    },
 }
 
+DATABASE_ROUTERS = [
+    'drf_messages.routers.MessagesRouter',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -204,3 +234,4 @@ SESSION_REDIS = {
 }
 
 MESSAGE_STORAGE = "drf_messages.storage.DBStorage"
+MESSAGES_SEARCH_BACKEND = "drf_messages.search.SQLiteSearchBackend"